@@ -0,0 +1,191 @@
+import os
+import time
+import platform
+import argparse
+import subprocess
+from os import path
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+from src.utils.logging import log_info, log_warning
+from src.utils.manifest import load_manifest, save_manifest
+from src.utils.instrumentation import get_memory_mb, reset_peak_memory
+from src.synthetic_data import generate_synthetic_data, DEFAULT_SEED, DEFAULT_CHUNK_SIZE
+from src.step_2_load_and_process_data import load_and_process_data, process_df
+from src.step_3_train_and_evaluate_model import train_and_evaluate_df, read_model_columns
+from src.step_4_generate_report import generate_report, generate_drift_metrics
+
+STEPS = ['process_df', 'train_and_evaluate_df', 'generate_drift_metrics', 'generate_report']
+NUM_FEATURES = ['passenger_count', 'trip_distance', 'fare_amount', 'total_amount']
+CAT_FEATURES = ['PULocationID', 'DOLocationID']
+TARGET = 'duration_min'
+DATA_MANIFEST_FILENAME = '.benchmark_data.json'
+
+def get_commit() -> str:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True, check=True).stdout.strip()
+        return f'{commit}-dirty' if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def prepare_data(data_dir: str, n_rows: int, seed: int = DEFAULT_SEED, drift: float = 0.5, chunk_size: int = DEFAULT_CHUNK_SIZE) -> dict:
+    '''
+    Generates a reference month without drift and a current month with drift, and preprocesses both. Data of a
+    previous benchmark with the same parameters is reused, so repeated runs only measure the steps.
+    Args:
+        data_dir (str): Directory for the benchmark data.
+        n_rows (int): Number of rows per month.
+        seed (int, optional): Random seed. Defaults to DEFAULT_SEED.
+        drift (float, optional): Drift magnitude of the current month. Defaults to 0.5.
+        chunk_size (int, optional): Number of rows generated at a time. Defaults to DEFAULT_CHUNK_SIZE.
+    Returns:
+        dict: Paths of the raw and processed reference and current files.
+    '''
+    size_dir = path.join(data_dir, f'rows_{n_rows}')
+    raw_dir, processed_dir = path.join(size_dir, 'raw'), path.join(size_dir, 'processed')
+    manifest_path = path.join(size_dir, DATA_MANIFEST_FILENAME)
+    params = {'n_rows': n_rows, 'seed': seed, 'drift': drift, 'chunk_size': chunk_size}
+    manifest = load_manifest(manifest_path)
+    if manifest.get('params') == params and all(path.exists(file) for file in manifest.get('raw', [])):
+        raw_files = manifest['raw']
+    else:
+        raw_files = generate_synthetic_data(raw_dir, n_rows, months=2, seed=seed, drift=drift, chunk_size=chunk_size)
+        save_manifest(manifest_path, {'params': params, 'raw': raw_files})
+    # Cached by the preprocessing manifest, like in the pipeline
+    load_and_process_data(raw_dir, processed_dir, ['.parquet'])
+    processed_files = [path.join(processed_dir, f'processed_{path.splitext(path.basename(file))[0]}.parquet') for file in raw_files]
+    return {'reference_raw': raw_files[0], 'current_raw': raw_files[1], 'reference': processed_files[0], 'current': processed_files[1]}
+
+def load_scored_frames(data: dict) -> tuple[pd.DataFrame, pd.DataFrame]:
+    features = NUM_FEATURES + CAT_FEATURES
+    reference = read_model_columns(data['reference'], features, TARGET)
+    current = read_model_columns(data['current'], features, TARGET)
+    model = LinearRegression().fit(reference[features].astype(np.float64), reference[TARGET])
+    reference['prediction'] = model.predict(reference[features])
+    current['prediction'] = model.predict(current[features])
+    return reference.drop(columns=TARGET), current.drop(columns=TARGET)
+
+def run_step(step: str, data: dict) -> dict:
+    '''
+    Runs one step on the benchmark data and measures it. Intended to run in a fresh process, so the peak RSS belongs
+    to this step only. Inputs are loaded before the clock starts, and the memory of the step is its peak RSS above
+    the RSS with the inputs loaded.
+    Args:
+        step (str): One of STEPS.
+        data (dict): Paths of the benchmark data, see prepare_data.
+    Returns:
+        dict: Rows, wall time, rows per second, RSS with the inputs loaded, peak RSS and memory of the step in MiB.
+    Throws:
+        ValueError: If the step is unknown.
+    '''
+    features = NUM_FEATURES + CAT_FEATURES
+    if step == 'process_df':
+        df = pd.read_parquet(data['reference_raw'])
+        rows = len(df)
+        function = lambda: process_df(df)
+    elif step == 'train_and_evaluate_df':
+        df = read_model_columns(data['reference'], features, TARGET)
+        rows = len(df)
+        function = lambda: train_and_evaluate_df(df, features, TARGET)
+    elif step in ('generate_drift_metrics', 'generate_report'):
+        reference, current = load_scored_frames(data)
+        rows = len(reference) + len(current)
+        engine = generate_drift_metrics if step == 'generate_drift_metrics' else generate_report
+        function = lambda: engine(reference, current, NUM_FEATURES, CAT_FEATURES)
+    else:
+        raise ValueError(f'Unknown step: {step}')
+    reset_peak_memory()
+    input_rss_mb, _ = get_memory_mb()
+    start = time.perf_counter()
+    function()
+    wall_s = time.perf_counter() - start
+    _, peak_rss_mb = get_memory_mb()
+    return {'step': step, 'rows': rows, 'wall_s': wall_s, 'rows_per_s': rows / wall_s, 'input_rss_mb': input_rss_mb, 'peak_rss_mb': peak_rss_mb, 'step_rss_mb': peak_rss_mb - input_rss_mb}
+
+def run_benchmarks(data_dir: str, sizes: list[int], steps: list[str] = STEPS, repeat: int = 3, seed: int = DEFAULT_SEED, drift: float = 0.5) -> dict:
+    '''
+    Benchmarks each step on synthetic data of each size. Every run is a fresh process, and the fastest of the
+    repeated runs is reported to reduce noise.
+    Args:
+        data_dir (str): Directory for the benchmark data.
+        sizes (list[int]): Number of rows per month to benchmark, e.g. [100_000, 1_000_000].
+        steps (list[str], optional): Steps to benchmark. Defaults to STEPS.
+        repeat (int, optional): Number of runs per step and size. Defaults to 3.
+        seed (int, optional): Random seed. Defaults to DEFAULT_SEED.
+        drift (float, optional): Drift magnitude of the current month. Defaults to 0.5.
+    Returns:
+        dict: The environment and a result per size and step, with the wall times of all runs.
+    '''
+    results = []
+    for n_rows in sizes:
+        data = prepare_data(data_dir, n_rows, seed=seed, drift=drift)
+        for step in steps:
+            runs = []
+            for _ in range(repeat):
+                # spawn, so no memory of the parent or of previous runs is inherited
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                    runs.append(executor.submit(run_step, step, data).result())
+            best = min(runs, key=lambda run: run['wall_s'])
+            result = {**best, 'n_rows': n_rows, 'wall_s_runs': [run['wall_s'] for run in runs], 'peak_rss_mb': max(run['peak_rss_mb'] for run in runs), 'step_rss_mb': max(run['step_rss_mb'] for run in runs)}
+            results.append(result)
+            log_info(f'{step} on {n_rows} rows: {result["wall_s"]:.3f}s ({result["rows_per_s"]:.0f} rows/s), peak RSS {result["peak_rss_mb"]:.0f} MiB, {result["step_rss_mb"]:.1f} MiB above the loaded inputs')
+    return {
+        'commit': get_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': seed,
+        'drift': drift,
+        'repeat': repeat,
+        'results': results,
+    }
+
+def compare_results(baseline: dict, current: dict) -> list[dict]:
+    '''
+    Compares the results of two benchmark runs, e.g. of two commits, per size and step.
+    Args:
+        baseline (dict): Results of the baseline run, as returned by run_benchmarks.
+        current (dict): Results of the current run.
+    Returns:
+        list[dict]: Speedup (baseline wall time / current wall time) and change of the step memory in MiB per size and step present in both.
+    '''
+    baseline_results = {(result['n_rows'], result['step']): result for result in baseline['results']}
+    comparison = []
+    for result in current['results']:
+        previous = baseline_results.get((result['n_rows'], result['step']))
+        if previous is None:
+            continue
+        comparison.append({
+            'n_rows': result['n_rows'],
+            'step': result['step'],
+            'speedup': previous['wall_s'] / result['wall_s'],
+            'step_rss_change_mb': result['step_rss_mb'] - previous['step_rss_mb'],
+        })
+    return comparison
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline steps on synthetic taxi data.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000], help='Numbers of rows per month to benchmark, e.g. 100000 1000000.')
+    parser.add_argument('--steps', type=str, nargs='+', default=STEPS, choices=STEPS, help='Steps to benchmark.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs per step and size, the fastest is reported.')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='Random seed of the synthetic data.')
+    parser.add_argument('--drift', type=float, default=0.5, help='Drift magnitude of the current month, between 0 and 1.')
+    parser.add_argument('--data_dir', type=str, default='data/benchmark', help='Directory for the synthetic data, reused between runs.')
+    parser.add_argument('--output_path', type=str, default='reports/benchmark.json', help='Where to save the results as JSON.')
+    parser.add_argument('--baseline', type=str, help='Results of a previous run to compare with, e.g. of another commit.')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.data_dir, args.sizes, steps=args.steps, repeat=args.repeat, seed=args.seed, drift=args.drift)
+    save_manifest(args.output_path, results)
+    log_info(f'Benchmark results saved to {args.output_path}')
+    if args.baseline:
+        baseline = load_manifest(args.baseline)
+        if not baseline:
+            log_warning(f'No baseline results in {args.baseline}')
+        for comparison in compare_results(baseline, results) if baseline else []:
+            log_info(f'{comparison["step"]} on {comparison["n_rows"]} rows: {comparison["speedup"]:.2f}x speedup, step memory {comparison["step_rss_change_mb"]:+.1f} MiB compared to {baseline.get("commit")}')
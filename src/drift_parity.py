@@ -0,0 +1,142 @@
+import sys
+import argparse
+import warnings
+import pandas as pd
+from datetime import datetime, timezone
+from src.utils.logging import log_info, log_error
+from src.utils.manifest import save_manifest
+from src.utils.drift import DEFAULT_THRESHOLDS, DEFAULT_DRIFT_SHARE, STATTEST_COLUMN_TYPES
+from src.synthetic_data import DEFAULT_SEED
+from src.benchmark import prepare_data, load_scored_frames, get_commit, NUM_FEATURES, CAT_FEATURES
+from src.step_4_generate_report import compare_with_evidently, compare_dataset_with_evidently
+
+# Stattests compared besides the default selection. The z-test is not forced, it only applies to binary columns
+STATTESTS = ['wasserstein', 'ks', 'psi', 'jensenshannon', 'chisquare']
+# Maximum absolute score difference per stattest. The native engine works on binned reference profiles, so distances
+# and p-values are close to Evidently's but not identical
+TOLERANCES = {
+    'wasserstein': 0.01,
+    'psi': 0.05,
+    'jensenshannon': 0.05,
+    'ks': 0.05,
+    'chisquare': 0.01,
+    'z': 0.01,
+}
+P_VALUE_STATTESTS = ['ks', 'chisquare', 'z']
+# P-values above this cap mean no drift for any usual threshold, so their differences are not compared
+P_VALUE_CAP = 0.2
+
+def check_parity(comparison: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Checks a comparison of the native drift engine with Evidently against the tolerances. Scores must differ by at most
+    the tolerance of the stattest, p-values up to P_VALUE_CAP. Drift detection must agree unless Evidently's score is
+    within the tolerance of the threshold, where a small score difference can flip the detection.
+    Args:
+        comparison (pd.DataFrame): Per column comparison, see compare_with_evidently.
+    Returns:
+        pd.DataFrame: The comparison with the tolerance, the compared difference and whether the column is borderline and passes.
+    '''
+    comparison = comparison.copy()
+    comparison['tolerance'] = comparison['stattest'].map(TOLERANCES)
+    cap = comparison['stattest'].isin(P_VALUE_STATTESTS).map({True: P_VALUE_CAP, False: float('inf')})
+    comparison['compared_diff'] = (comparison['evidently_score'].clip(upper=cap) - comparison['native_score'].clip(upper=cap)).abs()
+    comparison['borderline'] = (comparison['evidently_score'] - comparison['threshold']).abs() <= comparison['tolerance']
+    same_drift = comparison['evidently_drift'] == comparison['native_drift']
+    comparison['passed'] = (comparison['compared_diff'] <= comparison['tolerance']) & (same_drift | comparison['borderline'])
+    return comparison
+
+def check_dataset_parity(comparison: dict, borderline_columns: int, drift_share: float = DEFAULT_DRIFT_SHARE) -> dict:
+    '''
+    Checks a dataset comparison of the native drift engine with Evidently. Both engines must count the same columns
+    and missing values. The number of drifted columns may differ by at most the number of borderline columns, whose
+    detection may flip, see check_parity, and the dataset drift must agree unless these flips can cross the drift share.
+    Args:
+        comparison (dict): Dataset comparison, see compare_dataset_with_evidently.
+        borderline_columns (int): Number of borderline columns of the same comparison, see check_parity.
+        drift_share (float, optional): Share of drifted columns above which the dataset is considered drifted. Defaults to DEFAULT_DRIFT_SHARE.
+    Returns:
+        dict: The comparison with the number of borderline columns and whether the dataset drift is borderline and passes.
+    '''
+    comparison = {**comparison, 'borderline_columns': int(borderline_columns)}
+    same_columns = all(comparison[f'evidently_{name}'] == comparison[f'native_{name}'] for name in ['columns', 'reference_columns', 'current_columns'])
+    same_missing = all(comparison[f'evidently_{data}_missing'] == comparison[f'native_{data}_missing'] for data in ['reference', 'current'])
+    drifted_diff = abs(comparison['evidently_drifted_columns'] - comparison['native_drifted_columns'])
+    comparison['borderline'] = abs(comparison['evidently_share'] - drift_share) * comparison['evidently_columns'] <= borderline_columns
+    same_drift = comparison['evidently_drift'] == comparison['native_drift']
+    comparison['passed'] = bool(same_columns and same_missing and drifted_diff <= borderline_columns and (same_drift or comparison['borderline']))
+    return comparison
+
+def run_parity_checks(data_dir: str, n_rows: int, sample_sizes: list[int], seed: int = DEFAULT_SEED, drift: float = 0.5) -> tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    Compares the native drift engine with Evidently on synthetic data, with and without drift. The reference month is
+    compared with the drifted month, and its even rows with its odd rows. Each sample size is run with the default
+    stattest selection, which differs for samples up to 1000 rows, and with each stattest of STATTESTS. Columns are
+    compared on the scored model columns, and with the default selection also on the raw months, whose missing values
+    are spread over columns that are not profiled. The dataset drift and missing values are compared for each
+    selection that applies to all columns.
+    Args:
+        data_dir (str): Directory for the synthetic data, shared with the benchmark.
+        n_rows (int): Number of rows per month.
+        sample_sizes (list[int]): Numbers of rows sampled from the reference and current data.
+        seed (int, optional): Random seed of the synthetic data. Defaults to DEFAULT_SEED.
+        drift (float, optional): Drift magnitude of the current month. Defaults to 0.5.
+    Returns:
+        tuple[pd.DataFrame, pd.DataFrame]: Per data, scenario, sample size, stattest and column, the comparison and whether it passed, see check_parity, and the same per dataset, see check_dataset_parity.
+    '''
+    data = prepare_data(data_dir, n_rows, seed=seed, drift=drift)
+    reference, current = load_scored_frames(data)
+    reference_raw, current_raw = pd.read_parquet(data['reference_raw']), pd.read_parquet(data['current_raw'])
+    frames = {
+        'scored': {'drift': (reference, current), 'no_drift': (reference.iloc[::2], reference.iloc[1::2])},
+        'raw': {'drift': (reference_raw, current_raw), 'no_drift': (reference_raw.iloc[::2], reference_raw.iloc[1::2])},
+    }
+    comparisons, dataset_comparisons = [], []
+    for data_name, scenarios in frames.items():
+        for scenario, (reference_data, current_data) in scenarios.items():
+            for sample_size in sample_sizes:
+                for stattest in [None] + (STATTESTS if data_name == 'scored' else []):
+                    labels = {'data': data_name, 'scenario': scenario, 'sample_size': sample_size, 'selection': stattest or 'default'}
+                    with warnings.catch_warnings():
+                        # Evidently warns about deprecated pandas behaviour on every report
+                        warnings.simplefilter('ignore')
+                        comparison = check_parity(compare_with_evidently(reference_data, current_data, NUM_FEATURES, CAT_FEATURES, sample_size=sample_size, stattest=stattest))
+                        if stattest is None or set(STATTEST_COLUMN_TYPES[stattest]) == {'num', 'cat'}:
+                            dataset_comparison = compare_dataset_with_evidently(reference_data, current_data, NUM_FEATURES, CAT_FEATURES, sample_size=sample_size, stattest=stattest)
+                            dataset_comparisons.append({**labels, **check_dataset_parity(dataset_comparison, comparison['borderline'].sum())})
+                    for position, (name, value) in enumerate(labels.items()):
+                        comparison.insert(position, name, value)
+                    comparisons.append(comparison)
+    return pd.concat(comparisons, ignore_index=True), pd.DataFrame(dataset_comparisons)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that the native drift engine agrees with Evidently on synthetic taxi data.')
+    parser.add_argument('--n_rows', type=int, default=100_000, help='Number of rows per month of the synthetic data.')
+    parser.add_argument('--sample_sizes', type=int, nargs='+', default=[1000, 30_000], help='Numbers of rows compared, samples up to 1000 rows use other default stattests.')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='Random seed of the synthetic data.')
+    parser.add_argument('--drift', type=float, default=0.5, help='Drift magnitude of the current month, between 0 and 1.')
+    parser.add_argument('--data_dir', type=str, default='data/benchmark', help='Directory for the synthetic data, shared with the benchmark.')
+    parser.add_argument('--output_path', type=str, default='reports/drift_parity.json', help='Where to save the comparison as JSON.')
+    args = parser.parse_args()
+
+    results, dataset_results = run_parity_checks(args.data_dir, args.n_rows, args.sample_sizes, seed=args.seed, drift=args.drift)
+    summary = results.groupby('stattest').agg(columns=('passed', 'size'), failed=('passed', lambda passed: int((~passed).sum())), max_compared_diff=('compared_diff', 'max'), tolerance=('tolerance', 'first'))
+    log_info(f'Drift parity between Evidently and the native engine:\n{summary.to_string()}')
+    dataset_columns = ['data', 'scenario', 'sample_size', 'selection', 'evidently_share', 'native_share', 'evidently_current_missing', 'native_current_missing', 'passed']
+    log_info(f'Dataset drift and missing values of both engines:\n{dataset_results[dataset_columns].to_string(index=False)}')
+    save_manifest(args.output_path, {
+        'commit': get_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'thresholds': DEFAULT_THRESHOLDS,
+        'tolerances': TOLERANCES,
+        'results': results.to_dict(orient='records'),
+        'dataset_results': dataset_results.to_dict(orient='records'),
+    })
+    log_info(f'Drift parity results saved to {args.output_path}')
+    failed = results[~results['passed']]
+    if not failed.empty:
+        log_error(f'{len(failed)} columns differ from Evidently beyond the tolerance:\n{failed.to_string(index=False)}')
+    failed_datasets = dataset_results[~dataset_results['passed']]
+    if not failed_datasets.empty:
+        log_error(f'{len(failed_datasets)} dataset comparisons differ from Evidently:\n{failed_datasets.to_string(index=False)}')
+    if not failed.empty or not failed_datasets.empty:
+        sys.exit(1)
@@ -0,0 +1,131 @@
+import json
+import time
+import argparse
+import http.client
+from multiprocessing import Pool
+from urllib.parse import urlsplit
+import numpy as np
+import pandas as pd
+from src.utils.logging import log_info
+from src.utils.manifest import save_manifest
+
+DEFAULT_FEATURES = ['passenger_count', 'trip_distance', 'fare_amount', 'total_amount', 'PULocationID', 'DOLocationID']
+
+def sample_records(data_path: str = None, features: list[str] = DEFAULT_FEATURES, n_records: int = 10_000, seed: int = 42) -> list[dict]:
+    '''
+    Samples request records from processed data, or generates plausible random records if no data is given.
+    Args:
+        data_path (str, optional): Processed parquet file or dataset to sample from. Defaults to None.
+        features (list[str], optional): Feature names of the records. Defaults to DEFAULT_FEATURES.
+        n_records (int, optional): Number of records. Defaults to 10_000.
+        seed (int, optional): Random seed. Defaults to 42.
+    Returns:
+        list[dict]: The records.
+    '''
+    if data_path:
+        df = pd.read_parquet(data_path, columns=features).dropna()
+        df = df.sample(n=min(n_records, len(df)), random_state=seed)
+    else:
+        rng = np.random.default_rng(seed)
+        df = pd.DataFrame({
+            'passenger_count': rng.integers(1, 5, n_records),
+            'trip_distance': rng.gamma(2.0, 1.5, n_records).round(2),
+            'fare_amount': rng.gamma(3.0, 5.0, n_records).round(2),
+            'total_amount': rng.gamma(3.0, 7.0, n_records).round(2),
+            'PULocationID': rng.integers(1, 266, n_records),
+            'DOLocationID': rng.integers(1, 266, n_records),
+        })[features]
+    # Plain Python numbers, so the records serialize to JSON
+    return json.loads(df.to_json(orient='records'))
+
+def run_client(url: str, records: list[dict], duration: float, records_per_request: int, client_id: int) -> tuple[list[float], int]:
+    '''
+    Sends requests over one keep-alive connection until the duration has elapsed. Runs in a worker process.
+    Args:
+        url (str): Base URL of the scoring service.
+        records (list[dict]): Records to send, used round-robin.
+        duration (float): Seconds to send requests for.
+        records_per_request (int): Number of records per request.
+        client_id (int): Index of the client, used to offset the records.
+    Returns:
+        tuple[list[float], int]: The latency in seconds of each successful request and the number of failed requests.
+    '''
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    bodies = [json.dumps(records[i:i + records_per_request]).encode() for i in range(0, len(records) - records_per_request + 1, records_per_request)]
+    headers = {'Content-Type': 'application/json'}
+    latencies, errors = [], 0
+    i = client_id
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        body = bodies[i % len(bodies)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            connection.request('POST', '/predict', body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    connection.close()
+    return latencies, errors
+
+def run_load_test(url: str, records: list[dict], concurrency: int = 16, duration: float = 10.0, records_per_request: int = 1, warmup: float = 1.0) -> dict:
+    '''
+    Runs concurrent clients against the scoring service and reports throughput and latency percentiles.
+    Each client is a separate process with its own connection, so the generator itself is not limited by the GIL.
+    Args:
+        url (str): Base URL of the scoring service, e.g. 'http://localhost:8000'.
+        records (list[dict]): Records to send.
+        concurrency (int, optional): Number of concurrent clients. Defaults to 16.
+        duration (float, optional): Seconds to measure for. Defaults to 10.0.
+        records_per_request (int, optional): Number of records per request. Defaults to 1.
+        warmup (float, optional): Seconds of unmeasured requests before the measurement. Defaults to 1.0.
+    Returns:
+        dict: Requests and records per second, error count and latency percentiles in milliseconds.
+    '''
+    with Pool(concurrency) as pool:
+        if warmup > 0:
+            pool.starmap(run_client, [(url, records, warmup, records_per_request, i) for i in range(concurrency)])
+        start = time.perf_counter()
+        results = pool.starmap(run_client, [(url, records, duration, records_per_request, i) for i in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    latencies = np.concatenate([np.asarray(latencies) for latencies, _ in results]) * 1000
+    errors = sum(errors for _, errors in results)
+    percentiles = np.percentile(latencies, [50, 90, 99, 99.9]) if len(latencies) else [float('nan')] * 4
+    return {
+        'url': url,
+        'concurrency': concurrency,
+        'records_per_request': records_per_request,
+        'duration_s': elapsed,
+        'requests': int(len(latencies)),
+        'errors': int(errors),
+        'requests_per_s': len(latencies) / elapsed,
+        'records_per_s': len(latencies) * records_per_request / elapsed,
+        'latency_ms': {'mean': float(latencies.mean()) if len(latencies) else float('nan'), 'p50': float(percentiles[0]), 'p90': float(percentiles[1]), 'p99': float(percentiles[2]), 'p999': float(percentiles[3]), 'max': float(latencies.max()) if len(latencies) else float('nan')},
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure throughput and latency percentiles of the scoring service.')
+    parser.add_argument('--url', type=str, default='http://localhost:8000', help='Base URL of the scoring service.')
+    parser.add_argument('--data_path', type=str, help='Processed parquet file or dataset to sample request records from. Random records are used if omitted.')
+    parser.add_argument('--concurrency', type=int, default=16, help='Number of concurrent clients.')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to measure for.')
+    parser.add_argument('--warmup', type=float, default=1.0, help='Seconds of unmeasured requests before the measurement.')
+    parser.add_argument('--records_per_request', type=int, default=1, help='Number of records per request.')
+    parser.add_argument('--n_records', type=int, default=10_000, help='Number of distinct records to send.')
+    parser.add_argument('--output_path', type=str, help='Where to save the results as JSON.')
+    args = parser.parse_args()
+
+    records = sample_records(args.data_path, n_records=args.n_records)
+    results = run_load_test(args.url, records, concurrency=args.concurrency, duration=args.duration, records_per_request=args.records_per_request, warmup=args.warmup)
+    log_info(f'{results["requests_per_s"]:.0f} requests/s ({results["records_per_s"]:.0f} records/s), {results["errors"]} errors, latency p50 {results["latency_ms"]["p50"]:.2f} ms, p99 {results["latency_ms"]["p99"]:.2f} ms')
+    if args.output_path:
+        save_manifest(args.output_path, results)
+        log_info(f'Load test results saved to {args.output_path}')
@@ -1,58 +1,280 @@
 import os
+import json
+import argparse
+import threading
 from os import path
+from concurrent.futures import Executor, ProcessPoolExecutor
+import joblib
 import pandas as pd
+import requests
 from src.utils.logging import log_info
-from src.step_1_download_data import download_files
-from src.step_2_load_and_process_data import load_and_process_data
-from src.step_3_train_and_evaluate_model import train_and_evaluate
-from src.step_4_generate_report import generate_report
+from src.step_1_download_data import download_file, record_download, create_session, DEFAULT_CHUNK_SIZE, MANIFEST_FILENAME as DOWNLOAD_MANIFEST_FILENAME
+from src.step_2_load_and_process_data import load_and_process_data, get_preprocessing_params, is_output_complete, DATETIME_COLUMNS, DEFAULT_COLUMNS, DEFAULT_BATCH_SIZE, DEFAULT_ROW_GROUP_SIZE, MANIFEST_FILENAME as PREPROCESS_MANIFEST_FILENAME
+from src.step_3_train_and_evaluate_model import iter_train_and_evaluate, train_and_evaluate_df, train_streaming, read_model_columns, list_processed_sources, DEFAULT_BATCH_SIZE as TRAIN_BATCH_SIZE
+from src.step_4_generate_report import generate_report, generate_drift_metrics, get_reference_profile, DEFAULT_N_BINS
+
+from src.utils.manifest import load_manifest
+from src.utils.pipeline import Task, run_pipeline
+from src.utils.instrumentation import log_summary
+from src.utils.metrics_sink import MetricsSink, create_metrics_sink, drift_metric_rows
+from sklearn.metrics import mean_absolute_error
+from datetime import datetime, timezone
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def run_step4_generate_report(train_data: pd.DataFrame, val_data: pd.DataFrame, num_features: list[str], cat_features: list[str], report_path: str) -> None:
+def run_step4_generate_report(train_data: pd.DataFrame, val_data: pd.DataFrame, num_features: list[str], cat_features: list[str], report_path: str, engine: str = 'evidently', save_html: bool = True, model_path: str = None, n_bins: int = DEFAULT_N_BINS, sink: MetricsSink = None) -> dict:
     log_info('ℹ️ Starting Step 4: Generate Report')
-    report = generate_report(train_data, val_data, num_features, cat_features)
     os.makedirs(path.dirname(report_path), exist_ok=True)
-    report.save_html(report_path)
-    log_info(f'✅ Completed Step 4: Generate Report. Report saved to {report_path}')
+    metrics = None
+    if engine == 'native' or sink is not None:
+        # The reference profile is cached next to the model, so the reference side is only computed once per model
+        reference_profile = get_reference_profile(model_path, num_features, cat_features, reference_data=train_data, n_bins=n_bins) if model_path else None
+        metrics = generate_drift_metrics(train_data, val_data, num_features, cat_features, n_bins=n_bins, reference_profile=reference_profile)
+        if sink is not None:
+            drift_rows, missing_rows = drift_metric_rows(metrics, datetime.now(timezone.utc), model=path.basename(model_path) if model_path else None)
+            sink.write('drift_metrics', drift_rows)
+            sink.write('missing_metrics', missing_rows)
+        metrics_path = f'{path.splitext(report_path)[0]}.json'
+        with open(metrics_path, 'w') as file:
+            json.dump(metrics, file, indent=2)
+        log_info(f'Drift metrics saved to {metrics_path}: {metrics["dataset_drift"]["number_of_drifted_columns"]}/{metrics["dataset_drift"]["number_of_columns"]} columns drifted')
+    if engine != 'native' or save_html:
+        report = generate_report(train_data, val_data, num_features, cat_features)
+        report.save_html(report_path)
+        log_info(f'Report saved to {report_path}')
+    log_info('✅ Completed Step 4: Generate Report')
+    return metrics
+
+def load_evaluation_frames(processed_data_dir: str, source: str, model, features: list[str], target: str, valid_file_formats: list[str], split: str = 'random') -> tuple[pd.DataFrame, pd.DataFrame, pd.Series, pd.Series]:
+    '''
+    Scores the training and validation split of one processed file or dataset month with a fitted model, without refitting it.
+    Args:
+        processed_data_dir (str): Directory where processed data files are stored.
+        source (str): Name of the file or dataset month, see list_processed_sources.
+        model: The fitted model.
+        features (list[str]): List of feature column names.
+        target (str): Target variable column name.
+        valid_file_formats (list[str]): List of valid file formats.
+        split (str, optional): 'random' or 'hash', see train_and_evaluate_df. Defaults to 'random'.
+    Returns:
+        tuple[pd.DataFrame, pd.DataFrame, pd.Series, pd.Series]: Training features, validation features (both with predictions), training target, validation target.
+    '''
+    sources = {name: (file_path, partition_filters) for name, file_path, partition_filters in list_processed_sources(processed_data_dir, valid_file_formats)}
+    file_path, partition_filters = sources[source]
+    df = read_model_columns(file_path, features, target, filters=partition_filters)
+    _, X_train, X_val, y_train, y_val = train_and_evaluate_df(df, features, target, model=model, fit=False, split=split)
+    return X_train, X_val, y_train, y_val
 
-def run_step3_train_and_evaluate_model(processed_data_dir: str, models_dir: str, features: list[str], target: str, valid_file_formats: list[str], base_model_path: str = None) -> tuple[pd.DataFrame, pd.DataFrame]:
+def run_step3_train_and_evaluate_model(processed_data_dir: str, models_dir: str, features: list[str], target: str, valid_file_formats: list[str], base_model_path: str = None, engine: str = 'per_file', batch_size: int = TRAIN_BATCH_SIZE, split: str = 'random', sink: MetricsSink = None) -> tuple[pd.DataFrame, pd.DataFrame, str, str]:
     log_info('ℹ️ Starting Step 3: Train and Evaluate Model')
-    _, results = train_and_evaluate(processed_data_dir, models_dir, features, target, base_model_path=base_model_path, valid_file_formats=valid_file_formats)
-    _, _, _, X_train, X_val, y_train, y_val = results[-1]
+    timestamp = datetime.now(timezone.utc)
+    if engine == 'streaming':
+        # Fit once over all files without their hash-based validation rows, then evaluate on that split of the most recent
+        # file. A shuffled split cannot be reproduced batch by batch, so the streaming engine always uses the hash split
+        model_filename, model, _ = train_streaming(processed_data_dir, models_dir, features, target, batch_size=batch_size, valid_file_formats=valid_file_formats, validation_ratio=0.2)
+        last_file = list_processed_sources(processed_data_dir, valid_file_formats)[-1][0]
+        X_train, X_val, y_train, y_val = load_evaluation_frames(processed_data_dir, last_file, model, features, target, valid_file_formats, split='hash')
+        if sink is not None:
+            sink.write('model_metrics', [
+                {'timestamp': timestamp, 'model': model_filename, 'file': last_file, 'metric': 'train_mae', 'value': mean_absolute_error(y_train, X_train['prediction']), 'n_rows': len(X_train)},
+                {'timestamp': timestamp, 'model': model_filename, 'file': last_file, 'metric': 'val_mae', 'value': mean_absolute_error(y_val, X_val['prediction']), 'n_rows': len(X_val)},
+            ])
+    else:
+        # Only the frames of the most recent file are kept for the report
+        last_result = None
+        for result in iter_train_and_evaluate(processed_data_dir, models_dir, features, target, base_model_path=base_model_path, valid_file_formats=valid_file_formats, keep_frames=True, split=split):
+            log_info(f'{result.file}: training MAE {result.train_mae:.2f}, validation MAE {result.val_mae:.2f}')
+            if sink is not None:
+                sink.write('model_metrics', [
+                    {'timestamp': timestamp, 'model': result.model_filename, 'file': result.file, 'metric': 'train_mae', 'value': result.train_mae, 'n_rows': result.n_train},
+                    {'timestamp': timestamp, 'model': result.model_filename, 'file': result.file, 'metric': 'val_mae', 'value': result.val_mae, 'n_rows': result.n_val},
+                ])
+            last_result = result
+        X_train, X_val, model_filename, last_file = last_result.X_train, last_result.X_val, last_result.model_filename, last_result.file
     log_info('✅ Completed Step 3: Train and Evaluate Model')
-    return (X_train, X_val)
+    return (X_train, X_val, path.join(models_dir, model_filename), last_file)
+
+def download_task(url: str, raw_data_dir: str, session: requests.Session, slots: threading.Semaphore, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Task:
+    '''
+    Creates the pipeline task that downloads one file. It always runs, but download_file skips files that match the
+    remote ETag/Last-Modified and size, so an unchanged file only costs a HEAD request.
+    Args:
+        url (str): The URL of the file.
+        raw_data_dir (str): Directory where raw data files are saved.
+        session (requests.Session): Session shared by all downloads.
+        slots (threading.Semaphore): Limits the number of concurrent downloads.
+        chunk_size (int, optional): Size in bytes of the chunks written to disk. Defaults to DEFAULT_CHUNK_SIZE.
+    Returns:
+        Task: The download task, named 'download:<file>'.
+    '''
+    file = path.basename(url)
+
+    def download(_: dict) -> dict:
+        manifest_entry = load_manifest(path.join(raw_data_dir, DOWNLOAD_MANIFEST_FILENAME)).get(file)
+        with slots:
+            entry = download_file(url, raw_data_dir, session=session, chunk_size=chunk_size, manifest_entry=manifest_entry)
+        record_download(raw_data_dir, entry)
+        if not entry['skipped']:
+            log_info(f'Successfully downloaded {url} to {raw_data_dir}')
+        # The result feeds the cache key of the preprocessing task, so leave out the flag that differs between runs
+        return {key: value for key, value in entry.items() if key != 'skipped'}
+
+    # As in step 1, a failed download does not stop the other files
+    return Task(f'download:{file}', download, optional=True)
 
-def run_step2_preprocess_data(raw_data_dir: str, processed_data_dir: str, valid_file_formats: list):
-    log_info('ℹ️ Starting Step 2: Preprocess Data')
-    load_and_process_data(raw_data_dir, processed_data_dir, valid_file_formats)
-    log_info('✅ Completed Step 2: Preprocess Data')
-    
+def preprocess_task(file: str, raw_data_dir: str, processed_data_dir: str, valid_file_formats: list[str], deps: list[str] = [], executor: Executor = None, **kwargs) -> Task:
+    '''
+    Creates the pipeline task that preprocesses one raw file. The task is skipped if the raw file and the preprocessing
+    parameters are unchanged and its outputs exist.
+    Args:
+        file (str): Name of the raw file.
+        raw_data_dir (str): Directory where raw data files are stored.
+        processed_data_dir (str): Directory where processed data files are saved.
+        valid_file_formats (list[str]): List of valid file formats.
+        deps (list[str], optional): Tasks to wait for, i.e. the download of the file. Defaults to [].
+        executor (Executor, optional): Process pool shared by the preprocessing tasks. The file is processed in the task thread if None. Defaults to None.
+        **kwargs: Preprocessing options passed to load_and_process_data (streaming, batch_size, columns, compact, partitioned, row_group_size).
+    Returns:
+        Task: The preprocessing task, named 'preprocess:<file>'.
+    '''
+    file_path = path.join(raw_data_dir, file)
+    params = get_preprocessing_params(kwargs.get('columns', DEFAULT_COLUMNS), kwargs.get('compact', True), kwargs.get('partitioned', False), kwargs.get('row_group_size', DEFAULT_ROW_GROUP_SIZE))
 
-def run_step1_download_data(data_urls: list[str], raw_data_dir: str):
-    log_info('ℹ️ Starting Step 1: Download Data')
-    download_files(data_urls, raw_data_dir)
-    log_info('✅ Completed Step 1: Download Data')
+    def key() -> dict:
+        # Size and modification time are enough here, step 2 compares content hashes when the file is processed
+        stat = os.stat(file_path)
+        return {'file': file, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'params': params}
 
-def main():
-    data_urls = [url.strip() for url in os.getenv('DATASET_URLS', '').split(',')]
+    def preprocess(_: dict) -> dict:
+        summaries = load_and_process_data(raw_data_dir, processed_data_dir, valid_file_formats, files=[file], executor=executor, **kwargs)
+        if not summaries:
+            raise ValueError(f'Unsupported file format: {file}')
+        summary = summaries[0]
+        if summary['error']:
+            raise RuntimeError(summary['error'])
+        return {'output_name': path.basename(summary['output_path']), 'output_files': summary['output_files'], 'rows_in': summary['rows_in'], 'rows_out': summary['rows_out']}
+
+    def is_complete(result: dict) -> bool:
+        entry = load_manifest(path.join(processed_data_dir, PREPROCESS_MANIFEST_FILENAME)).get(result['output_name'], {})
+        return is_output_complete(processed_data_dir, result['output_name'], entry)
+
+    # As in step 2, a file that fails does not stop training on the other files
+    return Task(f'preprocess:{file}', preprocess, deps=deps, key=key, is_complete=is_complete, optional=True)
+
+def main(force: bool = False):
+    data_urls = [url.strip() for url in os.getenv('DATASET_URLS', '').split(',') if url.strip()]
     valid_file_formats = [ext.strip() for ext in os.getenv('VALID_FILE_FORMATS', '.csv,.parquet').split(',')]
     raw_data_dir = os.getenv('RAW_DATA_DIR', 'data/raw')
+    download_workers = int(os.getenv('DOWNLOAD_WORKERS', '4'))
+    download_chunk_size = int(os.getenv('DOWNLOAD_CHUNK_SIZE', str(DEFAULT_CHUNK_SIZE)))
     processed_data_dir = os.getenv('PROCESSED_DATA_DIR', 'data/processed')
+    preprocess_streaming = os.getenv('PREPROCESS_STREAMING', 'false').lower() == 'true'
+    preprocess_batch_size = int(os.getenv('PREPROCESS_BATCH_SIZE', str(DEFAULT_BATCH_SIZE)))
+    preprocess_workers = int(os.getenv('PREPROCESS_WORKERS', '1'))
+    preprocess_columns = [col.strip() for col in os.getenv('PREPROCESS_COLUMNS', '').split(',') if col.strip()]
+    preprocess_compact = os.getenv('PREPROCESS_COMPACT', 'true').lower() == 'true'
+    preprocess_partitioned = os.getenv('PREPROCESS_PARTITIONED', 'false').lower() == 'true'
+    preprocess_row_group_size = int(os.getenv('PREPROCESS_ROW_GROUP_SIZE', str(DEFAULT_ROW_GROUP_SIZE)))
 
     models_dir = os.getenv('MODELS_DIR', 'models')
     num_features = [feat.strip() for feat in os.getenv('MODEL_FEAT_NUM', 'passenger_count,trip_distance,fare_amount,total_amount').split(',')]
     cat_features = [feat.strip() for feat in os.getenv('MODEL_FEAT_CAT', 'PULocationID,DOLocationID').split(',')]
     target = os.getenv('MODEL_TARGET', 'duration_min')
+    training_engine = os.getenv('TRAINING_ENGINE', 'per_file')
+    training_batch_size = int(os.getenv('TRAINING_BATCH_SIZE', str(TRAIN_BATCH_SIZE)))
+    training_split = os.getenv('TRAINING_SPLIT', 'random')
+    if training_engine == 'streaming':
+        # The streaming engine holds out the hash-based validation rows, which are scored again when the model is unchanged
+        training_split = 'hash'
     report_path = os.getenv('REPORT_PATH', 'reports/data_drift_report.html')
+    drift_engine = os.getenv('DRIFT_ENGINE', 'evidently')
+    report_html = os.getenv('REPORT_HTML', 'true').lower() == 'true'
+    drift_n_bins = int(os.getenv('DRIFT_N_BINS', str(DEFAULT_N_BINS)))
+    metrics_sink_url = os.getenv('METRICS_SINK_URL', '')
+    pipeline_state_path = os.getenv('PIPELINE_STATE_PATH', 'data/.pipeline_state.json')
+    pipeline_timings_path = os.getenv('PIPELINE_TIMINGS_PATH', 'reports/pipeline_timings.json')
+    pipeline_workers = int(os.getenv('PIPELINE_WORKERS', '4'))
+    run_metrics_path = os.getenv('RUN_METRICS_PATH', 'reports/run_metrics.json')
+    features = num_features + cat_features
+    if not preprocess_columns:
+        # Only the raw columns the later steps read, so the other columns are never decoded
+        preprocess_columns = DATETIME_COLUMNS + features
+    elif preprocess_columns == ['all']:
+        preprocess_columns = None
+    preprocess_options = {'streaming': preprocess_streaming, 'batch_size': preprocess_batch_size, 'columns': preprocess_columns, 'compact': preprocess_compact, 'partitioned': preprocess_partitioned, 'row_group_size': preprocess_row_group_size}
+
+    # Step 1 and 2: every downloaded file goes straight into its own preprocessing task
+    os.makedirs(raw_data_dir, exist_ok=True)
+    session = create_session(pool_size=download_workers)
+    download_slots = threading.BoundedSemaphore(download_workers)
+    preprocess_executor = ProcessPoolExecutor(max_workers=preprocess_workers) if preprocess_workers > 1 else None
+    tasks = [download_task(url, raw_data_dir, session, download_slots, chunk_size=download_chunk_size) for url in data_urls]
+    downloaded_files = {path.basename(url): f'download:{path.basename(url)}' for url in data_urls}
+    local_files = [file for file in os.listdir(raw_data_dir) if any(file.endswith(ext) for ext in valid_file_formats)]
+    for file in sorted(set(local_files) | set(downloaded_files)):
+        deps = [downloaded_files[file]] if file in downloaded_files else []
+        tasks.append(preprocess_task(file, raw_data_dir, processed_data_dir, valid_file_formats, deps=deps, executor=preprocess_executor, **preprocess_options))
+
+    def remove_orphaned_outputs(_: dict) -> dict:
+        # Outputs of raw files that were removed are not covered by any preprocessing task
+        load_and_process_data(raw_data_dir, processed_data_dir, valid_file_formats, files=[], **preprocess_options)
+        return {}
+
+    tasks.append(Task('remove_orphaned_outputs', remove_orphaned_outputs, optional=True))
+
+    # Step 3: the frames of the last file are handed to step 4 in memory when the model was trained in this run
+    # The metrics sink is opened right before the run, the tasks only use it while they run
+    sink = None
+    evaluation_frames = {}
+
+    def train(_: dict) -> dict:
+        X_train, X_val, model_path, source = run_step3_train_and_evaluate_model(processed_data_dir, models_dir, features, target, valid_file_formats=valid_file_formats, engine=training_engine, batch_size=training_batch_size, split=training_split, sink=sink)
+        evaluation_frames['train_model'] = (X_train, X_val)
+        return {'model_path': model_path, 'source': source}
+
+    def train_key() -> dict:
+        sources = sorted(name for name, _, _ in list_processed_sources(processed_data_dir, valid_file_formats)) if path.isdir(processed_data_dir) else []
+        return {'features': features, 'target': target, 'engine': training_engine, 'batch_size': training_batch_size, 'split': training_split, 'sources': sources}
+
+    preprocess_tasks = [task.name for task in tasks if task.name.startswith('preprocess:') or task.name == 'remove_orphaned_outputs']
+    tasks.append(Task('train_model', train, deps=preprocess_tasks, key=train_key, is_complete=lambda result: path.exists(result['model_path'])))
+
+    # Step 4
+    metrics_path = f'{path.splitext(report_path)[0]}.json'
+
+    def report(results: dict) -> dict:
+        model_path, source = results['train_model']['model_path'], results['train_model']['source']
+        if 'train_model' in evaluation_frames:
+            X_train, X_val = evaluation_frames.pop('train_model')
+        else:
+            # The model is unchanged, score the same split again instead of retraining
+            X_train, X_val, _, _ = load_evaluation_frames(processed_data_dir, source, joblib.load(model_path), features, target, valid_file_formats, split=training_split)
+        run_step4_generate_report(X_train, X_val, num_features, cat_features, report_path, engine=drift_engine, save_html=report_html, model_path=model_path, n_bins=drift_n_bins, sink=sink)
+        outputs = ([metrics_path] if drift_engine == 'native' or sink is not None else []) + ([report_path] if drift_engine != 'native' or report_html else [])
+        return {'outputs': outputs}
+
+    def report_key() -> dict:
+        return {'num_features': num_features, 'cat_features': cat_features, 'report_path': report_path, 'engine': drift_engine, 'html': report_html, 'n_bins': drift_n_bins, 'sink': sink is not None}
+
+    tasks.append(Task('generate_report', report, deps=['train_model'], key=report_key, is_complete=lambda result: all(path.exists(output) for output in result['outputs'])))
 
     # Run the complete pipeline
-    run_step1_download_data(data_urls, raw_data_dir)
-    run_step2_preprocess_data(raw_data_dir, processed_data_dir, valid_file_formats)
-    X_train, X_val = run_step3_train_and_evaluate_model(processed_data_dir, models_dir, num_features + cat_features, target, valid_file_formats=valid_file_formats)
-    run_step4_generate_report(X_train, X_val, num_features, cat_features, report_path)
+    try:
+        sink = create_metrics_sink(metrics_sink_url) if metrics_sink_url else None
+        run_pipeline(tasks, pipeline_state_path, timings_path=pipeline_timings_path, workers=pipeline_workers, force=force)
+    finally:
+        if preprocess_executor is not None:
+            preprocess_executor.shutdown()
+        if sink is not None:
+            sink.close()
+        # Timers, counters and the RSS high-water mark of the hot paths, e.g. download_file and process_df
+        log_summary(run_metrics_path)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Run the complete pipeline, skipping steps whose inputs and parameters are unchanged.')
+    parser.add_argument('--force', action='store_true', help='Run all steps, ignoring the pipeline state.')
+    args = parser.parse_args()
+
+    main(force=args.force)
\ No newline at end of file
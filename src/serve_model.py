@@ -0,0 +1,346 @@
+import json
+import os
+import queue
+import signal
+import threading
+import time
+import argparse
+from os import path
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import joblib
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from sklearn.linear_model import LinearRegression
+from src.utils.logging import log_info, log_warning, log_error
+from src.utils.schema import compact_dtypes
+from src.step_3_train_and_evaluate_model import get_latest_model_path
+
+DEFAULT_MAX_BATCH_SIZE = 512
+DEFAULT_MAX_WAIT_MS = 2.0
+DEFAULT_MAX_QUEUE_SIZE = 10_000
+DEFAULT_RELOAD_INTERVAL = 5.0
+DEFAULT_FLUSH_ROWS = 50_000
+DEFAULT_FLUSH_INTERVAL = 30.0
+DEFAULT_REQUEST_TIMEOUT = 10.0
+
+class ModelStore:
+    '''
+    Holds the latest model of a models directory and swaps in a newer timestamped artifact when one appears.
+    Reloads are only checked every reload_interval seconds, so the directory is not listed on every batch.
+    '''
+    def __init__(self, models_dir: str, model_path: str = None, reload_interval: float = DEFAULT_RELOAD_INTERVAL):
+        self.models_dir = models_dir
+        self.reload_interval = reload_interval
+        # The model, its feature names and its path, swapped as one tuple so readers never see a mix of two models
+        self.current = None
+        self.last_check = time.monotonic()
+        self.reload_lock = threading.Lock()
+        self.load(model_path or get_latest_model_path(models_dir))
+        if self.current is None:
+            raise ValueError(f'No model found in {models_dir}')
+        # A fixed model path is never replaced
+        self.hot_reload = model_path is None
+
+    def load(self, model_path: str) -> bool:
+        '''
+        Loads a model artifact and makes it the current model.
+        Args:
+            model_path (str): Path of the model file.
+        Returns:
+            bool: True if the model was loaded. On failure, e.g. a file that is still being written, the current model is kept.
+        '''
+        if model_path is None:
+            return False
+        try:
+            model = joblib.load(model_path)
+        except Exception as e:
+            log_warning(f'Error loading model from {model_path}: {e}')
+            return False
+        self.current = (model, list(model.feature_names_in_), model_path)
+        log_info(f'Serving model {model_path}')
+        return True
+
+    def get(self) -> tuple[LinearRegression, list[str], str]:
+        '''
+        Returns the current model, reloading it first if a newer artifact appeared since the last check.
+        Returns:
+            tuple[LinearRegression, list[str], str]: The model, its feature names and the name of its file.
+        '''
+        now = time.monotonic()
+        # Only one thread checks for a newer model, the others keep serving the current one meanwhile
+        if self.hot_reload and now - self.last_check >= self.reload_interval and self.reload_lock.acquire(blocking=False):
+            try:
+                self.last_check = now
+                latest_path = get_latest_model_path(self.models_dir)
+                if latest_path is not None and latest_path != self.current[2]:
+                    self.load(latest_path)
+            finally:
+                self.reload_lock.release()
+        model, features, model_path = self.current
+        return model, features, path.basename(model_path)
+
+class PredictionLog:
+    '''
+    Append-only buffer of scored records. A background thread flushes it to parquet part files in batches, so the
+    log can be read as the current dataset of step 4, e.g. with read_processed(predictions_dir).
+    '''
+    def __init__(self, predictions_dir: str, flush_rows: int = DEFAULT_FLUSH_ROWS, flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        self.predictions_dir = predictions_dir
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.frames = []
+        self.rows = 0
+        self.part = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+        os.makedirs(predictions_dir, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, name='prediction-log', daemon=True)
+        self.thread.start()
+
+    def append(self, df: pd.DataFrame) -> None:
+        with self.lock:
+            self.frames.append(df)
+            self.rows += len(df)
+            full = self.rows >= self.flush_rows
+        if full:
+            self.wakeup.set()
+
+    def _run(self) -> None:
+        while not self.stopped:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        '''
+        Writes the buffered records to a new parquet part file.
+        Returns:
+            None
+        '''
+        with self.lock:
+            frames, self.frames, self.rows = self.frames, [], 0
+        if not frames:
+            return
+        timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+        part_path = path.join(self.predictions_dir, f'predictions-{timestamp}-{self.part:05d}.parquet')
+        self.part += 1
+        try:
+            compact_dtypes(pd.concat(frames, ignore_index=True)).to_parquet(f'{part_path}.tmp', index=False)
+            os.replace(f'{part_path}.tmp', part_path)
+        except Exception as e:
+            log_error(f'Error writing predictions to {part_path}: {e}')
+
+    def close(self) -> None:
+        self.stopped = True
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()
+
+class MicroBatcher:
+    '''
+    Combines the records of concurrent requests into one vectorized predict call. The batching thread waits at most
+    max_wait_ms after the first queued request for more requests, or until max_batch_size records are collected.
+    '''
+    def __init__(self, model_store: ModelStore, prediction_log: PredictionLog = None, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE, max_wait_ms: float = DEFAULT_MAX_WAIT_MS, max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE):
+        self.model_store = model_store
+        self.prediction_log = prediction_log
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self.thread.start()
+
+    def submit(self, records: list[dict]) -> Future:
+        '''
+        Queues records for scoring.
+        Args:
+            records (list[dict]): Feature values per record.
+        Returns:
+            Future: Resolves to the list of predictions and the name of the model file.
+        Throws:
+            queue.Full: If the service is overloaded.
+        '''
+        future = Future()
+        self.queue.put_nowait((records, future, time.time()))
+        return future
+
+    def _collect(self) -> list[tuple]:
+        try:
+            items = [self.queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        n_records = len(items[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while n_records < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            items.append(item)
+            n_records += len(item[0])
+        return items
+
+    def _run(self) -> None:
+        while not self.stopped:
+            items = self._collect()
+            if items:
+                self._score(items)
+
+    def _score(self, items: list[tuple]) -> None:
+        try:
+            model, features, model_name = self.model_store.get()
+            records = [record for item in items for record in item[0]]
+            df = pd.DataFrame.from_records(records, columns=features)
+            predictions = model.predict(df)
+        except Exception as e:
+            for _, future, _ in items:
+                future.set_exception(e)
+            return
+        offset = 0
+        for item_records, future, _ in items:
+            future.set_result((predictions[offset:offset + len(item_records)].tolist(), model_name))
+            offset += len(item_records)
+        if self.prediction_log is not None:
+            request_times = np.repeat([received for _, _, received in items], [len(item[0]) for item in items])
+            df['prediction'] = predictions
+            df['model'] = model_name
+            df['request_time'] = pd.to_datetime(request_times, unit='s', utc=True)
+            self.prediction_log.append(df)
+
+    def close(self) -> None:
+        self.stopped = True
+        self.thread.join()
+
+def parse_records(body: bytes, features: list[str]) -> list[dict]:
+    '''
+    Parses and validates the records of a request body.
+    Args:
+        body (bytes): JSON object of one record, a list of records, or {"records": [...]}.
+        features (list[str]): Feature names the model expects.
+    Returns:
+        list[dict]: The records.
+    Throws:
+        ValueError: If the body is not valid JSON or a record misses a feature or has a non-numeric value.
+    '''
+    payload = json.loads(body)
+    if isinstance(payload, dict):
+        payload = payload.get('records', [payload])
+    if not isinstance(payload, list) or not payload:
+        raise ValueError('Expected a record or a non-empty list of records')
+    for record in payload:
+        if not isinstance(record, dict):
+            raise ValueError('Records must be JSON objects')
+        for feature in features:
+            value = record.get(feature)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f'Feature {feature} must be a number, got {value!r}')
+    return payload
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    '''
+    POST /predict scores records, GET /health reports the served model.
+    '''
+    # Keep-alive connections, so clients do not pay a TCP handshake per request
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, with Nagle's algorithm the body would wait for the delayed ACK
+    disable_nagle_algorithm = True
+
+    def _send_json(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            _, _, model_name = self.server.batcher.model_store.get()
+            self._send_json(200, {'status': 'ok', 'model': model_name, 'queue_size': self.server.batcher.queue.qsize()})
+        else:
+            self._send_json(404, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path != '/predict':
+            self._send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        try:
+            _, features, _ = self.server.batcher.model_store.get()
+            records = parse_records(body, features)
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        try:
+            predictions, model_name = self.server.batcher.submit(records).result(timeout=DEFAULT_REQUEST_TIMEOUT)
+        except queue.Full:
+            self._send_json(503, {'error': 'Too many queued requests'})
+            return
+        except Exception as e:
+            self._send_json(500, {'error': f'{type(e).__name__}: {e}'})
+            return
+        self._send_json(200, {'predictions': predictions, 'model': model_name})
+
+    def log_message(self, format, *args):
+        # Per-request access logs would dominate the request latency
+        pass
+
+def serve(models_dir: str, predictions_dir: str, host: str = '0.0.0.0', port: int = 8000, model_path: str = None, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE, max_wait_ms: float = DEFAULT_MAX_WAIT_MS, reload_interval: float = DEFAULT_RELOAD_INTERVAL, flush_rows: int = DEFAULT_FLUSH_ROWS, flush_interval: float = DEFAULT_FLUSH_INTERVAL) -> None:
+    '''
+    Runs the scoring service until interrupted. Predictions are logged to predictions_dir, which step 4 can use as the current dataset.
+    Args:
+        models_dir (str): Directory of the timestamped model artifacts. The latest one is served and newer ones are picked up.
+        predictions_dir (str): Directory of the prediction log.
+        host (str, optional): Address to bind. Defaults to '0.0.0.0'.
+        port (int, optional): Port to listen on. Defaults to 8000.
+        model_path (str, optional): Serve this model instead of the latest one, without hot reloading. Defaults to None.
+        max_batch_size (int, optional): Maximum number of records per predict call. Defaults to DEFAULT_MAX_BATCH_SIZE.
+        max_wait_ms (float, optional): Maximum time a request waits for others to join its batch. Defaults to DEFAULT_MAX_WAIT_MS.
+        reload_interval (float, optional): Seconds between checks for a newer model. Defaults to DEFAULT_RELOAD_INTERVAL.
+        flush_rows (int, optional): Number of logged records that triggers a flush. Defaults to DEFAULT_FLUSH_ROWS.
+        flush_interval (float, optional): Maximum seconds between flushes of the prediction log. Defaults to DEFAULT_FLUSH_INTERVAL.
+    Returns:
+        None
+    '''
+    model_store = ModelStore(models_dir, model_path=model_path, reload_interval=reload_interval)
+    prediction_log = PredictionLog(predictions_dir, flush_rows=flush_rows, flush_interval=flush_interval)
+    batcher = MicroBatcher(model_store, prediction_log, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    server = ThreadingHTTPServer((host, port), ScoringRequestHandler)
+    server.daemon_threads = True
+    server.batcher = batcher
+    if threading.current_thread() is threading.main_thread():
+        # Stop gracefully on SIGTERM too, so the buffered predictions are flushed. shutdown blocks, so call it from another thread.
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    log_info(f'Scoring service listening on {host}:{port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        prediction_log.close()
+        log_info(f'Scoring service stopped, predictions logged to {predictions_dir}')
+
+if __name__ == '__main__':
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Serve the latest model over HTTP, micro-batching concurrent requests and logging predictions for drift monitoring.')
+    parser.add_argument('--models_dir', type=str, default=os.getenv('MODELS_DIR', 'models'), help='Directory of the timestamped model artifacts.')
+    parser.add_argument('--model_path', type=str, help='Serve this model instead of the latest one, without hot reloading.')
+    parser.add_argument('--predictions_dir', type=str, default=os.getenv('PREDICTIONS_DIR', 'data/predictions'), help='Directory of the prediction log.')
+    parser.add_argument('--host', type=str, default='0.0.0.0', help='Address to bind.')
+    parser.add_argument('--port', type=int, default=int(os.getenv('SERVE_PORT', '8000')), help='Port to listen on.')
+    parser.add_argument('--max_batch_size', type=int, default=DEFAULT_MAX_BATCH_SIZE, help='Maximum number of records per predict call.')
+    parser.add_argument('--max_wait_ms', type=float, default=DEFAULT_MAX_WAIT_MS, help='Maximum time a request waits for others to join its batch.')
+    parser.add_argument('--reload_interval', type=float, default=DEFAULT_RELOAD_INTERVAL, help='Seconds between checks for a newer model.')
+    parser.add_argument('--flush_rows', type=int, default=DEFAULT_FLUSH_ROWS, help='Number of logged records that triggers a flush to parquet.')
+    parser.add_argument('--flush_interval', type=float, default=DEFAULT_FLUSH_INTERVAL, help='Maximum seconds between flushes of the prediction log.')
+    args = parser.parse_args()
+
+    serve(args.models_dir, args.predictions_dir, host=args.host, port=args.port, model_path=args.model_path, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms, reload_interval=args.reload_interval, flush_rows=args.flush_rows, flush_interval=args.flush_interval)
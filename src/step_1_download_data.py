@@ -1,58 +1,284 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from tqdm import tqdm
 from os import path
 import os
 import argparse
-from src.utils.logging import log_info, log_error
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from src.utils.logging import log_info, log_error, log_warning
+from src.utils.manifest import load_manifest, save_manifest
+from src.utils.instrumentation import timer, increment
 
-def download_file(url: str, save_dir: str):
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_TIMEOUT = 60
+MANIFEST_FILENAME = '.download_manifest.json'
+PARTIAL_SUFFIX = '.part'
+# Sidecar of a '.part' file with the remote metadata its download was started with
+PARTIAL_METADATA_SUFFIX = '.part.json'
+# Serializes manifest updates of downloads that run in parallel, also across download_files calls
+MANIFEST_LOCK = threading.Lock()
+
+def create_session(pool_size: int = 10, max_retries: int = DEFAULT_MAX_RETRIES) -> requests.Session:
+    '''
+    Creates a requests session with a pooled HTTP adapter that can be shared between download workers.
+    Args:
+        pool_size (int, optional): Maximum number of pooled connections per host. Defaults to 10.
+        max_retries (int, optional): Number of retries for failed connections and retryable status codes. Defaults to DEFAULT_MAX_RETRIES.
+    Returns:
+        requests.Session: The configured session.
+    '''
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['HEAD', 'GET'],
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def get_remote_metadata(url: str, session: requests.Session) -> dict:
+    '''
+    Fetches the ETag, Last-Modified and size of a remote file with a HEAD request.
+    Args:
+        url (str): The URL of the remote file.
+        session (requests.Session): The session used for the request.
+    Returns:
+        dict: The remote metadata. Values are None if the server does not provide them.
+    Throws:
+        HTTPError: If the HTTP request returned an unsuccessful status code.
+    '''
+    response = session.head(url, allow_redirects=True, timeout=DEFAULT_TIMEOUT)
+    response.raise_for_status()
+    content_length = response.headers.get('content-length')
+    return {
+        'etag': response.headers.get('etag'),
+        'last_modified': response.headers.get('last-modified'),
+        'size': int(content_length) if content_length is not None else None,
+    }
+
+def is_up_to_date(file_path: str, manifest_entry: dict, remote_metadata: dict) -> bool:
+    '''
+    Checks whether a local file matches the remote file according to the download manifest.
+    Args:
+        file_path (str): Path to the local file.
+        manifest_entry (dict): The manifest entry recorded when the file was last downloaded.
+        remote_metadata (dict): The current remote metadata, as returned by get_remote_metadata.
+    Returns:
+        bool: True if the local file exists and its ETag/Last-Modified and size match the remote file.
+    '''
+    if not manifest_entry or not path.exists(file_path):
+        return False
+    local_size = path.getsize(file_path)
+    if manifest_entry.get('size') != local_size:
+        return False
+    if remote_metadata.get('size') is not None and remote_metadata['size'] != local_size:
+        return False
+    if remote_metadata.get('etag'):
+        return manifest_entry.get('etag') == remote_metadata['etag']
+    if remote_metadata.get('last_modified'):
+        return manifest_entry.get('last_modified') == remote_metadata['last_modified']
+    # Without validators we can only rely on the size
+    return remote_metadata.get('size') is not None
+
+def is_resumable(partial_metadata: dict, remote_metadata: dict) -> bool:
+    '''
+    Checks whether a partial file was started from the same version of the remote file as the current one.
+    Args:
+        partial_metadata (dict): The remote metadata recorded when the partial file was started.
+        remote_metadata (dict): The current remote metadata, as returned by get_remote_metadata.
+    Returns:
+        bool: True if the partial file has a validator and its ETag, Last-Modified and size match the remote file.
+    '''
+    if not partial_metadata or not (partial_metadata.get('etag') or partial_metadata.get('last_modified')):
+        return False
+    return all(partial_metadata.get(key) == remote_metadata.get(key) for key in ['etag', 'last_modified', 'size'])
+
+def download_file(url: str, save_dir: str, session: requests.Session = None, chunk_size: int = DEFAULT_CHUNK_SIZE, max_retries: int = DEFAULT_MAX_RETRIES, manifest_entry: dict = None) -> dict:
     '''
     Downloads a file from the given URL and saves it to the specified dir.
+    The content is written to a temporary '.part' file which is renamed into place once complete. If a partial file
+    exists and was started from the same version of the remote file, recorded in a '.part.json' sidecar, the download
+    resumes from it with an HTTP Range request. Interrupted transfers are resumed up to max_retries times.
     Args:
         url (str): The URL of the file to download.
         save_dir (str): The directory where the file will be saved.
+        session (requests.Session, optional): A shared session to use. A new one is created if not given. Defaults to None.
+        chunk_size (int, optional): Size in bytes of the chunks written to disk. Defaults to DEFAULT_CHUNK_SIZE.
+        max_retries (int, optional): Number of times an interrupted transfer is resumed. Defaults to DEFAULT_MAX_RETRIES.
+        manifest_entry (dict, optional): The manifest entry of a previous download. If it matches the remote file, the download is skipped. Defaults to None.
     Returns:
-        None
+        dict: The manifest entry for the downloaded file, with an additional 'skipped' flag.
     Throws:
         HTTPError: If the HTTP request returned an unsuccessful status code.
     '''
-    response = requests.get(url, stream=True)
-    response.raise_for_status()
+    if session is None:
+        session = create_session(pool_size=1, max_retries=max_retries)
 
     # make sure the directory exists
     os.makedirs(save_dir, exist_ok=True)
-    file_path = path.join(save_dir, path.basename(url))
+    file_name = path.basename(url)
+    file_path = path.join(save_dir, file_name)
+    part_path = f'{file_path}{PARTIAL_SUFFIX}'
+    partial_metadata_path = f'{file_path}{PARTIAL_METADATA_SUFFIX}'
+
+    with timer('download_file', file=file_name) as fields:
+        remote_metadata = get_remote_metadata(url, session)
+        entry = {'url': url, 'file': file_name, **remote_metadata}
+        if is_up_to_date(file_path, manifest_entry, remote_metadata):
+            log_info(f'Skipping {url}, local file {file_path} is up to date')
+            fields['skipped'] = True
+            increment('downloads_skipped')
+            return {**manifest_entry, 'skipped': True}
+
+        if path.exists(part_path) and not is_resumable(load_manifest(partial_metadata_path), remote_metadata):
+            log_warning(f'Discarding partial download of {url}, the remote file changed or cannot be validated')
+            os.remove(part_path)
+        # The partial file always belongs to the version in the sidecar, so If-Range sends the validator it was started with
+        save_manifest(partial_metadata_path, remote_metadata)
+        validator = remote_metadata['etag'] or remote_metadata['last_modified']
+        expected_size = remote_metadata['size']
+        initial_size = path.getsize(part_path) if path.exists(part_path) else 0
+        attempt = 0
+        while True:
+            offset = path.getsize(part_path) if path.exists(part_path) else 0
+            if expected_size is not None and offset == expected_size:
+                break
+            if expected_size is not None and offset > expected_size:
+                os.remove(part_path)
+                offset = initial_size = 0
 
-    with open(file_path, 'wb') as file:
-        for chunk in tqdm(response.iter_content(chunk_size=1024),
-                          desc=f'Downloading {url}',
-                          unit='B',
-                          unit_scale=True,
-                          unit_divisor=1024,
-                          total=int(response.headers.get('content-length', 0))):
-            file.write(chunk)
+            headers = {}
+            if offset > 0:
+                headers['Range'] = f'bytes={offset}-'
+                if validator:
+                    # Only resume if the remote file did not change, otherwise the server sends the full content
+                    headers['If-Range'] = validator
+            try:
+                with session.get(url, stream=True, headers=headers, timeout=DEFAULT_TIMEOUT) as response:
+                    if response.status_code == 416:
+                        # The partial file cannot be resumed, start over
+                        os.remove(part_path)
+                        initial_size = 0
+                        raise requests.exceptions.ConnectionError(f'Range not satisfiable for {url}')
+                    response.raise_for_status()
+                    if offset > 0 and response.status_code != 206:
+                        # Either the remote file changed since the partial file was started or ranges are not supported
+                        log_warning(f'Server answered {response.status_code} to the range request for {url}, discarding the partial download')
+                        os.remove(part_path)
+                        offset = initial_size = 0
+                        # The full content may be a newer version than the HEAD request saw
+                        content_length = response.headers.get('content-length')
+                        remote_metadata = {
+                            'etag': response.headers.get('etag') or remote_metadata['etag'],
+                            'last_modified': response.headers.get('last-modified') or remote_metadata['last_modified'],
+                            'size': int(content_length) if content_length is not None else None,
+                        }
+                        entry.update(remote_metadata)
+                        save_manifest(partial_metadata_path, remote_metadata)
+                        validator = remote_metadata['etag'] or remote_metadata['last_modified']
+                        expected_size = remote_metadata['size']
+                    mode = 'ab' if offset > 0 else 'wb'
+                    total = int(response.headers.get('content-length', 0)) + offset
+                    with open(part_path, mode) as file, tqdm(desc=f'Downloading {url}',
+                                                             unit='B',
+                                                             unit_scale=True,
+                                                             unit_divisor=1024,
+                                                             initial=offset,
+                                                             total=total,
+                                                             leave=False) as progress:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            file.write(chunk)
+                            progress.update(len(chunk))
+                if expected_size is None or path.getsize(part_path) == expected_size:
+                    break
+                raise requests.exceptions.ChunkedEncodingError(f'Incomplete download for {url}')
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.exceptions.Timeout) as e:
+                attempt += 1
+                if attempt > max_retries:
+                    raise
+                log_warning(f'Download of {url} interrupted ({e}), resuming (attempt {attempt}/{max_retries})')
 
-def download_files(urls: list[str], save_dir: str):
+        os.replace(part_path, file_path)
+        os.remove(partial_metadata_path)
+        entry['size'] = path.getsize(file_path)
+        # Bytes transferred in this call, without the part resumed from a previous run. initial_size is reset whenever
+        # that part is discarded
+        fields['bytes'] = entry['size'] - initial_size
+        increment('files_downloaded')
+        increment('bytes_downloaded', fields['bytes'])
+        return {**entry, 'skipped': False}
+
+def record_download(save_dir: str, entry: dict) -> None:
+    '''
+    Adds a downloaded file to the manifest in save_dir. The manifest is reread under a lock, so downloads that finish
+    at the same time, e.g. in separate pipeline tasks, do not overwrite each other's entries.
+    Args:
+        save_dir (str): The directory the file was saved to.
+        entry (dict): The manifest entry, as returned by download_file.
+    Returns:
+        None
+    '''
+    manifest_path = path.join(save_dir, MANIFEST_FILENAME)
+    with MANIFEST_LOCK:
+        manifest = load_manifest(manifest_path)
+        manifest[entry['file']] = {key: value for key, value in entry.items() if key != 'skipped'}
+        save_manifest(manifest_path, manifest)
+
+def download_files(urls: list[str], save_dir: str, workers: int = 1, chunk_size: int = DEFAULT_CHUNK_SIZE, max_retries: int = DEFAULT_MAX_RETRIES, session: requests.Session = None) -> list[dict]:
     '''
     Downloads multiple files from the given list of URLs.
+    Files are downloaded by a bounded pool of workers sharing one pooled session. A manifest in save_dir records the
+    ETag, Last-Modified and size of every downloaded file, so unchanged files are skipped on the next run.
     Args:
         urls (list[str]): The list of URLs of the files to download.
         save_dir (str): The directory where the files will be saved.
+        workers (int, optional): Number of parallel downloads. Defaults to 1.
+        chunk_size (int, optional): Size in bytes of the chunks written to disk. Defaults to DEFAULT_CHUNK_SIZE.
+        max_retries (int, optional): Number of retries per file. Defaults to DEFAULT_MAX_RETRIES.
+        session (requests.Session, optional): A shared session to use. A new one is created if not given. Defaults to None.
     Returns:
-        None
+        list[dict]: The manifest entries of the successfully downloaded or skipped files.
     '''
-    for url in urls:
-        try:
-            download_file(url, save_dir)
-            log_info(f'Successfully downloaded {url} to {save_dir}')
-        except Exception as e:
-            log_error(f'Error downloading {url}: {e}')
+    urls = [url for url in urls if url]
+    workers = max(1, min(workers, len(urls) or 1))
+    if session is None:
+        session = create_session(pool_size=workers, max_retries=max_retries)
+
+    manifest = load_manifest(path.join(save_dir, MANIFEST_FILENAME))
+    results = []
+
+    def download(url: str) -> dict:
+        entry = download_file(url, save_dir, session=session, chunk_size=chunk_size, max_retries=max_retries, manifest_entry=manifest.get(path.basename(url)))
+        record_download(save_dir, entry)
+        return entry
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(download, url): url for url in urls}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                entry = future.result()
+                results.append(entry)
+                if not entry['skipped']:
+                    log_info(f'Successfully downloaded {url} to {save_dir}')
+            except Exception as e:
+                log_error(f'Error downloading {url}: {e}')
+    return results
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Download dataset files from specified URLs.')
     parser.add_argument('--urls', type=str, nargs='+', required=True, help='List of URLs to download files from.')
     parser.add_argument('--save_dir', type=str, default='data/raw', help='Directory to save downloaded files.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of parallel downloads.')
+    parser.add_argument('--chunk_size', type=int, default=DEFAULT_CHUNK_SIZE, help='Size in bytes of the chunks written to disk.')
+    parser.add_argument('--max_retries', type=int, default=DEFAULT_MAX_RETRIES, help='Number of retries per file.')
     args = parser.parse_args()
 
     if args.urls:
-        download_files(args.urls, args.save_dir)
\ No newline at end of file
+        download_files(args.urls, args.save_dir, workers=args.workers, chunk_size=args.chunk_size, max_retries=args.max_retries)
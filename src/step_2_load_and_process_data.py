@@ -1,8 +1,34 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import os
 from os import path
 from src.utils.logging import log_info, log_error, log_warning
+from src.utils.manifest import load_manifest, save_manifest, file_fingerprint
+from src.utils.instrumentation import timer
+from src.utils.schema import compact_dtypes, compact_arrow_schema, get_memory_usage, format_memory_saving
+from src.utils.csv_cache import open_csv_batches, convert_csv_to_parquet
+from src.utils.dataset import DATASET_DIRNAME, DATETIME_COLUMN, DEFAULT_ROW_GROUP_SIZE, add_partition_columns, write_partitioned, remove_partitioned_files
 import argparse
+import time
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Iterator
+
+# Bump whenever process_df/process_batch change, so cached outputs are regenerated
+PREPROCESSING_VERSION = 2
+MANIFEST_FILENAME = '.preprocess_manifest.json'
+MAX_DURATION_MIN = 60
+MAX_PASSENGER_COUNT = 8
+DATETIME_COLUMNS = ['lpep_pickup_datetime', 'lpep_dropoff_datetime']
+REQUIRED_COLUMNS = DATETIME_COLUMNS + ['passenger_count']
+# Columns kept unless configured otherwise: the datetime columns and the default model features, the only raw columns the later steps read
+DEFAULT_COLUMNS = DATETIME_COLUMNS + ['passenger_count', 'trip_distance', 'fare_amount', 'total_amount', 'PULocationID', 'DOLocationID']
+DEFAULT_BATCH_SIZE = 256_000
+# Serializes manifest updates of load_and_process_data calls that run in parallel, e.g. one per pipeline task
+MANIFEST_LOCK = threading.Lock()
+SECONDS_PER_UNIT = {'s': 1, 'ms': 1e3, 'us': 1e6, 'ns': 1e9}
 
 def process_df(df: pd.DataFrame) -> pd.DataFrame:
     '''
@@ -12,50 +38,348 @@ def process_df(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         pd.DataFrame: The preprocessed taxi trip data.
     '''
+    with timer('process_df', rows_in=len(df)) as fields:
+        # Calculate the duration of each trip in minutes
+        df['duration_min'] = (df.lpep_dropoff_datetime - df.lpep_pickup_datetime).dt.total_seconds() / 60
+
+        # Filter out trips with unrealistic durations
+        df = df[(df.duration_min >= 0) & (df.duration_min <= MAX_DURATION_MIN)]
+
+        # Filter out trips with unrealistic passenger counts
+        df = df[(df.passenger_count > 0) & (df.passenger_count <= MAX_PASSENGER_COUNT)]
+
+        fields['rows'] = len(df)
+        return df
+
+def process_batch(batch: pa.RecordBatch) -> pa.RecordBatch:
+    '''
+    Preprocesses a single Arrow record batch of taxi trip data. Applies the same logic as process_df without
+    materializing intermediate pandas copies.
+    Args:
+        batch (pa.RecordBatch): A batch of raw taxi trip data.
+    Returns:
+        pa.RecordBatch: The preprocessed batch.
+    '''
     # Calculate the duration of each trip in minutes
-    df['duration_min'] = (df.lpep_dropoff_datetime - df.lpep_pickup_datetime).dt.total_seconds() / 60
+    pickup = batch.column('lpep_pickup_datetime')
+    dropoff = batch.column('lpep_dropoff_datetime')
+    seconds_per_unit = SECONDS_PER_UNIT[pickup.type.unit]
+    duration = pc.cast(pc.cast(pc.subtract(dropoff, pickup), pa.int64()), pa.float64())
+    duration_min = pc.divide(duration, seconds_per_unit * 60)
+    batch = batch.append_column('duration_min', duration_min)
+
+    # Filter out trips with unrealistic durations and passenger counts.
+    # Null comparisons are dropped by the filter, matching the pandas behaviour for NaN.
+    passenger_count = batch.column('passenger_count')
+    mask = pc.and_(
+        pc.and_(pc.greater_equal(duration_min, 0), pc.less_equal(duration_min, MAX_DURATION_MIN)),
+        pc.and_(pc.greater(passenger_count, 0), pc.less_equal(passenger_count, MAX_PASSENGER_COUNT)),
+    )
+    return batch.filter(mask)
+
+def iter_raw_batches(file_path: str, columns: list[str] = None, batch_size: int = DEFAULT_BATCH_SIZE) -> tuple[pa.Schema, Iterator[pa.RecordBatch]]:
+    '''
+    Opens a raw data file for streaming and returns its (projected) schema and an iterator over record batches.
+    Args:
+        file_path (str): Path to the raw parquet or CSV file.
+        columns (list[str], optional): Columns to read. All columns are read if None. Defaults to None.
+        batch_size (int, optional): Number of rows per batch. Defaults to DEFAULT_BATCH_SIZE.
+    Returns:
+        tuple[pa.Schema, Iterator[pa.RecordBatch]]: The schema of the batches and the batch iterator.
+    '''
+    if file_path.endswith('parquet'):
+        parquet_file = pq.ParquetFile(file_path)
+        schema = parquet_file.schema_arrow
+        if columns is not None:
+            schema = pa.schema([schema.field(column) for column in columns])
+        return schema, parquet_file.iter_batches(batch_size=batch_size, columns=columns)
+    elif file_path.endswith('csv'):
+        # Declared taxi schema with native timestamp parsing, see src.utils.csv_cache
+        return open_csv_batches(file_path, columns=columns, streaming=True)
+    raise ValueError(f'Unsupported file format: {file_path}')
+
+def get_partitioned_output(output_path: str) -> tuple[str, str]:
+    '''
+    Returns the dataset directory and the file basename used instead of output_path when writing a partitioned dataset.
+    Args:
+        output_path (str): Path of the flat processed file.
+    Returns:
+        tuple[str, str]: The dataset directory and the basename of the written files.
+    '''
+    return path.join(path.dirname(output_path), DATASET_DIRNAME), path.splitext(path.basename(output_path))[0]
+
+def process_file_streaming(file_path: str, output_path: str, columns: list[str] = DEFAULT_COLUMNS, batch_size: int = DEFAULT_BATCH_SIZE, compact: bool = True, partitioned: bool = False, row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> tuple[int, int, int, int, list[str]]:
+    '''
+    Preprocesses a raw data file batch by batch and writes the result incrementally to a parquet file, or to a
+    partitioned dataset. Peak memory is bounded by the batch size rather than the file size.
+    Args:
+        file_path (str): Path to the raw parquet or CSV file.
+        output_path (str): Path of the parquet file to write.
+        columns (list[str], optional): Columns to keep. The columns required for preprocessing are always read. All columns are kept if None. Defaults to DEFAULT_COLUMNS.
+        batch_size (int, optional): Number of rows per batch. Defaults to DEFAULT_BATCH_SIZE.
+        compact (bool, optional): Whether to cast the known taxi columns to compact types, see compact_arrow_schema. Defaults to True.
+        partitioned (bool, optional): Whether to write to the partitioned dataset next to output_path, see write_partitioned. Defaults to False.
+        row_group_size (int, optional): Maximum number of rows per row group of the partitioned dataset, row groups are not buffered across batches. Defaults to DEFAULT_ROW_GROUP_SIZE.
+    Returns:
+        tuple[int, int, int, int, list[str]]: The number of rows read, the number of rows written, the size in bytes of the written batches before and after compacting, and the files written to the partitioned dataset.
+    '''
+    if columns is not None:
+        columns = list(dict.fromkeys(list(columns) + REQUIRED_COLUMNS))
+    schema, batches = iter_raw_batches(file_path, columns=columns, batch_size=batch_size)
+
+    output_schema = schema.append(pa.field('duration_min', pa.float64()))
+    if compact:
+        output_schema = compact_arrow_schema(output_schema)
+
+    counts = {'rows_in': 0, 'rows_out': 0, 'bytes_before': 0, 'bytes_after': 0}
+
+    def iter_processed_batches() -> Iterator[pa.RecordBatch]:
+        for batch in batches:
+            counts['rows_in'] += batch.num_rows
+            processed_batch = process_batch(batch)
+            if processed_batch.num_rows > 0:
+                counts['bytes_before'] += processed_batch.nbytes
+                processed_batch = processed_batch.cast(output_schema)
+                counts['bytes_after'] += processed_batch.nbytes
+                counts['rows_out'] += processed_batch.num_rows
+                yield processed_batch
+
+    output_files = []
+    if partitioned:
+        dataset_dir, basename = get_partitioned_output(output_path)
+        # Like the in-memory path, rows are sorted by pickup time so row group statistics prune well. Row groups are
+        # written per batch instead of being buffered up to row_group_size, which could hold the whole file in memory
+        partitioned_batches = (add_partition_columns(batch.sort_by(DATETIME_COLUMN)) for batch in iter_processed_batches())
+        output_files = write_partitioned(partitioned_batches, add_partition_columns(output_schema.empty_table()).schema, dataset_dir, basename, row_group_size=row_group_size, min_rows_per_group=0)
+    else:
+        tmp_path = f'{output_path}.tmp'
+        writer = pq.ParquetWriter(tmp_path, output_schema)
+        try:
+            for processed_batch in iter_processed_batches():
+                writer.write_batch(processed_batch)
+        finally:
+            writer.close()
+        os.replace(tmp_path, output_path)
+    return counts['rows_in'], counts['rows_out'], counts['bytes_before'], counts['bytes_after'], output_files
 
-    # Filter out trips with unrealistic durations
-    df = df[(df.duration_min >= 0) & (df.duration_min <= 60)]
+def process_file(file_path: str, output_path: str, streaming: bool = False, batch_size: int = DEFAULT_BATCH_SIZE, columns: list[str] = DEFAULT_COLUMNS, compact: bool = True, partitioned: bool = False, row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> dict:
+    '''
+    Loads, preprocesses and saves a single raw data file. Intended to run in a worker process, so the result is written
+    straight to disk and only a small summary is returned.
+    Args:
+        file_path (str): Path to the raw parquet or CSV file.
+        output_path (str): Path of the parquet file to write.
+        streaming (bool, optional): Whether to process the file in bounded-memory record batches. Defaults to False.
+        batch_size (int, optional): Number of rows per batch in streaming mode. Defaults to DEFAULT_BATCH_SIZE.
+        columns (list[str], optional): Columns to keep, unused columns are not read. The columns required for preprocessing are always read. All columns are kept if None. Defaults to DEFAULT_COLUMNS.
+        compact (bool, optional): Whether to downcast the known taxi columns to compact dtypes. Defaults to True.
+        partitioned (bool, optional): Whether to write to the partitioned dataset next to output_path instead of output_path. Defaults to False.
+        row_group_size (int, optional): Number of rows per row group of the partitioned dataset. Defaults to DEFAULT_ROW_GROUP_SIZE.
+    Returns:
+        dict: Summary with the file name, output path, rows in, rows out, elapsed seconds, the size in bytes of the processed data before and after compacting, the files written to the partitioned dataset, and an error message if processing failed.
+    '''
+    start_time = time.perf_counter()
+    summary = {'file': path.basename(file_path), 'output_path': output_path, 'output_files': [], 'rows_in': 0, 'rows_out': 0, 'elapsed_s': 0.0, 'memory_before': 0, 'memory_after': 0, 'error': None, 'skipped': False}
+    if columns is not None:
+        columns = list(dict.fromkeys(list(columns) + REQUIRED_COLUMNS))
+    try:
+        if file_path.endswith('csv'):
+            # Parse the CSV once with the declared schema, later runs and steps read the cached parquet conversion
+            file_path = convert_csv_to_parquet(file_path, streaming=streaming)
+        if streaming:
+            summary['rows_in'], summary['rows_out'], summary['memory_before'], summary['memory_after'], summary['output_files'] = process_file_streaming(file_path, output_path, columns=columns, batch_size=batch_size, compact=compact, partitioned=partitioned, row_group_size=row_group_size)
+        else:
+            if not file_path.endswith('parquet'):
+                raise ValueError(f'Unsupported file format: {file_path}')
+            df = pd.read_parquet(file_path, columns=columns)
+            summary['rows_in'] = len(df)
+            preprocessed_df = process_df(df)
+            del df
+            summary['rows_out'] = len(preprocessed_df)
+            summary['memory_before'] = get_memory_usage(preprocessed_df)
+            if compact:
+                preprocessed_df = compact_dtypes(preprocessed_df)
+            summary['memory_after'] = get_memory_usage(preprocessed_df)
+            if partitioned:
+                # Sorting by pickup time keeps the time range of each row group narrow, so its statistics prune well
+                table = pa.Table.from_pandas(preprocessed_df, preserve_index=False).sort_by(DATETIME_COLUMN)
+                del preprocessed_df
+                table = add_partition_columns(table)
+                dataset_dir, basename = get_partitioned_output(output_path)
+                summary['output_files'] = write_partitioned(table, table.schema, dataset_dir, basename, row_group_size=row_group_size)
+            else:
+                preprocessed_df.to_parquet(output_path, index=False)
+    except Exception as e:
+        summary['error'] = f'{type(e).__name__}: {e}'
+        if partitioned:
+            # Do not leave a partial set of partition files behind
+            remove_partitioned_files(*get_partitioned_output(output_path))
+    summary['elapsed_s'] = time.perf_counter() - start_time
+    return summary
 
-    # Filter out trips with unrealistic passenger counts
-    df = df[(df.passenger_count > 0) & (df.passenger_count <= 8)]
+def get_preprocessing_params(columns: list[str] = DEFAULT_COLUMNS, compact: bool = True, partitioned: bool = False, row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> dict:
+    '''
+    Returns the parameters that determine the content of a processed output. A change in any of them invalidates cached outputs.
+    Args:
+        columns (list[str], optional): Columns kept, None for all columns. Defaults to DEFAULT_COLUMNS.
+        compact (bool, optional): Whether the known taxi columns are downcast to compact dtypes. Defaults to True.
+        partitioned (bool, optional): Whether outputs are written to the partitioned dataset. Defaults to False.
+        row_group_size (int, optional): Number of rows per row group of the partitioned dataset. Defaults to DEFAULT_ROW_GROUP_SIZE.
+    Returns:
+        dict: The preprocessing parameters.
+    '''
+    return {
+        'logic_version': PREPROCESSING_VERSION,
+        'max_duration_min': MAX_DURATION_MIN,
+        'max_passenger_count': MAX_PASSENGER_COUNT,
+        'columns': sorted(set(columns + REQUIRED_COLUMNS)) if columns is not None else None,
+        'compact': compact,
+        'partitioned': partitioned,
+        'row_group_size': row_group_size if partitioned else None,
+    }
 
-    return df
+def remove_outputs(processed_data_dir: str, output_name: str) -> None:
+    '''
+    Removes the flat file and the partitioned dataset files written for a raw file.
+    Args:
+        processed_data_dir (str): Directory where processed data files are saved.
+        output_name (str): Name of the flat processed file.
+    Returns:
+        None
+    '''
+    output_path = path.join(processed_data_dir, output_name)
+    if path.exists(output_path):
+        os.remove(output_path)
+    dataset_dir, basename = get_partitioned_output(output_path)
+    if path.isdir(dataset_dir):
+        remove_partitioned_files(dataset_dir, basename)
 
-def load_and_process_data(raw_data_dir: str, processed_data_dir: str, valid_file_formats: list = ['parquet', 'csv']) -> None:
+def is_output_complete(processed_data_dir: str, output_name: str, entry: dict) -> bool:
+    '''
+    Checks whether all outputs recorded in a manifest entry exist.
+    Args:
+        processed_data_dir (str): Directory where processed data files are saved.
+        output_name (str): Name of the flat processed file.
+        entry (dict): The manifest entry.
+    Returns:
+        bool: True if the outputs exist.
+    '''
+    if entry.get('params', {}).get('partitioned'):
+        dataset_dir, _ = get_partitioned_output(path.join(processed_data_dir, output_name))
+        return all(path.exists(path.join(dataset_dir, file)) for file in entry.get('output_files', []))
+    return path.exists(path.join(processed_data_dir, output_name))
+
+def load_and_process_data(raw_data_dir: str, processed_data_dir: str, valid_file_formats: list = ['parquet', 'csv'], streaming: bool = False, batch_size: int = DEFAULT_BATCH_SIZE, columns: list[str] = DEFAULT_COLUMNS, workers: int = 1, force: bool = False, compact: bool = True, partitioned: bool = False, row_group_size: int = DEFAULT_ROW_GROUP_SIZE, files: list[str] = None, executor: Executor = None) -> list[dict]:
     '''
     Main function to load, preprocess, and save the data.
+    A manifest in processed_data_dir records the fingerprint of each raw input together with the preprocessing logic
+    version and filter parameters. Outputs are only regenerated when one of these changes, and outputs whose raw
+    file no longer exists are removed. Only the entries of the processed files are updated in the manifest, so calls
+    for different files can run at the same time.
     Args:
         raw_data_dir (str): Directory where raw data files are stored.
         processed_data_dir (str): Directory where processed data files will be saved.
         valid_file_formats (list): List of valid file formats to process.
+        streaming (bool, optional): Whether to process files in bounded-memory record batches. Defaults to False.
+        batch_size (int, optional): Number of rows per batch in streaming mode. Defaults to DEFAULT_BATCH_SIZE.
+        columns (list[str], optional): Columns to keep, unused columns are not read. All columns are kept if None. Defaults to DEFAULT_COLUMNS.
+        workers (int, optional): Number of worker processes. Files are processed in the current process if 1. Defaults to 1.
+        force (bool, optional): Whether to reprocess all files regardless of the manifest. Defaults to False.
+        compact (bool, optional): Whether to downcast the known taxi columns to compact dtypes, see src.utils.schema. Defaults to True.
+        partitioned (bool, optional): Whether to write a hive-partitioned dataset (year/month/day of the pickup time) to DATASET_DIRNAME in processed_data_dir instead of one file per raw file. Defaults to False.
+        row_group_size (int, optional): Number of rows per row group of the partitioned dataset. Defaults to DEFAULT_ROW_GROUP_SIZE.
+        files (list[str], optional): Names of the raw files to process, e.g. a file that just finished downloading. All files in raw_data_dir are processed if None. Defaults to None.
+        executor (Executor, optional): A process pool shared between calls to run the files in, instead of one created for this call with workers processes. Defaults to None.
     Returns:
-        None
+        list[dict]: A summary per file with rows in, rows out, elapsed seconds, memory before and after compacting, output path, error (None on success) and whether it was skipped.
     '''
     os.makedirs(processed_data_dir, exist_ok=True)
+    manifest_path = path.join(processed_data_dir, MANIFEST_FILENAME)
+    manifest = load_manifest(manifest_path)
+    params = get_preprocessing_params(columns, compact, partitioned, row_group_size)
 
-    for file in os.listdir(raw_data_dir):
-        if any(file.endswith(ext) for ext in valid_file_formats):
-            file_path = path.join(raw_data_dir, file)
-            if file.endswith('parquet'):
-                df = pd.read_parquet(file_path)
-            elif file.endswith('csv'):
-                df = pd.read_csv(file_path)
-            else:
+    tasks = []
+    fingerprints = {}
+    summaries = []
+    raw_files = [file for file in sorted(os.listdir(raw_data_dir)) if any(file.endswith(ext) for ext in valid_file_formats)]
+    for file in raw_files:
+        if files is None or file in files:
+            if not (file.endswith('parquet') or file.endswith('csv')):
                 log_warning(f'Skipping unsupported file format: {file}')
                 continue
+            file_path = path.join(raw_data_dir, file)
+            # Outputs are always parquet, also for CSV inputs
+            output_name = f'processed_{path.splitext(file)[0]}.parquet'
+            output_path = path.join(processed_data_dir, output_name)
+            entry = manifest.get(output_name, {})
+            fingerprints[output_name] = file_fingerprint(file_path, previous_entry=entry.get('raw'))
+            if not force and is_output_complete(processed_data_dir, output_name, entry) and entry.get('raw', {}).get('sha256') == fingerprints[output_name]['sha256'] and entry.get('params') == params:
+                summaries.append({'file': file, 'output_path': output_path, 'output_files': entry.get('output_files', []), 'rows_in': entry.get('rows_in', 0), 'rows_out': entry.get('rows_out', 0), 'elapsed_s': 0.0, 'memory_before': entry.get('memory_before', 0), 'memory_after': entry.get('memory_after', 0), 'error': None, 'skipped': True})
+                continue
+            # Outputs of a previous run, possibly in the other layout, would otherwise be read twice
+            remove_outputs(processed_data_dir, output_name)
+            tasks.append((file_path, output_path, streaming, batch_size, columns, compact, partitioned, row_group_size))
 
-            preprocessed_df = process_df(df)
-            output_path = path.join(processed_data_dir, f'processed_{file}')
-            preprocessed_df.to_parquet(output_path, index=False)
-            log_info(f'Preprocessed data saved to {output_path}')
+    # Remove outputs whose raw input disappeared
+    removed = set()
+    for output_name, entry in manifest.items():
+        if output_name not in fingerprints and entry.get('raw_file') not in raw_files:
+            remove_outputs(processed_data_dir, output_name)
+            removed.add(output_name)
+            log_info(f'Removed orphaned output {path.join(processed_data_dir, output_name)}')
+
+    def run_tasks(executor: Executor) -> None:
+        futures = [executor.submit(process_file, *task) for task in tasks]
+        for future, task in zip(futures, tasks):
+            try:
+                summaries.append(future.result())
+            except Exception as e:
+                # The worker process itself died, e.g. out of memory
+                summaries.append({'file': path.basename(task[0]), 'output_path': task[1], 'output_files': [], 'rows_in': 0, 'rows_out': 0, 'elapsed_s': 0.0, 'memory_before': 0, 'memory_after': 0, 'error': f'{type(e).__name__}: {e}', 'skipped': False})
+
+    if executor is not None and tasks:
+        run_tasks(executor)
+    elif workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            run_tasks(pool)
+    else:
+        summaries.extend(process_file(*task) for task in tasks)
+
+    updates = {}
+    for summary in summaries:
+        output_name = path.basename(summary['output_path'])
+        if summary['skipped']:
+            log_info(f'Skipping {summary["file"]}, {summary["output_path"]} is up to date')
+        elif summary['error']:
+            removed.add(output_name)
+            log_error(f'Error preprocessing {summary["file"]}: {summary["error"]}')
+        else:
+            updates[output_name] = {'raw_file': summary['file'], 'raw': fingerprints[output_name], 'params': params, 'rows_in': summary['rows_in'], 'rows_out': summary['rows_out'], 'memory_before': summary['memory_before'], 'memory_after': summary['memory_after'], 'output_files': summary['output_files']}
+            output = f'{len(summary["output_files"])} partition files in {get_partitioned_output(summary["output_path"])[0]}' if partitioned else summary['output_path']
+            log_info(f'Preprocessed data saved to {output} ({summary["rows_out"]}/{summary["rows_in"]} rows kept in {summary["elapsed_s"]:.2f}s, memory {format_memory_saving(summary["memory_before"], summary["memory_after"])})')
+    with MANIFEST_LOCK:
+        # Reread the manifest, other calls may have updated the entries of their files in the meantime
+        manifest = load_manifest(manifest_path)
+        for output_name in removed:
+            manifest.pop(output_name, None)
+        manifest.update(updates)
+        save_manifest(manifest_path, manifest)
+    return summaries
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Load, preprocess, and save taxi trip data.')
     parser.add_argument('--raw_data_dir', type=str, default='data/raw', help='Directory where raw data files are stored.')
     parser.add_argument('--processed_data_dir', type=str, default='data/processed', help='Directory where processed data files will be saved.')
     parser.add_argument('--valid_file_formats', type=str, nargs='+', default=['parquet', 'csv'], help='List of valid file formats to process.')
+    parser.add_argument('--streaming', action='store_true', help='Process files in bounded-memory record batches.')
+    parser.add_argument('--batch_size', type=int, default=DEFAULT_BATCH_SIZE, help='Number of rows per batch in streaming mode.')
+    parser.add_argument('--columns', type=str, nargs='+', default=DEFAULT_COLUMNS, help='Columns to keep, unused columns are not read. Defaults to the datetime columns and the model features.')
+    parser.add_argument('--all_columns', action='store_true', help='Keep all raw columns instead of --columns.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes.')
+    parser.add_argument('--force', action='store_true', help='Reprocess all files, ignoring the manifest.')
+    parser.add_argument('--no_compact', action='store_true', help='Keep the raw dtypes instead of downcasting to compact dtypes.')
+    parser.add_argument('--partitioned', action='store_true', help=f'Write a dataset partitioned by pickup year/month/day to {DATASET_DIRNAME}/ in the processed data directory.')
+    parser.add_argument('--row_group_size', type=int, default=DEFAULT_ROW_GROUP_SIZE, help='Number of rows per row group of the partitioned dataset.')
     args = parser.parse_args()
 
-    load_and_process_data(args.raw_data_dir, args.processed_data_dir, args.valid_file_formats)
\ No newline at end of file
+    load_and_process_data(args.raw_data_dir, args.processed_data_dir, args.valid_file_formats, streaming=args.streaming, batch_size=args.batch_size, columns=None if args.all_columns else args.columns, workers=args.workers, force=args.force, compact=not args.no_compact, partitioned=args.partitioned, row_group_size=args.row_group_size)
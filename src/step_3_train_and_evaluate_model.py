@@ -1,16 +1,323 @@
 import pandas as pd
+import numpy as np
+import pyarrow.parquet as pq
+from dataclasses import dataclass, field, asdict
 from sklearn.model_selection import train_test_split
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import mean_absolute_error
-from typing import Tuple
+from typing import Tuple, Iterator, NamedTuple
 from src.utils.logging import log_info, log_warning
 from src.utils.timestamp import remove_timestamp_from_filename, add_current_timestamp_to_filename
+from src.utils.manifest import file_fingerprint
+from src.utils.instrumentation import timer
+from src.utils.schema import get_memory_usage
+from src.utils.csv_cache import convert_csv_to_parquet
+from src.utils.dataset import DATASET_DIRNAME, read_processed, list_partitions, list_dataset_files, parse_filters
 import joblib
 import argparse
 import os
 from os import path
 
-def train_and_evaluate_df(df: pd.DataFrame, features: list[str], target: str, model: LinearRegression = None, split_ratio: float = 0.2) -> Tuple[LinearRegression, pd.DataFrame, pd.DataFrame, pd.Series, pd.Series]:
+DEFAULT_BATCH_SIZE = 500_000
+STATS_FILENAME = 'linear_regression_stats.joblib'
+
+@dataclass
+class LinearRegressionStats:
+    '''
+    Sufficient statistics for an exact least-squares fit: row count, feature/target means and centered co-moments.
+    Statistics of disjoint chunks of data can be merged, so a fit over all files only needs one pass over each file.
+    Means and co-moments are combined with the pairwise update of Chan et al., which is numerically stable.
+    The features, target and ratio of held out validation rows are part of the statistics, so statistics persisted for
+    other columns or another split are not reused.
+    '''
+    features: list[str]
+    target: str = None
+    validation_ratio: float = None
+    n: int = 0
+    mean_x: np.ndarray = None
+    mean_y: float = 0.0
+    cxx: np.ndarray = None
+    cxy: np.ndarray = None
+    sources: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        n_features = len(self.features)
+        if self.mean_x is None:
+            self.mean_x = np.zeros(n_features)
+        if self.cxx is None:
+            self.cxx = np.zeros((n_features, n_features))
+        if self.cxy is None:
+            self.cxy = np.zeros(n_features)
+
+    def merge(self, other: 'LinearRegressionStats') -> 'LinearRegressionStats':
+        '''
+        Merges the statistics of another chunk of data into these statistics.
+        Args:
+            other (LinearRegressionStats): Statistics over the same features and target for a disjoint chunk of data.
+        Returns:
+            LinearRegressionStats: self, updated in place.
+        '''
+        if list(other.features) != list(self.features) or other.target != self.target:
+            raise ValueError(f'Cannot merge statistics over different columns: {other.features} -> {other.target} != {self.features} -> {self.target}')
+        if other.validation_ratio != self.validation_ratio:
+            raise ValueError(f'Cannot merge statistics with different validation ratios: {other.validation_ratio} != {self.validation_ratio}')
+        if other.n == 0:
+            return self
+        n = self.n + other.n
+        delta_x = other.mean_x - self.mean_x
+        delta_y = other.mean_y - self.mean_y
+        weight = self.n * other.n / n
+        self.cxx = self.cxx + other.cxx + np.outer(delta_x, delta_x) * weight
+        self.cxy = self.cxy + other.cxy + delta_x * delta_y * weight
+        self.mean_x = self.mean_x + delta_x * other.n / n
+        self.mean_y = self.mean_y + delta_y * other.n / n
+        self.n = n
+        self.sources.update(other.sources)
+        return self
+
+    def update(self, X: np.ndarray, y: np.ndarray) -> 'LinearRegressionStats':
+        '''
+        Adds a batch of rows to the statistics.
+        Args:
+            X (np.ndarray): Feature matrix of shape (n_rows, n_features).
+            y (np.ndarray): Target vector of shape (n_rows,).
+        Returns:
+            LinearRegressionStats: self, updated in place.
+        '''
+        if len(y) == 0:
+            return self
+        mean_x = X.mean(axis=0)
+        mean_y = y.mean()
+        X_centered = X - mean_x
+        y_centered = y - mean_y
+        batch = LinearRegressionStats(
+            self.features,
+            target=self.target,
+            validation_ratio=self.validation_ratio,
+            n=len(y),
+            mean_x=mean_x,
+            mean_y=float(mean_y),
+            cxx=X_centered.T @ X_centered,
+            cxy=X_centered.T @ y_centered,
+        )
+        return self.merge(batch)
+
+    def solve(self) -> LinearRegression:
+        '''
+        Solves the normal equations and returns a fitted Linear Regression model, equivalent to fitting on all rows at once.
+        Returns:
+            LinearRegression: The fitted model.
+        '''
+        if self.n == 0:
+            raise ValueError('Cannot fit a model on empty statistics')
+        coef = np.linalg.lstsq(self.cxx, self.cxy, rcond=None)[0]
+        model = LinearRegression()
+        model.coef_ = coef
+        model.intercept_ = float(self.mean_y - self.mean_x @ coef)
+        model.n_features_in_ = len(self.features)
+        model.feature_names_in_ = np.asarray(self.features, dtype=object)
+        return model
+
+def iter_feature_batches(file_path: str, features: list[str], target: str, batch_size: int = DEFAULT_BATCH_SIZE, validation_ratio: float = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    '''
+    Reads the feature and target columns of a processed file in batches. Rows with missing or non-finite values are dropped.
+    Args:
+        file_path (str): Path to the processed parquet or CSV file.
+        features (list[str]): List of feature column names.
+        target (str): Target variable column name.
+        batch_size (int, optional): Number of rows per batch. Defaults to DEFAULT_BATCH_SIZE.
+        validation_ratio (float, optional): If given, the rows that hash_split assigns to the validation set with this ratio, as in train_and_evaluate_df with split='hash', are dropped as well. Defaults to None.
+    Yields:
+        Tuple[np.ndarray, np.ndarray]: The feature matrix and target vector of each batch.
+    '''
+    columns = features + [target]
+    if file_path.endswith('.csv'):
+        # Parsed once with the declared schema, later reads use the cached parquet conversion
+        file_path = convert_csv_to_parquet(file_path)
+    if not file_path.endswith('.parquet'):
+        raise ValueError(f'Unsupported file format: {file_path}')
+    frames = (batch.to_pandas() for batch in pq.ParquetFile(file_path).iter_batches(batch_size=batch_size, columns=columns))
+    for frame in frames:
+        if validation_ratio is not None:
+            frame = frame[~hash_split(frame, validation_ratio, key_columns=columns)]
+        values = frame[columns].to_numpy(dtype=np.float64)
+        values = values[np.isfinite(values).all(axis=1)]
+        yield values[:, :-1], values[:, -1]
+
+def compute_file_stats(file_path: str, features: list[str], target: str, batch_size: int = DEFAULT_BATCH_SIZE, validation_ratio: float = None) -> LinearRegressionStats:
+    '''
+    Computes the sufficient statistics of a single processed file, batch by batch.
+    Args:
+        file_path (str): Path to the processed parquet or CSV file.
+        features (list[str]): List of feature column names.
+        target (str): Target variable column name.
+        batch_size (int, optional): Number of rows per batch. Defaults to DEFAULT_BATCH_SIZE.
+        validation_ratio (float, optional): Ratio of hash-based validation rows left out, see iter_feature_batches. Defaults to None.
+    Returns:
+        LinearRegressionStats: The statistics of the file.
+    '''
+    stats = LinearRegressionStats(features, target=target, validation_ratio=validation_ratio)
+    for X, y in iter_feature_batches(file_path, features, target, batch_size=batch_size, validation_ratio=validation_ratio):
+        stats.update(X, y)
+    return stats
+
+def train_streaming(processed_data_dir: str, models_dir: str, features: list[str], target: str, batch_size: int = DEFAULT_BATCH_SIZE, stats_path: str = None, valid_file_formats: list[str] = ['.csv', '.parquet'], validation_ratio: float = None) -> Tuple[str, LinearRegression, LinearRegressionStats]:
+    '''
+    Fits a Linear Regression model on all processed files at once without loading them into memory.
+    Statistics are kept per file and persisted, so on the next run only new or changed files are read and statistics
+    of removed files are dropped. All files are read again if the features, target or validation ratio changed. The
+    resulting model is the same as a single fit on the concatenated data. With a validation ratio, the rows of the
+    hash-based validation split of every file are held out, so the model can be evaluated on them with split='hash'.
+    Args:
+        processed_data_dir (str): Directory where processed data files are stored.
+        models_dir (str): Directory where models and statistics will be saved.
+        features (list[str]): List of feature column names.
+        target (str): Target variable column name.
+        batch_size (int, optional): Number of rows per batch. Defaults to DEFAULT_BATCH_SIZE.
+        stats_path (str, optional): Path of the persisted per-file statistics. Defaults to STATS_FILENAME in models_dir.
+        valid_file_formats (list[str], optional): List of valid file formats to process. Defaults to ['.csv', '.parquet'].
+        validation_ratio (float, optional): Ratio of hash-based validation rows held out, see iter_feature_batches. All rows are used if None. Defaults to None.
+    Returns:
+        Tuple[str, LinearRegression, LinearRegressionStats]: The filename of the saved model, the model and the merged statistics.
+    '''
+    os.makedirs(models_dir, exist_ok=True)
+    stats_path = stats_path or os.path.join(models_dir, STATS_FILENAME)
+    stats_by_file = {}
+    if os.path.exists(stats_path):
+        try:
+            stats_by_file = {file: LinearRegressionStats(**file_stats) for file, file_stats in joblib.load(stats_path).items()}
+            log_info(f'Loaded statistics for {len(stats_by_file)} files from {stats_path}')
+        except Exception as e:
+            log_warning(f'Error loading statistics from {stats_path}: {e}')
+
+    supported_files = sorted(f for f in os.listdir(processed_data_dir) if any(f.endswith(ext) for ext in valid_file_formats))
+    dataset_dir = os.path.join(processed_data_dir, DATASET_DIRNAME)
+    if os.path.isdir(dataset_dir):
+        # Each file of the partitioned dataset has its own statistics, so a new day only reads that day
+        supported_files += [os.path.join(DATASET_DIRNAME, f) for f in list_dataset_files(dataset_dir)]
+    log_info(f'Found {len(supported_files)} files to process in {processed_data_dir}')
+    updated_stats = {}
+    for file in supported_files:
+        file_path = os.path.join(processed_data_dir, file)
+        previous = stats_by_file.get(file)
+        fingerprint = file_fingerprint(file_path, previous_entry=previous.sources.get(file) if previous else None)
+        if previous is not None and list(previous.features) == list(features) and previous.target == target and previous.validation_ratio == validation_ratio and previous.sources.get(file, {}).get('sha256') == fingerprint['sha256']:
+            updated_stats[file] = previous
+            continue
+        log_info(f'Accumulating statistics for {file_path}')
+        file_stats = compute_file_stats(file_path, features, target, batch_size=batch_size, validation_ratio=validation_ratio)
+        file_stats.sources = {file: fingerprint}
+        updated_stats[file] = file_stats
+    # Persist plain dicts so the statistics can be loaded regardless of the entry point
+    joblib.dump({file: asdict(file_stats) for file, file_stats in updated_stats.items()}, stats_path)
+
+    stats = LinearRegressionStats(features, target=target, validation_ratio=validation_ratio)
+    for file_stats in updated_stats.values():
+        stats.merge(file_stats)
+    model = stats.solve()
+    model_filename = add_current_timestamp_to_filename('linear_regression_model.bin')
+    joblib.dump(model, os.path.join(models_dir, model_filename))
+    log_info(f'Fitted model on {stats.n} rows from {len(updated_stats)} files, saved to {os.path.join(models_dir, model_filename)}')
+    return model_filename, model, stats
+
+def list_processed_sources(processed_data_dir: str, valid_file_formats: list[str] = ['.csv', '.parquet']) -> list[Tuple[str, str, dict]]:
+    '''
+    Lists the units of processed data the model is trained on in turn: the processed files by name, which orders the
+    monthly TLC files chronologically, followed by one unit per month of the partitioned dataset in chronological order.
+    The last unit is the most recent one.
+    Args:
+        processed_data_dir (str): Directory where processed data files are stored.
+        valid_file_formats (list[str], optional): List of valid file formats to process. Defaults to ['.csv', '.parquet'].
+    Returns:
+        list[Tuple[str, str, dict]]: The name, path and partition filters (None for files) of each unit.
+    '''
+    sources = [(f, os.path.join(processed_data_dir, f), None) for f in sorted(os.listdir(processed_data_dir)) if any(f.endswith(ext) for ext in valid_file_formats)]
+    dataset_dir = os.path.join(processed_data_dir, DATASET_DIRNAME)
+    if os.path.isdir(dataset_dir):
+        for partition in list_partitions(dataset_dir):
+            name = '/'.join([DATASET_DIRNAME] + [f'{key}={value}' for key, value in partition.items()])
+            sources.append((name, dataset_dir, {key: [value] for key, value in partition.items()}))
+    return sources
+
+def read_model_columns(file_path: str, features: list[str], target: str, start: pd.Timestamp = None, end: pd.Timestamp = None, filters: dict = None) -> pd.DataFrame:
+    '''
+    Reads only the feature and target columns of a processed file or partitioned dataset and downcasts them to compact dtypes.
+    Args:
+        file_path (str): Path to the processed parquet or CSV file, or to a partitioned dataset directory.
+        features (list[str]): List of feature column names.
+        target (str): Target variable column name.
+        start (pd.Timestamp, optional): Inclusive start of the pickup time range. Defaults to None.
+        end (pd.Timestamp, optional): Exclusive end of the pickup time range. Defaults to None.
+        filters (dict, optional): Allowed values per column, see read_processed. Defaults to None.
+    Returns:
+        pd.DataFrame: The feature and target columns.
+    Throws:
+        ValueError: If the file format is not supported.
+    '''
+    columns = list(dict.fromkeys(features + [target]))
+    if file_path.endswith('.csv'):
+        # Parsed once with the declared schema, later reads use the cached parquet conversion
+        file_path = convert_csv_to_parquet(file_path)
+    if not (os.path.isdir(file_path) or file_path.endswith('.parquet')):
+        raise ValueError(f'Unsupported file format: {file_path}')
+    # Filters are pushed down to the partitions and row group statistics
+    df = read_processed(file_path, columns=columns, start=start, end=end, filters=filters)
+    log_info(f'Loaded {len(df)} rows and {len(columns)} columns from {file_path} ({get_memory_usage(df) / 2**20:.1f} MiB)')
+    return df
+
+class TrainingResult(NamedTuple):
+    '''
+    Result of training and evaluating the model on one processed file. Frames are None unless requested.
+    '''
+    file: str
+    model_filename: str
+    model: LinearRegression
+    train_mae: float
+    val_mae: float
+    n_train: int
+    n_val: int
+    X_train: pd.DataFrame = None
+    X_val: pd.DataFrame = None
+    y_train: pd.Series = None
+    y_val: pd.Series = None
+    val_path: str = None
+
+def get_latest_model_path(models_dir: str, model_name: str = 'linear_regression_model.bin') -> str:
+    '''
+    Returns the path of the most recent timestamped model artifact in the models directory.
+    Args:
+        models_dir (str): Directory where models are saved.
+        model_name (str, optional): Base name of the model file, without timestamp. Defaults to 'linear_regression_model.bin'.
+    Returns:
+        str: The path of the latest model, or None if there is none.
+    '''
+    if not os.path.isdir(models_dir):
+        return None
+    base_name, ext = path.splitext(model_name)
+    # Timestamps are ISO formatted, so the lexicographic order is chronological
+    model_files = sorted(f for f in os.listdir(models_dir) if f.startswith(f'{base_name}_') and f.endswith(ext))
+    return os.path.join(models_dir, model_files[-1]) if model_files else None
+
+def hash_split(df: pd.DataFrame, split_ratio: float = 0.2, key_columns: list[str] = None, seed: int = 42) -> np.ndarray:
+    '''
+    Deterministically assigns rows to the validation set based on a hash of their content.
+    Unlike a shuffled split, the assignment of a row does not depend on the other rows, so it is stable across files,
+    batches and reruns, and no shuffled copies of the data are materialized. Numeric columns are hashed as float64,
+    so the assignment does not depend on the compact dtype a column was read with.
+    Args:
+        df (pd.DataFrame): The data to split.
+        split_ratio (float, optional): The ratio of data to use for validation. Defaults to 0.2.
+        key_columns (list[str], optional): Columns to hash. All columns are hashed if None. Defaults to None.
+        seed (int, optional): Seed mixed into the hash to obtain a different split. Defaults to 42.
+    Returns:
+        np.ndarray: Boolean mask that is True for validation rows.
+    '''
+    keys = df if key_columns is None else df[key_columns]
+    keys = keys.astype({column: np.float64 for column in keys.columns if pd.api.types.is_numeric_dtype(keys[column]) and not pd.api.types.is_bool_dtype(keys[column])})
+    hashes = pd.util.hash_pandas_object(keys, index=False, hash_key=f'{seed:016d}'[:16]).to_numpy()
+    return (hashes % 1_000_000) < int(split_ratio * 1_000_000)
+
+def train_and_evaluate_df(df: pd.DataFrame, features: list[str], target: str, model: LinearRegression = None, split_ratio: float = 0.2, fit: bool = True, split: str = 'random') -> Tuple[LinearRegression, pd.DataFrame, pd.DataFrame, pd.Series, pd.Series]:
     '''
     Trains and evaluates a Linear Regression model on the given dataframe.
     Args:
@@ -19,41 +326,55 @@ def train_and_evaluate_df(df: pd.DataFrame, features: list[str], target: str, mo
         target (str): Target variable column name.
         model (LinearRegression, optional): An existing Linear Regression model to continue training. Defaults to None.
         split_ratio (float, optional): The ratio of data to use for validation. Defaults to 0.2.
+        fit (bool, optional): Whether to fit the model. If False, the given model is only evaluated. Defaults to True.
+        split (str, optional): 'random' for a shuffled split, 'hash' for a deterministic hash-based split (see hash_split). Defaults to 'random'.
     Returns:
         Tuple[LinearRegression, pd.DataFrame, pd.DataFrame, pd.Series, pd.Series]: The trained model, training features, validation features, training target, validation target.
     '''
-    # Split the data into features and target variable
-    X = df[features]
-    y = df[target]
+    with timer('train_and_evaluate_df', rows=len(df), fit=fit or model is None):
+        if split == 'hash':
+            # Select the rows of each set directly, each selection is a single owned copy
+            is_val = hash_split(df, split_ratio, key_columns=features + [target])
+            X_train, X_val = df.loc[~is_val, features], df.loc[is_val, features]
+            y_train, y_val = df.loc[~is_val, target], df.loc[is_val, target]
+        else:
+            # Split the data into features and target variable
+            X = df[features]
+            y = df[target]
 
-    # Split the data into training and validation sets
-    X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=split_ratio, random_state=42)
-    log_info(f'Data split into training and validation sets with ratio {1 - split_ratio}:{split_ratio}')
+            # Split the data into training and validation sets
+            X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=split_ratio, random_state=42)
+        log_info(f'Data split into training and validation sets with ratio {1 - split_ratio}:{split_ratio}')
 
-    # Initialize and train a Linear Regression model
-    if model is None:
-        model = LinearRegression()
-        log_info('Initializing new Linear Regression model')
-    model.fit(X_train, y_train)
+        # Initialize and train a Linear Regression model
+        if model is None:
+            model = LinearRegression()
+            log_info('Initializing new Linear Regression model')
+            fit = True
+        if fit:
+            # Fit in double precision, compact float32 columns would otherwise make sklearn solve in single precision
+            model.fit(X_train.astype(np.float64), y_train)
 
-    # Make predictions on the training and validation sets
-    train_preds = model.predict(X_train)
-    val_preds = model.predict(X_val)
-    log_info('Model training complete and predictions made on training and validation sets')
+        # Make predictions on the training and validation sets
+        train_preds = model.predict(X_train)
+        val_preds = model.predict(X_val)
+        log_info('Model training complete and predictions made on training and validation sets')
 
-    # Add the prediction column to the training and validation dataframes
-    X_train['prediction'] = train_preds
-    X_val['prediction'] = val_preds
+        # Add the prediction column to the training and validation dataframes
+        X_train['prediction'] = train_preds
+        X_val['prediction'] = val_preds
 
-    # Print the mean absolute error of the model on the training and validation data
-    log_info(f'Model Evaluation:\nTraining Mean Absolute Error: {mean_absolute_error(y_train, train_preds):.2f}\nValidation Mean Absolute Error: {mean_absolute_error(y_val, val_preds):.2f}')
+        # Print the mean absolute error of the model on the training and validation data
+        log_info(f'Model Evaluation:\nTraining Mean Absolute Error: {mean_absolute_error(y_train, train_preds):.2f}\nValidation Mean Absolute Error: {mean_absolute_error(y_val, val_preds):.2f}')
 
-    # Return the trained model and the training and validation data
-    return model, X_train, X_val, y_train, y_val
+        # Return the trained model and the training and validation data
+        return model, X_train, X_val, y_train, y_val
 
-def train_and_evaluate(processed_data_dir: str, models_dir: str, features: list[str], target: str, base_model_path: str = None, save_per_epoch: bool = True, valid_file_formats: list[str] = ['.csv', '.parquet']) -> list[Tuple[str, str, LinearRegression, pd.DataFrame, pd.DataFrame, pd.Series, pd.Series]]:
+def iter_train_and_evaluate(processed_data_dir: str, models_dir: str, features: list[str], target: str, base_model_path: str = None, save_per_epoch: bool = True, valid_file_formats: list[str] = ['.csv', '.parquet'], keep_frames: bool = False, spill_dir: str = None, split: str = 'random', start: pd.Timestamp = None, end: pd.Timestamp = None, filters: dict = None) -> Iterator[TrainingResult]:
     '''
-    Main function to load processed data files, train and evaluate the model.
+    Loads processed data files one at a time, trains and evaluates the model, and yields a result per file.
+    Only the current file is held in memory. Frames are attached to a result only if keep_frames is set, so a caller
+    that needs e.g. the last validation window keeps that result and lets the others be freed.
     Args:
         processed_data_dir (str): Directory where processed data files are stored.
         models_dir (str): Directory where models will be saved.
@@ -62,8 +383,14 @@ def train_and_evaluate(processed_data_dir: str, models_dir: str, features: list[
         base_model_path (str, optional): Path to an existing model file to continue training. Defaults to None.
         save_per_epoch (bool, optional): Whether to save the model after each epoch. Defaults to True.
         valid_file_formats (list[str], optional): List of valid file formats to process. Defaults to ['.csv', '.parquet'].
-    Returns:
-        Tuple[str, list[Tuple[str, str, LinearRegression, pd.DataFrame, pd.DataFrame, pd.Series, pd.Series]]]: The filename of the last saved model and a list of results for each processed file.
+        keep_frames (bool, optional): Whether to attach the training and validation frames to each result. Defaults to False.
+        spill_dir (str, optional): If set, the validation frame of each file is written to parquet in this directory. Defaults to None.
+        split (str, optional): 'random' or 'hash', see train_and_evaluate_df. Defaults to 'random'.
+        start (pd.Timestamp, optional): Only train on trips picked up from this time on. Defaults to None.
+        end (pd.Timestamp, optional): Only train on trips picked up before this time. Defaults to None.
+        filters (dict, optional): Allowed values per column, e.g. {'PULocationID': [74, 75]}. Defaults to None.
+    Yields:
+        TrainingResult: The model and metrics for each processed file.
     '''
     model = None
     model_name = 'linear_regression_model.bin'
@@ -76,27 +403,28 @@ def train_and_evaluate(processed_data_dir: str, models_dir: str, features: list[
             log_warning(f'Error loading model from {base_model_path}: {e}')
     
     os.makedirs(models_dir, exist_ok=True)
+    if spill_dir:
+        os.makedirs(spill_dir, exist_ok=True)
 
-    results = []
-    # Get all files in the processed data directory, concat
-    supported_files = [f for f in os.listdir(processed_data_dir) if any(f.endswith(ext) for ext in valid_file_formats)]
+    # Get all files and dataset partitions in the processed data directory
+    supported_files = list_processed_sources(processed_data_dir, valid_file_formats)
     num_files = len(supported_files)
     log_info(f'Found {num_files} files to process in {processed_data_dir}')
-    for i, file in enumerate(supported_files):
+    for i, (file, processed_file_path, partition_filters) in enumerate(supported_files):
         is_last_file = (i == num_files - 1)
-        processed_file_path = os.path.join(processed_data_dir, file)
-        log_info(f'Processing file {i + 1}/{num_files}: {processed_file_path}')
-        # Load the processed data file
-        if file.endswith('.parquet'):
-            df = pd.read_parquet(processed_file_path)
-        elif file.endswith('.csv'):
-            df = pd.read_csv(processed_file_path)
-        else:
+        log_info(f'Processing file {i + 1}/{num_files}: {processed_file_path if partition_filters is None else os.path.join(processed_data_dir, file)}')
+        if partition_filters is None and not file.endswith(('.parquet', '.csv')):
             log_warning(f'Skipping unsupported file format: {file}')
             continue
+        # Load only the model columns of the processed data file
+        df = read_model_columns(processed_file_path, features, target, start=start, end=end, filters={**(filters or {}), **(partition_filters or {})})
+        if df.empty:
+            log_warning(f'Skipping {file}, no rows match the filters')
+            continue
 
-        # Train and evaluate the model
-        model, X_train, X_val, y_train, y_val = train_and_evaluate_df(df, features, target, model=model)
+        # Train and evaluate the model, the full file is no longer needed afterwards
+        model, X_train, X_val, y_train, y_val = train_and_evaluate_df(df, features, target, model=model, split=split)
+        del df
 
         # Save at least the last model, or every epoch if specified
         model_filename = ''
@@ -104,7 +432,46 @@ def train_and_evaluate(processed_data_dir: str, models_dir: str, features: list[
             model_filename = add_current_timestamp_to_filename(remove_timestamp_from_filename(model_name))
             joblib.dump(model, os.path.join(models_dir, model_filename))
             log_info(f'Saving {"epoch" if save_per_epoch else "final"} model to {os.path.join(models_dir, model_filename)}')
-        results.append((os.path.basename(file), model_filename, model, X_train, X_val, y_train, y_val))
+
+        val_path = None
+        if spill_dir:
+            val_path = os.path.join(spill_dir, f'validation_{path.splitext(file.replace("/", "_").replace("=", "-"))[0]}.parquet')
+            X_val.assign(**{target: y_val}).to_parquet(val_path, index=False)
+
+        result = TrainingResult(
+            file=file,
+            model_filename=model_filename,
+            model=model,
+            train_mae=mean_absolute_error(y_train, X_train['prediction']),
+            val_mae=mean_absolute_error(y_val, X_val['prediction']),
+            n_train=len(X_train),
+            n_val=len(X_val),
+            val_path=val_path,
+        )
+        if keep_frames:
+            result = result._replace(X_train=X_train, X_val=X_val, y_train=y_train, y_val=y_val)
+        del X_train, X_val, y_train, y_val
+        yield result
+
+def train_and_evaluate(processed_data_dir: str, models_dir: str, features: list[str], target: str, base_model_path: str = None, save_per_epoch: bool = True, valid_file_formats: list[str] = ['.csv', '.parquet']) -> list[Tuple[str, str, LinearRegression, pd.DataFrame, pd.DataFrame, pd.Series, pd.Series]]:
+    '''
+    Main function to load processed data files, train and evaluate the model.
+    Keeps the frames of every file in memory, prefer iter_train_and_evaluate for long histories.
+    Args:
+        processed_data_dir (str): Directory where processed data files are stored.
+        models_dir (str): Directory where models will be saved.
+        features (list[str]): List of feature column names.
+        target (str): Target variable column name.
+        base_model_path (str, optional): Path to an existing model file to continue training. Defaults to None.
+        save_per_epoch (bool, optional): Whether to save the model after each epoch. Defaults to True.
+        valid_file_formats (list[str], optional): List of valid file formats to process. Defaults to ['.csv', '.parquet'].
+    Returns:
+        Tuple[str, list[Tuple[str, str, LinearRegression, pd.DataFrame, pd.DataFrame, pd.Series, pd.Series]]]: The filename of the last saved model and a list of results for each processed file.
+    '''
+    results = [
+        (result.file, result.model_filename, result.model, result.X_train, result.X_val, result.y_train, result.y_val)
+        for result in iter_train_and_evaluate(processed_data_dir, models_dir, features, target, base_model_path=base_model_path, save_per_epoch=save_per_epoch, valid_file_formats=valid_file_formats, keep_frames=True)
+    ]
     
     # Return the filename of the last saved model and all results
     last_model_filename = results[-1][1] if results else ''
@@ -119,19 +486,26 @@ if __name__ == '__main__':
     parser.add_argument('--target', type=str, default='duration_min', help='Target variable for prediction.')
     parser.add_argument('--num_features', type=str, nargs='+', default=['passenger_count', 'trip_distance', 'fare_amount', 'total_amount'], help='List of numerical feature names.')
     parser.add_argument('--cat_features', type=str, nargs='+', default=['PULocationID', 'DOLocationID'], help='List of categorical feature names.')
+    parser.add_argument('--engine', type=str, choices=['per_file', 'streaming'], default='per_file', help='Fit on each file in turn, or one exact out-of-core fit over all files.')
+    parser.add_argument('--batch_size', type=int, default=DEFAULT_BATCH_SIZE, help='Number of rows per batch for the streaming engine.')
+    parser.add_argument('--split', type=str, choices=['random', 'hash'], default='random', help='Shuffled or deterministic hash-based train/validation split. The streaming engine holds out the validation rows of the hash-based split.')
+    parser.add_argument('--start', type=pd.Timestamp, help='Only train on trips picked up from this time on, e.g. 2024-01-15.')
+    parser.add_argument('--end', type=pd.Timestamp, help='Only train on trips picked up before this time.')
+    parser.add_argument('--filters', type=str, nargs='+', help='Allowed values per column, e.g. PULocationID=74,75.')
     args = parser.parse_args()
+    features = args.num_features + args.cat_features
 
-    last_model_filename, results = train_and_evaluate(args.processed_data_dir, args.models_dir, args.features, args.target, base_model_path=args.base_model_path, valid_file_formats=args.valid_file_formats)
-    log_info(f'Final model saved as: {last_model_filename}')
-    for file_name, model_file, model, X_train, X_val, y_train, y_val in results:
-        log_info(f'File: {file_name}, Model saved as: {model_file}')
-        # Store validation data for further analysis if needed
-        model_file_base = f'validation_data_{path.splitext(model_file)[0] if model_file else ""}.parquet'
-        model_file_base = add_current_timestamp_to_filename(remove_timestamp_from_filename(model_file_base))
-        X_val.copy().to_parquet(os.path.join(args.models_dir, model_file_base), index=False)
-        log_info(f'Saved validation data to {os.path.join(args.models_dir, model_file_base)}')
-
-
-
-
-    
\ No newline at end of file
+    if args.engine == 'streaming':
+        model_filename, _, stats = train_streaming(args.processed_data_dir, args.models_dir, features, args.target, batch_size=args.batch_size, valid_file_formats=args.valid_file_formats, validation_ratio=0.2)
+        log_info(f'Final model saved as: {model_filename} (fitted on {stats.n} rows)')
+    else:
+        last_model_filename = ''
+        for result in iter_train_and_evaluate(args.processed_data_dir, args.models_dir, features, args.target, base_model_path=args.base_model_path, valid_file_formats=args.valid_file_formats, keep_frames=True, split=args.split, start=args.start, end=args.end, filters=parse_filters(args.filters)):
+            last_model_filename = result.model_filename or last_model_filename
+            log_info(f'File: {result.file}, Model saved as: {result.model_filename}, Validation MAE: {result.val_mae:.2f}')
+            # Store validation data for further analysis if needed
+            model_file_base = f'validation_data_{path.splitext(result.model_filename)[0] if result.model_filename else ""}.parquet'
+            model_file_base = add_current_timestamp_to_filename(remove_timestamp_from_filename(model_file_base))
+            result.X_val.to_parquet(os.path.join(args.models_dir, model_file_base), index=False)
+            log_info(f'Saved validation data to {os.path.join(args.models_dir, model_file_base)}')
+        log_info(f'Final model saved as: {last_model_filename}')
@@ -1,9 +1,21 @@
 from evidently import ColumnMapping
-from src.utils.logging import log_warning
+from src.utils.logging import log_info, log_warning
+from src.utils.drift import build_profile, compute_drift, column_drift, DEFAULT_N_BINS, DEFAULT_DRIFT_SHARE, STATTEST_COLUMN_TYPES
+from src.utils.manifest import save_manifest
+from src.utils.instrumentation import timer
+from src.utils.dataset import read_processed, parse_filters
 import pandas as pd
+import argparse
+import joblib
+import hashlib
+import json
+from os import path
 from evidently.report import Report
 from evidently.metrics import ColumnDriftMetric, DatasetDriftMetric, DatasetMissingValuesMetric
 
+# Bump whenever the profile layout or binning logic changes, so cached profiles are rebuilt
+PROFILE_VERSION = 2
+
 def generate_report(train_data: pd.DataFrame, val_data: pd.DataFrame, num_features: list[str], cat_features: list[str]):
     '''
     Generates an Evidently report to analyze data drift and missing values between training and validation datasets.
@@ -15,30 +27,244 @@ def generate_report(train_data: pd.DataFrame, val_data: pd.DataFrame, num_featur
     Returns:
         Report: The generated Evidently report.
     '''
-    # Define the column mapping for the Evidently report
-    # This includes the prediction column, numerical features, and categorical features
-    column_mapping = ColumnMapping(
-        target=None,
-        prediction='prediction',
-        numerical_features=num_features,
-        categorical_features=cat_features
-    )
-
-    # Initialize the Evidently report with the desired metrics
-    # In this case, we're using the ColumnDriftMetric for the 'prediction' column,
-    # the DatasetDriftMetric to measure drift across the entire dataset,
-    # and the DatasetMissingValuesMetric to measure the proportion of missing values
-    report = Report(metrics=[
-        ColumnDriftMetric(column_name='prediction'),
-        DatasetDriftMetric(),
-        DatasetMissingValuesMetric()
-    ])
-
-    # Run the report on the training and validation data
-    # The training data is used as the reference data, and the validation data is the current data
-    report.run(reference_data=train_data, current_data=val_data, column_mapping=column_mapping)
-    # Return the generated report
-    return report
+    with timer('generate_report', rows=len(train_data) + len(val_data)):
+        # Define the column mapping for the Evidently report
+        # This includes the prediction column, numerical features, and categorical features
+        column_mapping = ColumnMapping(
+            target=None,
+            prediction='prediction',
+            numerical_features=num_features,
+            categorical_features=cat_features
+        )
+
+        # Initialize the Evidently report with the desired metrics
+        # In this case, we're using the ColumnDriftMetric for the 'prediction' column,
+        # the DatasetDriftMetric to measure drift across the entire dataset,
+        # and the DatasetMissingValuesMetric to measure the proportion of missing values
+        report = Report(metrics=[
+            ColumnDriftMetric(column_name='prediction'),
+            DatasetDriftMetric(),
+            DatasetMissingValuesMetric()
+        ])
+
+        # Run the report on the training and validation data
+        # The training data is used as the reference data, and the validation data is the current data
+        report.run(reference_data=train_data, current_data=val_data, column_mapping=column_mapping)
+        # Return the generated report
+        return report
+
+def get_profile_path(model_path: str) -> str:
+    '''
+    Returns the path of the reference profile stored next to a model artifact.
+    Args:
+        model_path (str): Path to the model file, e.g. models/linear_regression_model_<timestamp>.bin.
+    Returns:
+        str: The path of the profile, e.g. models/linear_regression_model_<timestamp>.profile.json.
+    '''
+    return f'{path.splitext(model_path)[0]}.profile.json'
+
+def get_profile_config_hash(num_features: list[str], cat_features: list[str], prediction: str = 'prediction', n_bins: int = DEFAULT_N_BINS) -> str:
+    '''
+    Returns a hash of the configuration a reference profile depends on. A cached profile is only valid for the same hash.
+    Args:
+        num_features (list[str]): List of numerical feature column names.
+        cat_features (list[str]): List of categorical feature column names.
+        prediction (str, optional): Name of the prediction column. Defaults to 'prediction'.
+        n_bins (int, optional): Number of histogram bins for numerical columns. Defaults to DEFAULT_N_BINS.
+    Returns:
+        str: The configuration hash.
+    '''
+    config = {'version': PROFILE_VERSION, 'num_features': list(num_features), 'cat_features': list(cat_features), 'prediction': prediction, 'n_bins': n_bins}
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+def load_reference_profile(model_path: str, num_features: list[str], cat_features: list[str], prediction: str = 'prediction', n_bins: int = DEFAULT_N_BINS) -> dict:
+    '''
+    Loads the cached reference profile of a model artifact.
+    Args:
+        model_path (str): Path to the model file.
+        num_features (list[str]): List of numerical feature column names.
+        cat_features (list[str]): List of categorical feature column names.
+        prediction (str, optional): Name of the prediction column. Defaults to 'prediction'.
+        n_bins (int, optional): Number of histogram bins for numerical columns. Defaults to DEFAULT_N_BINS.
+    Returns:
+        dict: The profile, or None if it does not exist or was built with a different configuration.
+    '''
+    profile_path = get_profile_path(model_path)
+    if not path.exists(profile_path):
+        return None
+    with open(profile_path, 'r') as file:
+        profile = json.load(file)
+    if profile.get('config_hash') != get_profile_config_hash(num_features, cat_features, prediction, n_bins):
+        log_info(f'Reference profile {profile_path} was built with a different configuration, ignoring it')
+        return None
+    return profile
+
+def get_reference_profile(model_path: str, num_features: list[str], cat_features: list[str], reference_data: pd.DataFrame = None, prediction: str = 'prediction', n_bins: int = DEFAULT_N_BINS) -> dict:
+    '''
+    Returns the reference profile of a model artifact. The cached profile is used if valid, otherwise it is built
+    from the reference data and saved next to the model.
+    Args:
+        model_path (str): Path to the model file.
+        num_features (list[str]): List of numerical feature column names.
+        cat_features (list[str]): List of categorical feature column names.
+        reference_data (pd.DataFrame, optional): Reference data, including predictions, used if no valid profile is cached. Defaults to None.
+        prediction (str, optional): Name of the prediction column. Defaults to 'prediction'.
+        n_bins (int, optional): Number of histogram bins for numerical columns. Defaults to DEFAULT_N_BINS.
+    Returns:
+        dict: The reference profile.
+    Throws:
+        ValueError: If no valid profile is cached and no reference data is given.
+    '''
+    profile = load_reference_profile(model_path, num_features, cat_features, prediction=prediction, n_bins=n_bins)
+    if profile is not None:
+        log_info(f'Loaded reference profile from {get_profile_path(model_path)}')
+        return profile
+    if reference_data is None:
+        raise ValueError(f'No valid reference profile for {model_path} and no reference data given')
+    profile = build_profile(reference_data, num_features, cat_features, prediction=prediction, n_bins=n_bins)
+    profile['model'] = path.basename(model_path)
+    profile['config_hash'] = get_profile_config_hash(num_features, cat_features, prediction, n_bins)
+    save_manifest(get_profile_path(model_path), profile)
+    log_info(f'Saved reference profile to {get_profile_path(model_path)}')
+    return profile
+
+def generate_drift_metrics(train_data: pd.DataFrame, val_data: pd.DataFrame, num_features: list[str], cat_features: list[str], prediction: str = 'prediction', stattest: str = None, n_bins: int = DEFAULT_N_BINS, drift_share: float = DEFAULT_DRIFT_SHARE, reference_profile: dict = None) -> dict:
+    '''
+    Computes data drift and missing values between training and validation datasets with the native NumPy engine.
+    Produces the same per-column drift scores and dataset drift share as the Evidently report, from histograms and
+    category counts instead of the full frames, and returns plain JSON-serializable results.
+    Args:
+        train_data (pd.DataFrame): The training dataset, used as reference. Not read if reference_profile is given.
+        val_data (pd.DataFrame): The validation dataset, used as current data.
+        num_features (list[str]): List of numerical feature column names.
+        cat_features (list[str]): List of categorical feature column names.
+        prediction (str, optional): Name of the prediction column. Defaults to 'prediction'.
+        stattest (str, optional): Stattest used for all columns, selected per column like Evidently if None. Defaults to None.
+        n_bins (int, optional): Number of histogram bins for numerical columns. Defaults to DEFAULT_N_BINS.
+        drift_share (float, optional): Share of drifted columns above which the dataset is considered drifted. Defaults to DEFAULT_DRIFT_SHARE.
+        reference_profile (dict, optional): A precomputed reference profile, see get_reference_profile. Defaults to None.
+    Returns:
+        dict: Drift results with 'columns', 'dataset_drift' and 'missing_values' sections.
+    '''
+    with timer('generate_drift_metrics', rows=len(val_data) if reference_profile is not None else len(train_data) + len(val_data)):
+        if reference_profile is None:
+            reference_profile = build_profile(train_data, num_features, cat_features, prediction=prediction, n_bins=n_bins)
+        return compute_drift(reference_profile, val_data, stattest=stattest, drift_share=drift_share)
+
+def compare_with_evidently(train_data: pd.DataFrame, val_data: pd.DataFrame, num_features: list[str], cat_features: list[str], sample_size: int = 100_000, random_state: int = 42, stattest: str = None) -> pd.DataFrame:
+    '''
+    Compares the native drift engine with Evidently on sampled data, column by column.
+    Args:
+        train_data (pd.DataFrame): The training dataset, used as reference.
+        val_data (pd.DataFrame): The validation dataset, used as current data.
+        num_features (list[str]): List of numerical feature column names.
+        cat_features (list[str]): List of categorical feature column names.
+        sample_size (int, optional): Maximum number of rows sampled from each dataset. Defaults to 100_000.
+        random_state (int, optional): Random state of the sampling. Defaults to 42.
+        stattest (str, optional): Stattest used by both engines, only for the columns it applies to. Selected per column if None. Defaults to None.
+    Returns:
+        pd.DataFrame: Per column, the stattest and threshold, the drift score and detection of both engines and the absolute score difference.
+    '''
+    train_sample = train_data.sample(n=min(sample_size, len(train_data)), random_state=random_state)
+    val_sample = val_data.sample(n=min(sample_size, len(val_data)), random_state=random_state)
+    reference_profile = build_profile(train_sample, num_features, cat_features)
+    columns = [column for column, profile in reference_profile['columns'].items() if stattest is None or profile['column_type'] in STATTEST_COLUMN_TYPES[stattest]]
+    native = {column: column_drift(reference_profile['columns'][column], val_sample[column], stattest=stattest) for column in columns}
+
+    prediction = 'prediction' if 'prediction' in train_sample.columns else None
+    column_mapping = ColumnMapping(target=None, prediction=prediction, numerical_features=num_features, categorical_features=cat_features)
+    report = Report(metrics=[ColumnDriftMetric(column_name=column, stattest=stattest) for column in columns])
+    report.run(reference_data=train_sample, current_data=val_sample, column_mapping=column_mapping)
+
+    rows = []
+    for metric in report.as_dict()['metrics']:
+        result = metric['result']
+        native_result = native[result['column_name']]
+        rows.append({
+            'column': result['column_name'],
+            'stattest': native_result['stattest'],
+            'threshold': native_result['threshold'],
+            'evidently_score': result['drift_score'],
+            'native_score': native_result['drift_score'],
+            'abs_diff': abs(result['drift_score'] - native_result['drift_score']),
+            'evidently_drift': result['drift_detected'],
+            'native_drift': native_result['drift_detected'],
+        })
+    return pd.DataFrame(rows)
+
+def compare_dataset_with_evidently(train_data: pd.DataFrame, val_data: pd.DataFrame, num_features: list[str], cat_features: list[str], sample_size: int = 100_000, random_state: int = 42, stattest: str = None, drift_share: float = DEFAULT_DRIFT_SHARE) -> dict:
+    '''
+    Compares the dataset drift and the missing values of the native drift engine with Evidently on sampled data.
+    Missing values are counted over all columns of the data, drift over the prediction and feature columns.
+    Args:
+        train_data (pd.DataFrame): The training dataset, used as reference.
+        val_data (pd.DataFrame): The validation dataset, used as current data.
+        num_features (list[str]): List of numerical feature column names.
+        cat_features (list[str]): List of categorical feature column names.
+        sample_size (int, optional): Maximum number of rows sampled from each dataset. Defaults to 100_000.
+        random_state (int, optional): Random state of the sampling. Defaults to 42.
+        stattest (str, optional): Stattest used by both engines for all columns, so it must apply to numerical and categorical columns. Selected per column if None. Defaults to None.
+        drift_share (float, optional): Share of drifted columns above which the dataset is considered drifted. Defaults to DEFAULT_DRIFT_SHARE.
+    Returns:
+        dict: The number of columns and drifted columns and the dataset drift of both engines, and the number of columns and missing values of the reference and current data of both engines.
+    '''
+    train_sample = train_data.sample(n=min(sample_size, len(train_data)), random_state=random_state)
+    val_sample = val_data.sample(n=min(sample_size, len(val_data)), random_state=random_state)
+    prediction = 'prediction' if 'prediction' in train_sample.columns else None
+    native = compute_drift(build_profile(train_sample, num_features, cat_features, prediction=prediction), val_sample, stattest=stattest, drift_share=drift_share)
+
+    column_mapping = ColumnMapping(target=None, prediction=prediction, numerical_features=num_features, categorical_features=cat_features)
+    report = Report(metrics=[DatasetDriftMetric(drift_share=drift_share, stattest=stattest), DatasetMissingValuesMetric()])
+    report.run(reference_data=train_sample, current_data=val_sample, column_mapping=column_mapping)
+    drift, missing = (metric['result'] for metric in report.as_dict()['metrics'])
+
+    comparison = {
+        'evidently_columns': int(drift['number_of_columns']),
+        'native_columns': native['dataset_drift']['number_of_columns'],
+        'evidently_drifted_columns': int(drift['number_of_drifted_columns']),
+        'native_drifted_columns': native['dataset_drift']['number_of_drifted_columns'],
+        'evidently_share': float(drift['share_of_drifted_columns']),
+        'native_share': native['dataset_drift']['share_of_drifted_columns'],
+        'evidently_drift': bool(drift['dataset_drift']),
+        'native_drift': native['dataset_drift']['dataset_drift'],
+    }
+    for data in ['reference', 'current']:
+        comparison[f'evidently_{data}_columns'] = int(missing[data]['number_of_columns'])
+        comparison[f'native_{data}_columns'] = native['missing_values'][data]['number_of_columns']
+        comparison[f'evidently_{data}_missing'] = int(missing[data]['number_of_missing_values'])
+        comparison[f'native_{data}_missing'] = native['missing_values'][data]['number_of_missing_values']
+    return comparison
 
 if __name__ == '__main__':
-    log_warning('This module is intended to be imported and used within the main pipeline.')
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Compute native drift metrics against a cached model profile, or compare the native drift engine with Evidently on sampled data.')
+    parser.add_argument('--reference_path', type=str, help='Parquet file with reference data, including the prediction column.')
+    parser.add_argument('--current_path', type=str, help='Parquet file or partitioned dataset with current data. Without a prediction column, it is computed with --model_path.')
+    parser.add_argument('--model_path', type=str, help='Model file whose cached reference profile is used as reference.')
+    parser.add_argument('--output_path', type=str, default='reports/data_drift_metrics.json', help='Where to save the drift metrics computed against --model_path.')
+    parser.add_argument('--n_bins', type=int, default=DEFAULT_N_BINS, help='Number of histogram bins of the reference profile.')
+    parser.add_argument('--num_features', type=str, nargs='+', default=['passenger_count', 'trip_distance', 'fare_amount', 'total_amount'], help='List of numerical feature names.')
+    parser.add_argument('--cat_features', type=str, nargs='+', default=['PULocationID', 'DOLocationID'], help='List of categorical feature names.')
+    parser.add_argument('--sample_size', type=int, default=100_000, help='Maximum number of rows sampled from each dataset.')
+    parser.add_argument('--stattest', type=str, choices=list(STATTEST_COLUMN_TYPES), help='Stattest compared on the columns it applies to, selected per column if not given.')
+    parser.add_argument('--start', type=pd.Timestamp, help='Only use current trips picked up from this time on, e.g. 2024-01-15.')
+    parser.add_argument('--end', type=pd.Timestamp, help='Only use current trips picked up before this time.')
+    parser.add_argument('--filters', type=str, nargs='+', help='Allowed values per column of the current data, e.g. PULocationID=74,75.')
+    args = parser.parse_args()
+
+    if args.model_path and args.current_path:
+        # Only the current data is scanned, the reference side comes from the profile cached next to the model
+        reference_data = pd.read_parquet(args.reference_path) if args.reference_path else None
+        reference_profile = get_reference_profile(args.model_path, args.num_features, args.cat_features, reference_data=reference_data, n_bins=args.n_bins)
+        # Filters are pushed down, so only the matching partitions and row groups of the current data are read
+        current_data = read_processed(args.current_path, start=args.start, end=args.end, filters=parse_filters(args.filters))
+        if 'prediction' not in current_data.columns:
+            model = joblib.load(args.model_path)
+            current_data['prediction'] = model.predict(current_data[list(model.feature_names_in_)])
+        metrics = generate_drift_metrics(None, current_data, args.num_features, args.cat_features, n_bins=args.n_bins, reference_profile=reference_profile)
+        save_manifest(args.output_path, metrics)
+        log_info(f'Drift metrics saved to {args.output_path}')
+    elif args.reference_path and args.current_path:
+        comparison = compare_with_evidently(pd.read_parquet(args.reference_path), pd.read_parquet(args.current_path), args.num_features, args.cat_features, sample_size=args.sample_size, stattest=args.stattest)
+        log_info(f'Drift parity between Evidently and the native engine:\n{comparison.to_string(index=False)}')
+    else:
+        log_warning('This module is intended to be imported and used within the main pipeline.')
\ No newline at end of file
@@ -0,0 +1,174 @@
+import os
+import time
+import argparse
+from os import path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from src.utils.logging import log_info
+from src.utils.schema import TAXI_SCHEMA
+
+DEFAULT_CHUNK_SIZE = 1_000_000
+DEFAULT_SEED = 42
+N_ZONES = 265
+# Share of rows without the optional codes, like the rows of the TLC files that were not recorded by the meter
+MISSING_SHARE = 0.03
+# Share of rows with a negative duration or a duration above one hour, which preprocessing filters out
+NEGATIVE_DURATION_SHARE = 0.002
+LONG_DURATION_SHARE = 0.005
+PASSENGER_COUNTS = np.arange(7)
+PASSENGER_PROBABILITIES = np.array([0.03, 0.78, 0.10, 0.03, 0.02, 0.02, 0.02])
+# Passenger mix at full drift, shifted towards group rides
+DRIFTED_PASSENGER_PROBABILITIES = np.array([0.03, 0.50, 0.25, 0.08, 0.05, 0.05, 0.04])
+
+def get_zone_probabilities(seed: int, drift: float = 0.0) -> np.ndarray:
+    '''
+    Returns the pickup and drop-off probability of each zone. Zone popularity follows a Zipf-like law, and drift
+    moves probability mass to a different ranking of the zones.
+    Args:
+        seed (int): Random seed, the same seed gives the same ranking.
+        drift (float, optional): Share of the drifted ranking, between 0 and 1. Defaults to 0.0.
+    Returns:
+        np.ndarray: Probabilities of the zones 1 to N_ZONES.
+    '''
+    rng = np.random.default_rng(seed)
+    popularity = 1 / np.arange(1, N_ZONES + 1) ** 1.1
+    probabilities = (1 - drift) * popularity[rng.permutation(N_ZONES)] + drift * popularity[rng.permutation(N_ZONES)]
+    return probabilities / probabilities.sum()
+
+def generate_chunk(n_rows: int, first_row: int, total_rows: int, start: pd.Timestamp, end: pd.Timestamp, rng: np.random.Generator, zone_probabilities: np.ndarray, drift: float = 0.0) -> pa.Table:
+    '''
+    Generates a chunk of green taxi trips with the raw schema (TAXI_SCHEMA). Pickup times increase over the chunks of
+    a file, so chunk first_row of total_rows covers the matching share of [start, end).
+    Amounts are derived from distance and duration with noise, so the columns are correlated but not collinear.
+    Drift lengthens trips, slows traffic and shifts the passenger mix; the zone mix is set by zone_probabilities.
+    Args:
+        n_rows (int): Number of rows of the chunk.
+        first_row (int): Index of the first row of the chunk in the file.
+        total_rows (int): Number of rows of the file.
+        start (pd.Timestamp): Inclusive start of the pickup times of the file.
+        end (pd.Timestamp): Exclusive end of the pickup times of the file.
+        rng (np.random.Generator): Random generator of the chunk.
+        zone_probabilities (np.ndarray): Probabilities of the zones, see get_zone_probabilities.
+        drift (float, optional): Drift magnitude, between 0 and 1. Defaults to 0.0.
+    Returns:
+        pa.Table: The trips.
+    '''
+    start_us, end_us = pd.Timestamp(start).value // 1000, pd.Timestamp(end).value // 1000
+    position = (first_row + np.sort(rng.random(n_rows)) * n_rows) / total_rows
+    pickup = start_us + (position * (end_us - start_us)).astype(np.int64)
+
+    distance = np.round(rng.gamma(1.6, 1.9 * (1 + drift), n_rows), 2)
+    speed_mph = np.maximum(rng.gamma(6.0, 2.0 * (1 - 0.3 * drift), n_rows), 2.0)
+    duration_min = distance / speed_mph * 60 + rng.exponential(2.5, n_rows)
+    outlier = rng.random(n_rows)
+    duration_min = np.where(outlier < LONG_DURATION_SHARE, duration_min + rng.uniform(60, 600, n_rows), duration_min)
+    duration_min = np.where(outlier > 1 - NEGATIVE_DURATION_SHARE, -rng.uniform(1, 30, n_rows), duration_min)
+    dropoff = pickup + (duration_min * 60e6).astype(np.int64)
+
+    missing = rng.random(n_rows) < MISSING_SHARE
+    passenger_probabilities = (1 - drift) * PASSENGER_PROBABILITIES + drift * DRIFTED_PASSENGER_PROBABILITIES
+    passenger_count = rng.choice(PASSENGER_COUNTS, n_rows, p=passenger_probabilities).astype(np.float64)
+    payment_type = rng.choice([1.0, 2.0, 3.0, 4.0], n_rows, p=[0.60, 0.37, 0.02, 0.01])
+
+    fare = np.maximum(np.round(3.0 + 1.75 * distance + 0.35 * np.clip(duration_min, 0, 120) + rng.normal(0, 1.0, n_rows), 2), 3.0)
+    extra = rng.choice([0.0, 1.0, 2.5], n_rows, p=[0.5, 0.3, 0.2])
+    mta_tax = np.where(rng.random(n_rows) < 0.05, 0.0, 0.5)
+    tip = np.where(payment_type == 1, np.round(fare * rng.uniform(0.1, 0.3, n_rows), 2), 0.0)
+    tolls = np.where(rng.random(n_rows) < 0.03, 6.94, 0.0)
+    improvement_surcharge = np.ones(n_rows)
+    congestion_surcharge = rng.choice([0.0, 2.75], n_rows, p=[0.8, 0.2])
+    total = np.round(fare + extra + mta_tax + tip + tolls + improvement_surcharge + np.where(missing, 0.0, congestion_surcharge), 2)
+
+    columns = {
+        'VendorID': pa.array(rng.choice(np.array([1, 2], dtype=np.int32), n_rows, p=[0.15, 0.85])),
+        'lpep_pickup_datetime': pa.array(pickup, type=pa.timestamp('us')),
+        'lpep_dropoff_datetime': pa.array(dropoff, type=pa.timestamp('us')),
+        'store_and_fwd_flag': pa.array(np.where(rng.random(n_rows) < 0.003, 'Y', 'N'), mask=missing),
+        'RatecodeID': pa.array(rng.choice([1.0, 2.0, 3.0, 4.0, 5.0], n_rows, p=[0.93, 0.02, 0.01, 0.01, 0.03]), mask=missing),
+        'PULocationID': pa.array(rng.choice(N_ZONES, n_rows, p=zone_probabilities).astype(np.int32) + 1),
+        'DOLocationID': pa.array(rng.choice(N_ZONES, n_rows, p=zone_probabilities).astype(np.int32) + 1),
+        'passenger_count': pa.array(passenger_count, mask=missing),
+        'trip_distance': pa.array(distance),
+        'fare_amount': pa.array(fare),
+        'extra': pa.array(extra),
+        'mta_tax': pa.array(mta_tax),
+        'tip_amount': pa.array(tip),
+        'tolls_amount': pa.array(tolls),
+        'ehail_fee': pa.nulls(n_rows, type=pa.float64()),
+        'improvement_surcharge': pa.array(improvement_surcharge),
+        'total_amount': pa.array(total),
+        'payment_type': pa.array(payment_type, mask=missing),
+        'trip_type': pa.array(rng.choice([1.0, 2.0], n_rows, p=[0.97, 0.03]), mask=missing),
+        'congestion_surcharge': pa.array(congestion_surcharge, mask=missing),
+    }
+    return pa.Table.from_pydict(columns, schema=TAXI_SCHEMA)
+
+def write_synthetic_file(output_path: str, n_rows: int, start: pd.Timestamp, end: pd.Timestamp, seed: int = DEFAULT_SEED, drift: float = 0.0, chunk_size: int = DEFAULT_CHUNK_SIZE, file_index: int = 0) -> int:
+    '''
+    Writes a parquet file of synthetic trips chunk by chunk, so memory stays bounded by chunk_size for any n_rows.
+    Every chunk has its own generator seeded from (seed, file_index, chunk index), so the output is deterministic for
+    the same arguments.
+    Args:
+        output_path (str): Path of the parquet file.
+        n_rows (int): Number of rows.
+        start (pd.Timestamp): Inclusive start of the pickup times.
+        end (pd.Timestamp): Exclusive end of the pickup times.
+        seed (int, optional): Random seed. Defaults to DEFAULT_SEED.
+        drift (float, optional): Drift magnitude, between 0 and 1. Defaults to 0.0.
+        chunk_size (int, optional): Number of rows generated and written at a time, also the row group size. Defaults to DEFAULT_CHUNK_SIZE.
+        file_index (int, optional): Index of the file in a series, so files of the same seed differ. Defaults to 0.
+    Returns:
+        int: The number of rows written.
+    '''
+    if not 0 <= drift <= 1:
+        raise ValueError(f'Drift must be between 0 and 1, got {drift}')
+    zone_probabilities = get_zone_probabilities(seed, drift)
+    tmp_path = f'{output_path}.tmp'
+    with pq.ParquetWriter(tmp_path, TAXI_SCHEMA) as writer:
+        for chunk_index, first_row in enumerate(range(0, n_rows, chunk_size)):
+            rng = np.random.default_rng([seed, file_index, chunk_index])
+            writer.write_table(generate_chunk(min(chunk_size, n_rows - first_row), first_row, n_rows, start, end, rng, zone_probabilities, drift=drift))
+    os.replace(tmp_path, output_path)
+    return n_rows
+
+def generate_synthetic_data(output_dir: str, n_rows: int, start: str = '2024-01', months: int = 1, seed: int = DEFAULT_SEED, drift: float = 0.0, chunk_size: int = DEFAULT_CHUNK_SIZE) -> list[str]:
+    '''
+    Generates monthly files named like the TLC downloads (green_tripdata_YYYY-MM.parquet), so they can be used as raw
+    data of the pipeline. Drift increases linearly from none in the first month to drift in the last month.
+    Args:
+        output_dir (str): Directory to write the files to.
+        n_rows (int): Number of rows per month.
+        start (str, optional): First month, e.g. '2024-01'. Defaults to '2024-01'.
+        months (int, optional): Number of months. Defaults to 1.
+        seed (int, optional): Random seed. Defaults to DEFAULT_SEED.
+        drift (float, optional): Drift magnitude of the last month, between 0 and 1. Defaults to 0.0.
+        chunk_size (int, optional): Number of rows generated and written at a time. Defaults to DEFAULT_CHUNK_SIZE.
+    Returns:
+        list[str]: Paths of the written files.
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for i, month in enumerate(pd.period_range(start, periods=months, freq='M')):
+        month_drift = drift * i / (months - 1) if months > 1 else drift
+        output_path = path.join(output_dir, f'green_tripdata_{month}.parquet')
+        start_time = time.perf_counter()
+        write_synthetic_file(output_path, n_rows, month.start_time, (month + 1).start_time, seed=seed, drift=month_drift, chunk_size=chunk_size, file_index=i)
+        elapsed = time.perf_counter() - start_time
+        log_info(f'Generated {n_rows} trips with drift {month_drift:.2f} in {output_path} ({elapsed:.2f}s, {n_rows / elapsed:.0f} rows/s)')
+        paths.append(output_path)
+    return paths
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate deterministic synthetic green taxi trips with injected drift.')
+    parser.add_argument('--output_dir', type=str, default='data/synthetic', help='Directory to write the monthly parquet files to.')
+    parser.add_argument('--n_rows', type=int, default=100_000, help='Number of rows per month, e.g. 100000 to 100000000.')
+    parser.add_argument('--start', type=str, default='2024-01', help='First month, e.g. 2024-01.')
+    parser.add_argument('--months', type=int, default=2, help='Number of months.')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='Random seed.')
+    parser.add_argument('--drift', type=float, default=0.5, help='Drift magnitude of the last month, between 0 and 1. Increases linearly from 0 in the first month.')
+    parser.add_argument('--chunk_size', type=int, default=DEFAULT_CHUNK_SIZE, help='Number of rows generated and written at a time.')
+    args = parser.parse_args()
+
+    generate_synthetic_data(args.output_dir, args.n_rows, start=args.start, months=args.months, seed=args.seed, drift=args.drift, chunk_size=args.chunk_size)
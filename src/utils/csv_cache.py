@@ -0,0 +1,110 @@
+import json
+import os
+from os import path
+from typing import Iterator
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from src.utils.logging import log_info
+from src.utils.manifest import file_fingerprint
+from src.utils.schema import TAXI_SCHEMA
+
+# Bump whenever the declared schema or the parse options change, so cached conversions are regenerated
+CSV_CACHE_VERSION = 1
+CSV_CACHE_DIRNAME = '.csv_cache'
+CACHE_METADATA_KEY = b'csv_cache'
+# Bytes parsed per block, each block is parsed on its own thread and becomes one record batch
+DEFAULT_BLOCK_SIZE = 64 * 1024 * 1024
+# ISO timestamps as in the TLC exports, and the US format of older extracts, e.g. '01/31/2019 11:59:59 PM'
+TIMESTAMP_PARSERS = [pa_csv.ISO8601, '%Y-%m-%d %H:%M:%S', '%m/%d/%Y %I:%M:%S %p', '%m/%d/%Y %H:%M']
+
+def open_csv_batches(csv_path: str, schema: pa.Schema = TAXI_SCHEMA, columns: list[str] = None, streaming: bool = False, block_size: int = DEFAULT_BLOCK_SIZE) -> tuple[pa.Schema, Iterator[pa.RecordBatch]]:
+    '''
+    Reads a CSV file with the Arrow CSV reader. Columns of the declared schema are converted to their declared types,
+    including native timestamp parsing, other columns are inferred.
+    Args:
+        csv_path (str): Path to the CSV file.
+        schema (pa.Schema, optional): Declared column types. Defaults to TAXI_SCHEMA.
+        columns (list[str], optional): Columns to read. All columns are read if None. Defaults to None.
+        streaming (bool, optional): Whether to read block by block with bounded memory. Otherwise the file is parsed
+            at once by all threads, which is faster but holds the whole table in memory. Defaults to False.
+        block_size (int, optional): Number of bytes parsed per block. Defaults to DEFAULT_BLOCK_SIZE.
+    Returns:
+        tuple[pa.Schema, Iterator[pa.RecordBatch]]: The schema of the batches and the batch iterator.
+    '''
+    read_options = pa_csv.ReadOptions(use_threads=True, block_size=block_size)
+    convert_options = pa_csv.ConvertOptions(
+        column_types={field.name: field.type for field in schema},
+        timestamp_parsers=TIMESTAMP_PARSERS,
+        strings_can_be_null=True,
+        include_columns=columns,
+    )
+    if streaming:
+        reader = pa_csv.open_csv(csv_path, read_options=read_options, convert_options=convert_options)
+        return reader.schema, reader
+    table = pa_csv.read_csv(csv_path, read_options=read_options, convert_options=convert_options)
+    return table.schema, iter(table.to_batches())
+
+def get_cache_path(csv_path: str, cache_dir: str = None) -> str:
+    '''
+    Returns the path of the parquet conversion of a CSV file.
+    Args:
+        csv_path (str): Path to the CSV file.
+        cache_dir (str, optional): Directory of the cached conversions. Defaults to CSV_CACHE_DIRNAME next to the CSV file.
+    Returns:
+        str: The path of the cached parquet file.
+    '''
+    cache_dir = cache_dir or path.join(path.dirname(csv_path), CSV_CACHE_DIRNAME)
+    return path.join(cache_dir, f'{path.splitext(path.basename(csv_path))[0]}.parquet')
+
+def read_cache_entry(cache_path: str) -> dict:
+    '''
+    Reads the fingerprint of the source CSV stored in the metadata of a cached conversion.
+    Args:
+        cache_path (str): Path of the cached parquet file.
+    Returns:
+        dict: The fingerprint and cache version, or an empty dict if there is no valid cached file.
+    '''
+    if not path.exists(cache_path):
+        return {}
+    try:
+        metadata = pq.read_schema(cache_path).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return {}
+    try:
+        return json.loads(metadata.get(CACHE_METADATA_KEY, b'{}'))
+    except ValueError:
+        return {}
+
+def convert_csv_to_parquet(csv_path: str, cache_dir: str = None, schema: pa.Schema = TAXI_SCHEMA, streaming: bool = False, block_size: int = DEFAULT_BLOCK_SIZE) -> str:
+    '''
+    Converts a CSV file to parquet once and returns the cached conversion on later calls. The fingerprint of the CSV
+    file is stored in the parquet metadata, so the conversion is redone only if the CSV file changes.
+    Args:
+        csv_path (str): Path to the CSV file.
+        cache_dir (str, optional): Directory of the cached conversions. Defaults to CSV_CACHE_DIRNAME next to the CSV file.
+        schema (pa.Schema, optional): Declared column types. Defaults to TAXI_SCHEMA.
+        streaming (bool, optional): Whether to convert block by block with bounded memory, see open_csv_batches. Defaults to False.
+        block_size (int, optional): Number of bytes parsed per block. Defaults to DEFAULT_BLOCK_SIZE.
+    Returns:
+        str: The path of the parquet file.
+    '''
+    cache_path = get_cache_path(csv_path, cache_dir)
+    entry = read_cache_entry(cache_path)
+    fingerprint = file_fingerprint(csv_path, previous_entry=entry.get('source'))
+    if entry.get('version') == CSV_CACHE_VERSION and entry.get('source', {}).get('sha256') == fingerprint['sha256']:
+        return cache_path
+
+    os.makedirs(path.dirname(cache_path), exist_ok=True)
+    csv_schema, batches = open_csv_batches(csv_path, schema=schema, streaming=streaming, block_size=block_size)
+    csv_schema = csv_schema.with_metadata({CACHE_METADATA_KEY: json.dumps({'version': CSV_CACHE_VERSION, 'source': fingerprint})})
+    # Unique per process, so parallel workers converting the same file do not write into each other's output
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    rows = 0
+    with pq.ParquetWriter(tmp_path, csv_schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    os.replace(tmp_path, cache_path)
+    log_info(f'Converted {csv_path} to {cache_path} ({rows} rows)')
+    return cache_path
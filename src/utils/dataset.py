@@ -0,0 +1,220 @@
+import glob
+import os
+from os import path
+from functools import reduce
+from typing import Iterable
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from src.utils.schema import compact_dtypes
+
+DATASET_DIRNAME = 'dataset'
+DATETIME_COLUMN = 'lpep_pickup_datetime'
+# Hive partitions year=YYYY/month=M/day=D, derived from the pickup time
+PARTITION_SCHEMA = pa.schema([('year', pa.int16()), ('month', pa.int8()), ('day', pa.int8())])
+PARTITION_COLUMNS = PARTITION_SCHEMA.names
+# Large enough for efficient scans, small enough that statistics can skip parts of busy days
+DEFAULT_ROW_GROUP_SIZE = 256_000
+
+def get_partitioning() -> ds.Partitioning:
+    return ds.partitioning(PARTITION_SCHEMA, flavor='hive')
+
+def add_partition_columns(data: pa.RecordBatch | pa.Table) -> pa.RecordBatch | pa.Table:
+    '''
+    Appends the year, month and day of the pickup time as partition columns.
+    Args:
+        data (pa.RecordBatch | pa.Table): Processed taxi trip data.
+    Returns:
+        pa.RecordBatch | pa.Table: The data with the partition columns.
+    '''
+    pickup = data.column(DATETIME_COLUMN)
+    for name, function in zip(PARTITION_COLUMNS, [pc.year, pc.month, pc.day]):
+        data = data.append_column(PARTITION_SCHEMA.field(name), pc.cast(function(pickup), PARTITION_SCHEMA.field(name).type))
+    return data
+
+def write_partitioned(data: pa.Table | Iterable[pa.RecordBatch], schema: pa.Schema, dataset_dir: str, basename: str, row_group_size: int = DEFAULT_ROW_GROUP_SIZE, min_rows_per_group: int = None) -> list[str]:
+    '''
+    Writes processed data into a hive-partitioned parquet dataset. Files are named after basename, so the outputs of
+    one raw file can be replaced or removed without touching other files in the same partitions.
+    Row groups hold at most row_group_size rows and carry column statistics, so readers can skip row groups by predicate.
+    Rows of each partition are buffered until min_rows_per_group are collected, so batches streamed into many
+    partitions should pass 0 to keep memory bounded by the batch size.
+    Args:
+        data (pa.Table | Iterable[pa.RecordBatch]): The data, including the partition columns (see add_partition_columns).
+        schema (pa.Schema): The schema of the data.
+        dataset_dir (str): Root directory of the dataset.
+        basename (str): Prefix of the written files.
+        row_group_size (int, optional): Maximum number of rows per row group. Defaults to DEFAULT_ROW_GROUP_SIZE.
+        min_rows_per_group (int, optional): Number of rows buffered per partition before a row group is written. Defaults to row_group_size.
+    Returns:
+        list[str]: Paths of the written files, relative to dataset_dir.
+    '''
+    written = []
+    parquet_format = ds.ParquetFileFormat()
+    ds.write_dataset(
+        data,
+        dataset_dir,
+        schema=schema,
+        format=parquet_format,
+        partitioning=get_partitioning(),
+        basename_template=f'{basename}-{{i}}.parquet',
+        existing_data_behavior='overwrite_or_ignore',
+        file_options=parquet_format.make_write_options(write_statistics=True),
+        min_rows_per_group=row_group_size if min_rows_per_group is None else min_rows_per_group,
+        max_rows_per_group=row_group_size,
+        file_visitor=lambda written_file: written.append(path.relpath(written_file.path, dataset_dir)),
+    )
+    return sorted(written)
+
+def remove_partitioned_files(dataset_dir: str, basename: str) -> int:
+    '''
+    Removes all files written with the given basename from a partitioned dataset.
+    Args:
+        dataset_dir (str): Root directory of the dataset.
+        basename (str): Prefix of the files, as passed to write_partitioned.
+    Returns:
+        int: The number of removed files.
+    '''
+    files = glob.glob(path.join(glob.escape(dataset_dir), '**', f'{glob.escape(basename)}-*.parquet'), recursive=True)
+    for file in files:
+        os.remove(file)
+    return len(files)
+
+def list_partitions(dataset_dir: str, depth: int = 2) -> list[dict]:
+    '''
+    Lists the partitions of a dataset down to the given depth, e.g. all year/month partitions for depth 2.
+    Args:
+        dataset_dir (str): Root directory of the dataset.
+        depth (int, optional): Number of partition levels. Defaults to 2.
+    Returns:
+        list[dict]: The partition values in chronological order, e.g. [{'year': 2024, 'month': 1}, ...].
+    '''
+    partitions = [{}]
+    for name in PARTITION_COLUMNS[:depth]:
+        children = []
+        for partition in partitions:
+            partition_dir = path.join(dataset_dir, *(f'{key}={value}' for key, value in partition.items()))
+            values = sorted(int(entry.split('=', 1)[1]) for entry in os.listdir(partition_dir) if entry.startswith(f'{name}=') and path.isdir(path.join(partition_dir, entry)))
+            children.extend({**partition, name: value} for value in values)
+        partitions = children
+    return partitions
+
+def list_dataset_files(dataset_dir: str) -> list[str]:
+    '''
+    Lists the parquet files of a partitioned dataset.
+    Args:
+        dataset_dir (str): Root directory of the dataset.
+    Returns:
+        list[str]: Paths of the files relative to dataset_dir, in partition order.
+    '''
+    files = [path.relpath(file, dataset_dir) for file in glob.glob(path.join(glob.escape(dataset_dir), '**', '*.parquet'), recursive=True)]
+    # Partition values are compared as numbers, a string sort would put month=10 before month=9
+    return sorted(files, key=lambda file: ([int(part.split('=', 1)[1]) for part in path.dirname(file).split(os.sep) if '=' in part], file))
+
+def get_partition_day(file: str) -> pd.Timestamp:
+    '''
+    Returns the day a file of the partitioned dataset belongs to, from its year=/month=/day= path.
+    Args:
+        file (str): Path of a file in the dataset.
+    Returns:
+        pd.Timestamp: The day.
+    '''
+    values = dict(part.split('=', 1) for part in file.replace(os.sep, '/').split('/') if '=' in part)
+    return pd.Timestamp(year=int(values['year']), month=int(values['month']), day=int(values['day']))
+
+def get_partition_filter(start: pd.Timestamp = None, end: pd.Timestamp = None) -> ds.Expression:
+    '''
+    Returns a filter on the partition columns that selects the days overlapping [start, end), so whole partitions
+    outside the time range are skipped without opening their files.
+    Args:
+        start (pd.Timestamp, optional): Inclusive start of the time range. Defaults to None.
+        end (pd.Timestamp, optional): Exclusive end of the time range. Defaults to None.
+    Returns:
+        ds.Expression: The filter, or None if the range is unbounded.
+    '''
+    if start is None or end is None:
+        # Without both bounds, rely on the row group statistics of the datetime column
+        return None
+    days = pd.date_range(pd.Timestamp(start).floor('D'), pd.Timestamp(end) - pd.Timedelta(1, 'ns'), freq='D')
+    if len(days) == 0:
+        return ds.scalar(False)
+    # Select whole months when possible to keep the expression small
+    expressions = []
+    for (year, month), month_days in pd.Series(days.day, index=days).groupby([days.year, days.month]):
+        expression = (ds.field('year') == year) & (ds.field('month') == month)
+        if len(month_days) < pd.Timestamp(year=year, month=month, day=1).days_in_month:
+            expression = expression & ds.field('day').isin(month_days.tolist())
+        expressions.append(expression)
+    return reduce(lambda left, right: left | right, expressions)
+
+def build_filter(dataset: ds.Dataset, start: pd.Timestamp = None, end: pd.Timestamp = None, filters: dict = None) -> ds.Expression:
+    '''
+    Builds a filter expression for a processed dataset. The time range is applied to the pickup time, which the
+    row group statistics can evaluate, and to the partition columns if the dataset is partitioned.
+    Args:
+        dataset (ds.Dataset): The dataset to filter.
+        start (pd.Timestamp, optional): Inclusive start of the pickup time range. Defaults to None.
+        end (pd.Timestamp, optional): Exclusive end of the pickup time range. Defaults to None.
+        filters (dict, optional): Allowed values per column, e.g. {'PULocationID': [1, 2]}. Defaults to None.
+    Returns:
+        ds.Expression: The filter, or None if nothing is filtered.
+    '''
+    expressions = []
+    if start is not None or end is not None:
+        datetime_type = dataset.schema.field(DATETIME_COLUMN).type
+        if start is not None:
+            expressions.append(ds.field(DATETIME_COLUMN) >= pa.scalar(pd.Timestamp(start).to_pydatetime(), type=datetime_type))
+        if end is not None:
+            expressions.append(ds.field(DATETIME_COLUMN) < pa.scalar(pd.Timestamp(end).to_pydatetime(), type=datetime_type))
+        if all(name in dataset.schema.names for name in PARTITION_COLUMNS):
+            partition_filter = get_partition_filter(start, end)
+            if partition_filter is not None:
+                expressions.append(partition_filter)
+    for column, values in (filters or {}).items():
+        expressions.append(ds.field(column).isin(list(values)))
+    return reduce(lambda left, right: left & right, expressions) if expressions else None
+
+def read_processed(data_path: str, columns: list[str] = None, start: pd.Timestamp = None, end: pd.Timestamp = None, filters: dict = None) -> pd.DataFrame:
+    '''
+    Reads processed data from a parquet file or a partitioned dataset directory. Filters are pushed down, so only
+    the partitions and row groups that can match are read, and only the requested columns are decoded.
+    Args:
+        data_path (str): Path to a processed parquet file or to the root directory of a partitioned dataset.
+        columns (list[str], optional): Columns to read. All data columns (without the partition columns) are read if None. Defaults to None.
+        start (pd.Timestamp, optional): Inclusive start of the pickup time range. Defaults to None.
+        end (pd.Timestamp, optional): Exclusive end of the pickup time range. Defaults to None.
+        filters (dict, optional): Allowed values per column, e.g. {'PULocationID': [1, 2]} or {'year': [2024], 'month': [1]}. Defaults to None.
+    Returns:
+        pd.DataFrame: The matching rows with compact dtypes.
+    '''
+    if path.isdir(data_path):
+        dataset = ds.dataset(data_path, format='parquet', partitioning=get_partitioning())
+    else:
+        dataset = ds.dataset(data_path, format='parquet')
+    if columns is None:
+        columns = [name for name in dataset.schema.names if not (path.isdir(data_path) and name in PARTITION_COLUMNS)]
+    table = dataset.to_table(columns=columns, filter=build_filter(dataset, start=start, end=end, filters=filters))
+    return compact_dtypes(table.to_pandas())
+
+def parse_filters(filters: list[str]) -> dict:
+    '''
+    Parses command line filters of the form 'column=value1,value2'. Numeric values are converted to numbers.
+    Args:
+        filters (list[str]): The filters.
+    Returns:
+        dict: Allowed values per column.
+    '''
+    def parse_value(value: str):
+        for convert in (int, float):
+            try:
+                return convert(value)
+            except ValueError:
+                pass
+        return value
+
+    parsed = {}
+    for item in filters or []:
+        column, values = item.split('=', 1)
+        parsed[column.strip()] = [parse_value(value.strip()) for value in values.split(',')]
+    return parsed
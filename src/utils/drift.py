@@ -0,0 +1,373 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+from scipy.spatial import distance
+
+DEFAULT_N_BINS = 100
+DEFAULT_DRIFT_SHARE = 0.5
+# Numerical columns with at most this many distinct reference values also keep exact value counts
+MAX_DISCRETE_VALUES = 20
+QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+# Default thresholds of the Evidently stattests
+DEFAULT_THRESHOLDS = {
+    'wasserstein': 0.1,
+    'psi': 0.1,
+    'jensenshannon': 0.1,
+    'ks': 0.05,
+    'chisquare': 0.05,
+    'z': 0.05,
+}
+# Column types each stattest can be chosen for, as in Evidently
+STATTEST_COLUMN_TYPES = {
+    'wasserstein': ['num'],
+    'psi': ['num', 'cat'],
+    'jensenshannon': ['num', 'cat'],
+    'ks': ['num'],
+    'chisquare': ['cat'],
+    'z': ['cat'],
+}
+
+def _category_key(value) -> str:
+    '''
+    Normalizes a category value to a string key, so integer IDs read as floats (e.g. because of missing values) still match.
+    '''
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return str(value)
+
+def _value_counts(values: pd.Series) -> dict:
+    counts = values.value_counts(dropna=True)
+    result = {}
+    for value, count in counts.items():
+        key = _category_key(value)
+        result[key] = result.get(key, 0) + int(count)
+    return result
+
+def _finite_values(series: pd.Series) -> tuple[np.ndarray, int]:
+    '''
+    Returns the finite values of a numerical series and the number of missing (NaN or infinite) values.
+    '''
+    values = pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    finite = np.isfinite(values)
+    return values[finite], int((~finite).sum())
+
+def count_missing_values(df: pd.DataFrame) -> int:
+    '''
+    Counts the missing values in all columns of a dataframe, like Evidently's DatasetMissingValuesMetric: nulls,
+    infinite numbers and empty strings.
+    Args:
+        df (pd.DataFrame): The data.
+    Returns:
+        int: The number of missing values.
+    '''
+    missing = 0
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_numeric_dtype(series):
+            missing += _finite_values(series)[1]
+            continue
+        missing += int(series.isna().sum())
+        if pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series) or isinstance(series.dtype, pd.CategoricalDtype):
+            missing += int((series == '').sum())
+    return missing
+
+def bin_values(values: np.ndarray, bin_edges: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Assigns values to fixed bins with an additional underflow and overflow bin.
+    Args:
+        values (np.ndarray): Finite values to bin.
+        bin_edges (np.ndarray): Increasing bin edges.
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Counts and sums of the values per bin, [underflow, bins..., overflow].
+    '''
+    n_bins = len(bin_edges) - 1
+    index = np.searchsorted(bin_edges[1:-1], values, side='right') + 1
+    index[values < bin_edges[0]] = 0
+    index[values > bin_edges[-1]] = n_bins + 1
+    counts = np.bincount(index, minlength=n_bins + 2)
+    sums = np.bincount(index, weights=values, minlength=n_bins + 2)
+    return counts, sums
+
+def profile_numerical(series: pd.Series, n_bins: int = DEFAULT_N_BINS) -> dict:
+    '''
+    Builds a compact profile of a numerical column: moments, quantiles, a histogram over fixed reference-quantile
+    bins and, for columns with few distinct values, exact value counts.
+    Args:
+        series (pd.Series): The column values.
+        n_bins (int, optional): Number of quantile bins. Defaults to DEFAULT_N_BINS.
+    Returns:
+        dict: The JSON-serializable profile.
+    '''
+    values, missing = _finite_values(series)
+    profile = {'column_type': 'num', 'count': int(len(values)), 'missing': missing}
+    if len(values) == 0:
+        return profile
+    bin_edges = np.unique(np.quantile(values, np.linspace(0, 1, n_bins + 1)))
+    if len(bin_edges) == 1:
+        bin_edges = np.array([bin_edges[0], bin_edges[0]])
+    counts, sums = bin_values(values, bin_edges)
+    distinct = np.unique(values)
+    profile.update({
+        'mean': float(values.mean()),
+        'std': float(values.std()),
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'quantiles': {str(q): float(v) for q, v in zip(QUANTILES, np.quantile(values, QUANTILES))},
+        'bin_edges': bin_edges.tolist(),
+        'bin_counts': counts.tolist(),
+        'bin_sums': sums.tolist(),
+        'value_counts': _value_counts(pd.Series(values)) if len(distinct) <= MAX_DISCRETE_VALUES else None,
+    })
+    return profile
+
+def profile_categorical(series: pd.Series) -> dict:
+    '''
+    Builds a compact profile of a categorical column: category frequencies and missing-value count.
+    Args:
+        series (pd.Series): The column values.
+    Returns:
+        dict: The JSON-serializable profile.
+    '''
+    missing = int(series.isna().sum())
+    return {'column_type': 'cat', 'count': int(len(series) - missing), 'missing': missing, 'value_counts': _value_counts(series)}
+
+def build_profile(df: pd.DataFrame, num_features: list[str], cat_features: list[str], prediction: str = 'prediction', n_bins: int = DEFAULT_N_BINS) -> dict:
+    '''
+    Builds the profile of a dataset for drift detection. Only the profile of the reference data is needed to
+    compute drift, so it can be stored instead of the reference frame. Missing values are also counted over the
+    columns that are not profiled.
+    Args:
+        df (pd.DataFrame): The dataset.
+        num_features (list[str]): List of numerical feature column names.
+        cat_features (list[str]): List of categorical feature column names.
+        prediction (str, optional): Name of the numerical prediction column, ignored if None or absent. Defaults to 'prediction'.
+        n_bins (int, optional): Number of histogram bins for numerical columns. Defaults to DEFAULT_N_BINS.
+    Returns:
+        dict: The JSON-serializable profile.
+    '''
+    columns = {}
+    if prediction and prediction in df.columns:
+        columns[prediction] = profile_numerical(df[prediction], n_bins=n_bins)
+    for column in num_features:
+        columns[column] = profile_numerical(df[column], n_bins=n_bins)
+    for column in cat_features:
+        columns[column] = profile_categorical(df[column])
+    return {
+        'num_features': list(num_features),
+        'cat_features': list(cat_features),
+        'prediction': prediction if prediction in columns else None,
+        'n_bins': n_bins,
+        'n_rows': int(len(df)),
+        'n_columns': int(df.shape[1]),
+        'missing': count_missing_values(df),
+        'columns': columns,
+    }
+
+def _fill_zeroes(percents: np.ndarray) -> np.ndarray:
+    # Same replacement of empty buckets as Evidently, to keep logarithms finite
+    non_zero = percents[percents != 0]
+    fill = non_zero.min() / 10**6 if non_zero.min() <= 0.0001 else 0.0001
+    return np.where(percents == 0, fill, percents)
+
+def _sort_key(key: str) -> tuple:
+    try:
+        return (0, float(key), key)
+    except ValueError:
+        return (1, 0.0, key)
+
+def _aligned_counts(reference_counts: dict, current_counts: dict) -> tuple[np.ndarray, np.ndarray]:
+    keys = sorted(set(current_counts) | set(reference_counts), key=_sort_key)
+    return (np.array([reference_counts.get(key, 0) for key in keys], dtype=np.float64),
+            np.array([current_counts.get(key, 0) for key in keys], dtype=np.float64))
+
+def _wasserstein_binned(reference: dict, current_counts: np.ndarray, current_sums: np.ndarray) -> float:
+    '''
+    Wasserstein-1 distance between two histograms over the same bins, with each bin's mass placed at the mean of
+    its values, normed by the reference standard deviation like Evidently's 'wasserstein' test.
+    '''
+    reference_counts = np.asarray(reference['bin_counts'], dtype=np.float64)
+    reference_sums = np.asarray(reference['bin_sums'], dtype=np.float64)
+    ref_mask, cur_mask = reference_counts > 0, current_counts > 0
+    positions = np.concatenate([reference_sums[ref_mask] / reference_counts[ref_mask], current_sums[cur_mask] / current_counts[cur_mask]])
+    weights = np.concatenate([reference_counts[ref_mask] / reference_counts.sum(), -current_counts[cur_mask] / current_counts.sum()])
+    order = np.argsort(positions, kind='stable')
+    positions, cdf_diff = positions[order], np.cumsum(weights[order])
+    distance_value = float(np.sum(np.abs(cdf_diff[:-1]) * np.diff(positions)))
+    return distance_value / max(reference['std'], 0.001)
+
+def _sturges_counts(reference: dict, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Counts reference and current values in equal-width Sturges bins over their combined range, like Evidently bins
+    continuous columns for PSI and Jensen-Shannon. Reference counts are interpolated from its quantile histogram.
+    '''
+    n_bins = int(np.ceil(np.log2(reference['count'] + len(values)) + 1))
+    edges = np.linspace(min(reference['min'], values.min()), max(reference['max'], values.max()), n_bins + 1)
+    current_counts = np.histogram(values, edges)[0].astype(np.float64)
+    # Reference values are spread evenly within each quantile bin
+    reference_cdf = np.concatenate([[0.0], np.cumsum(reference['bin_counts'][1:-1], dtype=np.float64)])
+    reference_counts = np.diff(np.interp(edges, np.asarray(reference['bin_edges']), reference_cdf))
+    return reference_counts, current_counts
+
+def _ks_binned(reference_counts: np.ndarray, current_counts: np.ndarray) -> float:
+    '''
+    Two-sample Kolmogorov-Smirnov p-value from histograms over the same bins, using the asymptotic distribution.
+    '''
+    n_ref, n_cur = reference_counts.sum(), current_counts.sum()
+    statistic = float(np.max(np.abs(np.cumsum(reference_counts) / n_ref - np.cumsum(current_counts) / n_cur)))
+    effective_n = np.round(n_ref * n_cur / (n_ref + n_cur))
+    return float(stats.kstwo.sf(statistic, effective_n))
+
+def _psi(reference_counts: np.ndarray, current_counts: np.ndarray) -> float:
+    reference_percents = _fill_zeroes(reference_counts / reference_counts.sum())
+    current_percents = _fill_zeroes(current_counts / current_counts.sum())
+    return float(np.sum((reference_percents - current_percents) * np.log(reference_percents / current_percents)))
+
+def _jensenshannon(reference_counts: np.ndarray, current_counts: np.ndarray) -> float:
+    return float(distance.jensenshannon(reference_counts / reference_counts.sum(), current_counts / current_counts.sum()))
+
+def _chisquare(reference_counts: np.ndarray, current_counts: np.ndarray) -> float:
+    expected = reference_counts * current_counts.sum() / reference_counts.sum()
+    return float(stats.chisquare(current_counts, expected)[1])
+
+def _z_test(reference_counts: np.ndarray, current_counts: np.ndarray) -> float:
+    # Two-proportion z-test on the share of the first category
+    n_ref, n_cur = reference_counts.sum(), current_counts.sum()
+    if np.count_nonzero(reference_counts + current_counts) <= 1:
+        return 1.0
+    p_ref, p_cur = 1 - reference_counts[0] / n_ref, 1 - current_counts[0] / n_cur
+    pooled = (p_ref * n_ref + p_cur * n_cur) / (n_ref + n_cur)
+    z_stat = (p_ref - p_cur) / np.sqrt(pooled * (1 - pooled) * (1 / n_ref + 1 / n_cur))
+    return float(2 * (1 - stats.norm.cdf(np.abs(z_stat))))
+
+def select_stattest(reference: dict, n_values: int) -> str:
+    '''
+    Selects the stattest the same way Evidently does by default, based on the reference size and number of distinct values.
+    Args:
+        reference (dict): Profile of the reference column.
+        n_values (int): Number of distinct values in reference and current data combined.
+    Returns:
+        str: The name of the stattest.
+    '''
+    if reference['count'] <= 1000:
+        if reference['column_type'] == 'num' and n_values > 5:
+            return 'ks'
+        return 'chisquare' if n_values > 2 else 'z'
+    if reference['column_type'] == 'num' and n_values > 5:
+        return 'wasserstein'
+    return 'jensenshannon'
+
+def column_drift(reference: dict, current: pd.Series, stattest: str = None, threshold: float = None) -> dict:
+    '''
+    Computes the drift of a single column against its reference profile.
+    Args:
+        reference (dict): Profile of the reference column, see build_profile.
+        current (pd.Series): Current values of the column.
+        stattest (str, optional): One of 'wasserstein', 'psi', 'jensenshannon', 'ks', 'chisquare', 'z'. Selected like Evidently if None. Defaults to None.
+        threshold (float, optional): Drift threshold. Defaults to the threshold of the stattest.
+    Returns:
+        dict: The stattest, threshold, drift score, whether drift was detected and missing-value counts.
+    '''
+    if reference['column_type'] == 'num':
+        values, current_missing = _finite_values(current)
+        current_count = len(values)
+    else:
+        current_missing = int(current.isna().sum())
+        current_count = len(current) - current_missing
+    result = {
+        'column_type': reference['column_type'],
+        'reference_missing': reference['missing'],
+        'current_missing': current_missing,
+        'reference_count': reference['count'],
+        'current_count': current_count,
+    }
+    if reference['count'] == 0 or current_count == 0:
+        return {**result, 'stattest': None, 'threshold': None, 'drift_score': None, 'drift_detected': False}
+
+    # Exact value counts are available for categorical and low-cardinality numerical columns
+    current_value_counts = None
+    if reference.get('value_counts') is not None:
+        current_value_counts = _value_counts(pd.Series(values) if reference['column_type'] == 'num' else current)
+        n_values = len(set(reference['value_counts']) | set(current_value_counts))
+    else:
+        n_values = MAX_DISCRETE_VALUES + 1
+
+    stattest = stattest or select_stattest(reference, n_values)
+    threshold = DEFAULT_THRESHOLDS[stattest] if threshold is None else threshold
+
+    if reference['column_type'] == 'cat' and stattest not in ('jensenshannon', 'psi', 'chisquare', 'z'):
+        raise ValueError(f'Stattest {stattest} is not supported for categorical columns')
+    if current_value_counts is not None and stattest in ('jensenshannon', 'psi', 'chisquare', 'z'):
+        reference_counts, current_counts = _aligned_counts(reference['value_counts'], current_value_counts)
+    elif stattest in ('jensenshannon', 'psi'):
+        reference_counts, current_counts = _sturges_counts(reference, values)
+    else:
+        reference_counts = np.asarray(reference['bin_counts'], dtype=np.float64)
+        current_counts, current_sums = bin_values(values, np.asarray(reference['bin_edges']))
+        current_counts = current_counts.astype(np.float64)
+
+    if stattest == 'wasserstein':
+        score = _wasserstein_binned(reference, current_counts, current_sums)
+    elif stattest == 'ks':
+        score = _ks_binned(reference_counts, current_counts)
+    elif stattest == 'psi':
+        score = _psi(reference_counts, current_counts)
+    elif stattest == 'jensenshannon':
+        score = _jensenshannon(reference_counts, current_counts)
+    elif stattest == 'chisquare':
+        score = _chisquare(reference_counts, current_counts)
+    elif stattest == 'z':
+        score = _z_test(reference_counts, current_counts)
+    else:
+        raise ValueError(f'Unknown stattest: {stattest}')
+
+    # Distances detect drift above the threshold, p-values below it
+    drift_detected = score >= threshold if stattest in ('wasserstein', 'psi', 'jensenshannon') else score < threshold
+    return {**result, 'stattest': stattest, 'threshold': threshold, 'drift_score': score, 'drift_detected': bool(drift_detected)}
+
+def compute_drift(reference_profile: dict, current: pd.DataFrame, stattest: str = None, drift_share: float = DEFAULT_DRIFT_SHARE) -> dict:
+    '''
+    Computes per-column drift, dataset drift and missing values of the current data against a reference profile.
+    Mirrors Evidently's ColumnDriftMetric and DatasetDriftMetric over the prediction, numerical and categorical
+    columns, and DatasetMissingValuesMetric over all columns of the data.
+    Args:
+        reference_profile (dict): Profile of the reference data, see build_profile.
+        current (pd.DataFrame): The current data.
+        stattest (str, optional): Stattest used for all columns. Selected per column like Evidently if None. Defaults to None.
+        drift_share (float, optional): Share of drifted columns above which the dataset is considered drifted. Defaults to DEFAULT_DRIFT_SHARE.
+    Returns:
+        dict: JSON-serializable drift results with 'columns', 'dataset_drift' and 'missing_values' sections.
+    '''
+    columns = {
+        column: column_drift(reference, current[column], stattest=stattest)
+        for column, reference in reference_profile['columns'].items()
+    }
+    number_of_drifted_columns = sum(1 for result in columns.values() if result['drift_detected'])
+    share_of_drifted_columns = number_of_drifted_columns / len(columns) if columns else 0.0
+
+    n_columns = len(columns)
+    reference_rows, reference_columns, reference_missing = reference_profile['n_rows'], reference_profile['n_columns'], reference_profile['missing']
+    current_rows, current_columns, current_missing = int(len(current)), int(current.shape[1]), count_missing_values(current)
+    return {
+        'columns': columns,
+        'dataset_drift': {
+            'drift_share': drift_share,
+            'number_of_columns': n_columns,
+            'number_of_drifted_columns': number_of_drifted_columns,
+            'share_of_drifted_columns': share_of_drifted_columns,
+            'dataset_drift': bool(share_of_drifted_columns >= drift_share),
+        },
+        'missing_values': {
+            'reference': {
+                'number_of_rows': reference_rows,
+                'number_of_columns': reference_columns,
+                'number_of_missing_values': reference_missing,
+                'share_of_missing_values': reference_missing / (reference_rows * reference_columns) if reference_rows and reference_columns else 0.0,
+            },
+            'current': {
+                'number_of_rows': current_rows,
+                'number_of_columns': current_columns,
+                'number_of_missing_values': current_missing,
+                'share_of_missing_values': current_missing / (current_rows * current_columns) if current_rows and current_columns else 0.0,
+            },
+        },
+    }
@@ -0,0 +1,115 @@
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+from src.utils.logging import log_info
+from src.utils.manifest import save_manifest
+
+# Aggregates of the current process, see get_summary
+_lock = threading.Lock()
+_timers = {}
+_counters = {}
+
+def get_memory_mb() -> tuple[float, float]:
+    '''
+    Returns the current and peak resident set size of this process.
+    Returns:
+        tuple[float, float]: Current and peak RSS in MiB. Both are the peak if the current size is not available.
+    '''
+    try:
+        with open('/proc/self/status') as file:
+            status = {line.split(':')[0]: int(line.split()[1]) / 2**10 for line in file if line.startswith(('VmRSS', 'VmHWM'))}
+        return status['VmRSS'], status['VmHWM']
+    except (OSError, KeyError):
+        # ru_maxrss is in KiB on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+        return peak, peak
+
+def reset_peak_memory() -> None:
+    # Linux only: resets the peak RSS to the current RSS, e.g. so a benchmark measures a step without loading its inputs
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+    except OSError:
+        pass
+
+def increment(name: str, value: float = 1) -> None:
+    '''
+    Adds to a counter, e.g. the number of bytes downloaded.
+    Args:
+        name (str): Name of the counter.
+        value (float, optional): Amount to add. Defaults to 1.
+    Returns:
+        None
+    '''
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+@contextmanager
+def timer(name: str, **fields) -> Iterator[dict]:
+    '''
+    Measures the wall time of a block and the RSS high-water mark of the process at its end, logs them together with
+    the fields as a structured record and adds them to the summary of the run. Fields can be added inside the block,
+    and a 'rows' field is also summed up in the summary:
+        with timer('process_df', rows_in=len(df)) as fields:
+            ...
+            fields['rows'] = len(df)
+    Args:
+        name (str): Name of the timer, e.g. the function being measured.
+        **fields: Context to log with the measurement, e.g. the file name.
+    Yields:
+        dict: The fields, to add results such as row counts to.
+    '''
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        elapsed = time.perf_counter() - start
+        rss_mb, peak_rss_mb = get_memory_mb()
+        with _lock:
+            stats = _timers.setdefault(name, {'count': 0, 'total_s': 0.0, 'max_s': 0.0, 'rows': 0, 'peak_rss_mb': 0.0})
+            stats['count'] += 1
+            stats['total_s'] += elapsed
+            stats['max_s'] = max(stats['max_s'], elapsed)
+            stats['rows'] += fields.get('rows', 0)
+            stats['peak_rss_mb'] = max(stats['peak_rss_mb'], peak_rss_mb)
+        log_info(f'{name} took {elapsed:.3f}s (RSS {rss_mb:.0f} MiB, peak {peak_rss_mb:.0f} MiB)', metric='timer', timer=name, elapsed_s=elapsed, rss_mb=rss_mb, peak_rss_mb=peak_rss_mb, **fields)
+
+def get_summary() -> dict:
+    '''
+    Returns the timers and counters recorded in this process. Measurements of worker processes are only in the log.
+    Returns:
+        dict: Per timer the count, total and maximum seconds, rows and RSS high-water mark, the counters, and the peak RSS of the process in MiB.
+    '''
+    with _lock:
+        timers = {name: {**stats, 'rows_per_s': stats['rows'] / stats['total_s'] if stats['rows'] and stats['total_s'] else None} for name, stats in _timers.items()}
+        counters = dict(_counters)
+    return {'timers': timers, 'counters': counters, 'peak_rss_mb': get_memory_mb()[1]}
+
+def log_summary(output_path: str = None) -> dict:
+    '''
+    Logs the summary of the run, one line per timer, and optionally saves it as JSON.
+    Args:
+        output_path (str, optional): Where to save the summary. Defaults to None.
+    Returns:
+        dict: The summary, see get_summary.
+    '''
+    summary = get_summary()
+    for name, stats in sorted(summary['timers'].items(), key=lambda item: -item[1]['total_s']):
+        throughput = f', {stats["rows_per_s"]:.0f} rows/s' if stats['rows_per_s'] else ''
+        log_info(f'{name}: {stats["count"]} calls, {stats["total_s"]:.3f}s total, {stats["max_s"]:.3f}s max{throughput}, peak RSS {stats["peak_rss_mb"]:.0f} MiB', metric='timer_summary', timer=name, **stats)
+    for name, value in sorted(summary['counters'].items()):
+        log_info(f'{name}: {value}', metric='counter', counter=name, value=value)
+    log_info(f'Peak RSS of the run: {summary["peak_rss_mb"]:.0f} MiB', metric='peak_rss', peak_rss_mb=summary['peak_rss_mb'])
+    if output_path:
+        save_manifest(output_path, summary)
+        log_info(f'Run metrics saved to {output_path}')
+    return summary
+
+def reset() -> None:
+    with _lock:
+        _timers.clear()
+        _counters.clear()
@@ -1,17 +1,106 @@
+import atexit
+import json
 import logging
+import os
+import queue
+import threading
+import multiprocessing.util
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+CONSOLE_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DEFAULT_LOG_FILE = 'logs/app.log'
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.StreamHandler(), logging.FileHandler('logs/app.log')],
-)
 logger = logging.getLogger(__name__)
+_setup_lock = threading.Lock()
+_listener = None
+# Process the handlers were set up in, a forked worker inherits the queue handler but not the listener thread
+_setup_pid = None
+
+class JsonFormatter(logging.Formatter):
+    '''
+    Formats records as one JSON object per line, with the fields passed to log_info/log_warning/log_error as keys.
+    '''
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def setup_logging(log_file: str = None, level: str = None) -> None:
+    '''
+    Sets up non-blocking logging for the current process. Log calls only put the record on a queue, and a listener
+    thread writes it to the console and, as JSON lines, to the log file. Called on the first log call, so importing a
+    module does not touch the file system. Later calls in the same process do nothing.
+    Args:
+        log_file (str, optional): Path of the JSON log file, its directory is created if needed. Defaults to env LOG_FILE or DEFAULT_LOG_FILE, an empty LOG_FILE disables the file.
+        level (str, optional): Minimum level of the root logger. Defaults to env LOG_LEVEL or 'INFO'.
+    Returns:
+        None
+    '''
+    global _listener, _setup_pid
+    with _setup_lock:
+        if _setup_pid == os.getpid():
+            return
+        log_file = os.getenv('LOG_FILE', DEFAULT_LOG_FILE) if log_file is None else log_file
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        handlers = [console_handler]
+        if log_file:
+            log_dir = os.path.dirname(log_file)
+            if log_dir:
+                os.makedirs(log_dir, exist_ok=True)
+            file_handler = logging.FileHandler(log_file)
+            file_handler.setFormatter(JsonFormatter())
+            handlers.append(file_handler)
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if isinstance(handler, QueueHandler):
+                root.removeHandler(handler)
+        log_queue = queue.SimpleQueue()
+        root.addHandler(QueueHandler(log_queue))
+        root.setLevel(level or os.getenv('LOG_LEVEL', 'INFO'))
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        _setup_pid = os.getpid()
+        # Worker processes of multiprocessing exit without running atexit handlers, but run its finalizers
+        atexit.register(shutdown_logging)
+        multiprocessing.util.Finalize(None, shutdown_logging, exitpriority=0)
+
+def shutdown_logging() -> None:
+    '''
+    Writes all queued records and stops the listener thread. Runs automatically at exit.
+    Returns:
+        None
+    '''
+    global _listener, _setup_pid
+    with _setup_lock:
+        if _listener is None or _setup_pid != os.getpid():
+            return
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener, _setup_pid = None, None
+
+def _log(level: int, message: str, fields: dict) -> None:
+    if _setup_pid != os.getpid():
+        setup_logging()
+    logger.log(level, message, extra={'fields': fields} if fields else None)
+
+def log_info(message: str, **fields):
+    _log(logging.INFO, message, fields)
 
-def log_info(message: str):
-    logger.info(message)
-    
-def log_error(message: str):
-    logger.error(message)
+def log_error(message: str, **fields):
+    _log(logging.ERROR, message, fields)
 
-def log_warning(message: str):
-    logger.warning(message)
\ No newline at end of file
+def log_warning(message: str, **fields):
+    _log(logging.WARNING, message, fields)
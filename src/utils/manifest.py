@@ -0,0 +1,60 @@
+import hashlib
+import json
+import os
+import threading
+from os import path
+
+def load_manifest(manifest_path: str) -> dict:
+    '''
+    Loads a JSON manifest from disk.
+    Args:
+        manifest_path (str): Path to the manifest file.
+    Returns:
+        dict: The manifest content, or an empty dict if the file does not exist or is unreadable.
+    '''
+    if not path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r') as file:
+            return json.load(file)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def save_manifest(manifest_path: str, manifest: dict) -> None:
+    '''
+    Atomically writes a JSON manifest to disk. The content is written to a temporary file first and then renamed into place,
+    so readers never see a partially written manifest.
+    Args:
+        manifest_path (str): Path to the manifest file.
+        manifest (dict): The manifest content.
+    Returns:
+        None
+    '''
+    manifest_dir = path.dirname(manifest_path)
+    if manifest_dir:
+        os.makedirs(manifest_dir, exist_ok=True)
+    # Unique per process and thread, so concurrent writers of the same manifest do not write into each other's file
+    tmp_path = f'{manifest_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def file_fingerprint(file_path: str, previous_entry: dict = None, chunk_size: int = 8 * 1024 * 1024) -> dict:
+    '''
+    Computes a content fingerprint (SHA-256) of a file. If the size and modification time match a previous entry,
+    its fingerprint is reused instead of rereading the file.
+    Args:
+        file_path (str): Path to the file.
+        previous_entry (dict, optional): A previously computed fingerprint entry. Defaults to None.
+        chunk_size (int, optional): Number of bytes read at a time while hashing. Defaults to 8 MiB.
+    Returns:
+        dict: The fingerprint entry with 'sha256', 'size' and 'mtime_ns'.
+    '''
+    stat = os.stat(file_path)
+    if previous_entry and previous_entry.get('size') == stat.st_size and previous_entry.get('mtime_ns') == stat.st_mtime_ns and previous_entry.get('sha256'):
+        return {'sha256': previous_entry['sha256'], 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return {'sha256': digest.hexdigest(), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
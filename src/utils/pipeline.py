@@ -0,0 +1,162 @@
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, NamedTuple
+from src.utils.logging import log_info, log_error, log_warning
+from src.utils.manifest import load_manifest, save_manifest
+
+@dataclass
+class Task:
+    '''
+    A node of the pipeline DAG. The function is called with the results of the dependencies, keyed by task name, and
+    returns a JSON-serializable result that is kept in the pipeline state.
+    If key is given, it returns the inputs and parameters that determine the result. Together with the keys of the
+    dependencies it forms the cache key of the task, and the task is skipped if the key matches the previous run and
+    is_complete confirms that the outputs of the previous result still exist. Tasks without a key always run, and
+    their result takes the place of the key for their dependents.
+    A failure of an optional task is logged and its dependents run without its result, otherwise the dependents are
+    not run and the pipeline raises the error once all other tasks are finished.
+    '''
+    name: str
+    function: Callable[[dict], dict]
+    deps: list[str] = field(default_factory=list)
+    key: Callable[[], dict] = None
+    is_complete: Callable[[dict], bool] = None
+    optional: bool = False
+
+class TaskRun(NamedTuple):
+    '''
+    Outcome of a task: 'ran', 'skipped' (cached), 'failed' or 'upstream_failed'. Times are seconds since the start of the run.
+    '''
+    name: str
+    status: str
+    result: dict = None
+    key: str = None
+    start_s: float = 0.0
+    elapsed_s: float = 0.0
+    error: str = None
+
+def hash_key(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+def sort_tasks(tasks: list[Task]) -> list[Task]:
+    '''
+    Orders tasks so that every task comes after its dependencies.
+    Args:
+        tasks (list[Task]): The tasks.
+    Returns:
+        list[Task]: The tasks in dependency order, otherwise in the given order.
+    Throws:
+        ValueError: If task names are not unique, a dependency is unknown or the dependencies contain a cycle.
+    '''
+    by_name = {task.name: task for task in tasks}
+    if len(by_name) != len(tasks):
+        raise ValueError('Task names must be unique')
+    for task in tasks:
+        unknown = [dep for dep in task.deps if dep not in by_name]
+        if unknown:
+            raise ValueError(f'Task {task.name} depends on unknown tasks: {", ".join(unknown)}')
+    ordered, done = [], set()
+    while len(ordered) < len(tasks):
+        ready = [task for task in tasks if task.name not in done and all(dep in done for dep in task.deps)]
+        if not ready:
+            raise ValueError(f'Cyclic dependencies between tasks: {", ".join(sorted(set(by_name) - done))}')
+        ordered.extend(ready)
+        done.update(task.name for task in ready)
+    return ordered
+
+def run_pipeline(tasks: list[Task], state_path: str, timings_path: str = None, workers: int = 4, force: bool = False) -> dict[str, TaskRun]:
+    '''
+    Runs a DAG of tasks on a thread pool. A task starts as soon as its own dependencies are finished, so e.g. each
+    downloaded file can be preprocessed while other files are still downloading.
+    The key and result of every task that ran are saved to state_path, unchanged tasks are skipped on the next run.
+    Args:
+        tasks (list[Task]): The tasks.
+        state_path (str): Path of the JSON file with the keys and results of previous runs.
+        timings_path (str, optional): Path of a JSON file to write the status and timing of every task to. Defaults to None.
+        workers (int, optional): Maximum number of tasks running at the same time. Defaults to 4.
+        force (bool, optional): Whether to run all tasks regardless of the state. Defaults to False.
+    Returns:
+        dict[str, TaskRun]: The outcome of each task, in dependency order.
+    Throws:
+        ValueError: If the tasks do not form a DAG, see sort_tasks.
+        Exception: The first error of a failed task that is not optional.
+    '''
+    tasks = sort_tasks(tasks)
+    state = load_manifest(state_path)
+    state_lock = threading.Lock()
+    started_at = datetime.now(timezone.utc)
+    run_start = time.perf_counter()
+    runs, errors = {}, {}
+
+    def execute(task: Task, dep_results: dict, dep_keys: dict) -> TaskRun:
+        start = time.perf_counter()
+        key = hash_key({'key': task.key(), 'deps': dep_keys}) if task.key is not None else None
+        previous = state.get(task.name, {})
+        if key is not None and not force and previous.get('key') == key and (task.is_complete is None or task.is_complete(previous.get('result'))):
+            return TaskRun(task.name, 'skipped', previous.get('result'), key, start - run_start, time.perf_counter() - start)
+        result = task.function(dep_results)
+        elapsed = time.perf_counter() - start
+        if key is None:
+            key = hash_key(result)
+        with state_lock:
+            state[task.name] = {'key': key, 'result': result, 'elapsed_s': elapsed, 'finished_at': datetime.now(timezone.utc).isoformat()}
+            save_manifest(state_path, state)
+        return TaskRun(task.name, 'ran', result, key, start - run_start, elapsed)
+
+    def is_blocked(task: Task) -> bool:
+        return any(runs[dep].status == 'upstream_failed' or (runs[dep].status == 'failed' and not by_name[dep].optional) for dep in task.deps)
+
+    by_name = {task.name: task for task in tasks}
+    pending = list(tasks)
+    futures = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while pending or futures:
+            for task in list(pending):
+                if not all(dep in runs for dep in task.deps):
+                    continue
+                pending.remove(task)
+                if is_blocked(task):
+                    runs[task.name] = TaskRun(task.name, 'upstream_failed', start_s=time.perf_counter() - run_start)
+                    log_warning(f'Not running task {task.name}, a dependency failed')
+                    continue
+                dep_results = {dep: runs[dep].result for dep in task.deps}
+                # A failed optional dependency counts as absent, its key is added once it succeeds
+                dep_keys = {dep: runs[dep].key for dep in task.deps if runs[dep].status != 'failed'}
+                futures[executor.submit(execute, task, dep_results, dep_keys)] = (task, time.perf_counter())
+            if not futures:
+                # Only tasks blocked by failures were left, they were marked in the loop above
+                continue
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                task, submitted = futures.pop(future)
+                try:
+                    runs[task.name] = future.result()
+                    log_info(f'Task {task.name} {runs[task.name].status} in {runs[task.name].elapsed_s:.2f}s')
+                except Exception as e:
+                    errors[task.name] = e
+                    runs[task.name] = TaskRun(task.name, 'failed', start_s=submitted - run_start, elapsed_s=time.perf_counter() - submitted, error=f'{type(e).__name__}: {e}')
+                    log_error(f'Task {task.name} failed: {runs[task.name].error}')
+
+    runs = {task.name: runs[task.name] for task in tasks}
+    elapsed = time.perf_counter() - run_start
+    counts = {status: sum(run.status == status for run in runs.values()) for status in ['ran', 'skipped', 'failed', 'upstream_failed']}
+    log_info(f'Pipeline finished in {elapsed:.2f}s: {counts["ran"]} tasks ran, {counts["skipped"]} skipped, {counts["failed"]} failed, {counts["upstream_failed"]} not run')
+    if timings_path:
+        save_manifest(timings_path, {
+            'started_at': started_at.isoformat(),
+            'elapsed_s': elapsed,
+            'workers': workers,
+            'force': force,
+            'counts': counts,
+            'tasks': [{'name': run.name, 'status': run.status, 'start_s': run.start_s, 'elapsed_s': run.elapsed_s, 'error': run.error} for run in runs.values()],
+        })
+        log_info(f'Task timings saved to {timings_path}')
+    for name, error in errors.items():
+        if not by_name[name].optional:
+            raise error
+    return runs
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Declared types of the raw green taxi columns, as published in the TLC parquet files. Codes that can be missing are
+# doubles there, so CSV extracts convert to the same schema as the parquet files.
+TAXI_SCHEMA = pa.schema([
+    ('VendorID', pa.int32()),
+    ('lpep_pickup_datetime', pa.timestamp('us')),
+    ('lpep_dropoff_datetime', pa.timestamp('us')),
+    ('store_and_fwd_flag', pa.string()),
+    ('RatecodeID', pa.float64()),
+    ('PULocationID', pa.int32()),
+    ('DOLocationID', pa.int32()),
+    ('passenger_count', pa.float64()),
+    ('trip_distance', pa.float64()),
+    ('fare_amount', pa.float64()),
+    ('extra', pa.float64()),
+    ('mta_tax', pa.float64()),
+    ('tip_amount', pa.float64()),
+    ('tolls_amount', pa.float64()),
+    ('ehail_fee', pa.float64()),
+    ('improvement_surcharge', pa.float64()),
+    ('total_amount', pa.float64()),
+    ('payment_type', pa.float64()),
+    ('trip_type', pa.float64()),
+    ('congestion_surcharge', pa.float64()),
+])
+
+# Compact dtypes of the green taxi columns. Columns that are not listed keep their dtype.
+COMPACT_DTYPES = {
+    'VendorID': 'int8',
+    'store_and_fwd_flag': 'category',
+    'RatecodeID': 'int8',
+    'PULocationID': 'int16',
+    'DOLocationID': 'int16',
+    'passenger_count': 'int8',
+    'trip_distance': 'float32',
+    'fare_amount': 'float32',
+    'extra': 'float32',
+    'mta_tax': 'float32',
+    'tip_amount': 'float32',
+    'tolls_amount': 'float32',
+    'ehail_fee': 'float32',
+    'improvement_surcharge': 'float32',
+    'total_amount': 'float32',
+    'payment_type': 'int8',
+    'trip_type': 'int8',
+    'congestion_surcharge': 'float32',
+}
+
+ARROW_TYPES = {
+    'int8': pa.int8(),
+    'int16': pa.int16(),
+    'float32': pa.float32(),
+    'category': pa.dictionary(pa.int32(), pa.string()),
+}
+
+def get_compact_dtype(series: pd.Series, dtype: str) -> str:
+    '''
+    Returns the dtype a column can be stored in without losing information. Integer dtypes are only used if the
+    column has no missing values and all values are whole numbers within the range of the dtype, otherwise the
+    column falls back to float32.
+    Args:
+        series (pd.Series): The column.
+        dtype (str): The compact dtype from COMPACT_DTYPES.
+    Returns:
+        str: The dtype to cast the column to. Non-numeric columns keep their dtype unless the target is 'category'.
+    '''
+    if dtype == 'category':
+        return dtype
+    if not pd.api.types.is_numeric_dtype(series):
+        # e.g. an all-missing object column, leave it to the caller
+        return series.dtype
+    if not np.issubdtype(np.dtype(dtype), np.integer) or series.empty:
+        return dtype
+    if series.isna().any():
+        return 'float32'
+    values = series.to_numpy()
+    info = np.iinfo(dtype)
+    if values.min() < info.min or values.max() > info.max or not np.array_equal(values, np.round(values)):
+        return 'float32'
+    return dtype
+
+def compact_dtypes(df: pd.DataFrame, dtypes: dict = COMPACT_DTYPES) -> pd.DataFrame:
+    '''
+    Downcasts the known taxi columns of a dataframe to compact dtypes.
+    Args:
+        df (pd.DataFrame): The taxi trip data.
+        dtypes (dict, optional): Compact dtype per column. Defaults to COMPACT_DTYPES.
+    Returns:
+        pd.DataFrame: The data with compact dtypes. Columns that already have the target dtype are not copied.
+    '''
+    casts = {}
+    for column, dtype in dtypes.items():
+        if column in df.columns:
+            compact_dtype = get_compact_dtype(df[column], dtype)
+            if df[column].dtype != compact_dtype:
+                casts[column] = compact_dtype
+    return df.astype(casts, copy=False) if casts else df
+
+def compact_arrow_schema(schema: pa.Schema, dtypes: dict = COMPACT_DTYPES) -> pa.Schema:
+    '''
+    Returns the Arrow schema with the known taxi columns replaced by compact types. Arrow integers are nullable, so
+    missing values do not require a float fallback.
+    Args:
+        schema (pa.Schema): The schema of the raw or processed data.
+        dtypes (dict, optional): Compact dtype per column. Defaults to COMPACT_DTYPES.
+    Returns:
+        pa.Schema: The compact schema.
+    '''
+    fields = []
+    for arrow_field in schema:
+        if arrow_field.name in dtypes:
+            arrow_field = arrow_field.with_type(ARROW_TYPES[dtypes[arrow_field.name]])
+        fields.append(arrow_field)
+    return pa.schema(fields)
+
+def get_memory_usage(df: pd.DataFrame) -> int:
+    '''
+    Returns the resident size of a dataframe in bytes, including the contents of object columns.
+    Args:
+        df (pd.DataFrame): The dataframe.
+    Returns:
+        int: The size in bytes.
+    '''
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+def format_memory_saving(bytes_before: int, bytes_after: int) -> str:
+    '''
+    Formats the memory saved by compacting a dataframe, e.g. '24.1 MiB -> 6.2 MiB (3.9x smaller)'.
+    Args:
+        bytes_before (int): Size before compacting.
+        bytes_after (int): Size after compacting.
+    Returns:
+        str: The formatted saving.
+    '''
+    ratio = bytes_before / bytes_after if bytes_after else float('inf')
+    return f'{bytes_before / 2**20:.1f} MiB -> {bytes_after / 2**20:.1f} MiB ({ratio:.1f}x smaller)'